@@ -16,17 +16,23 @@ Provides:
 
 from __future__ import annotations
 
+import atexit
 import fcntl
 import ipaddress
 import json
 import os
+import queue
 import re
 import sqlite3
 import threading
 import time
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import shutil
+import socket
 import hashlib
+import struct
+import zlib
 from contextlib import contextmanager
 from urllib.parse import quote
 
@@ -155,6 +161,20 @@ ANALYTICS_LOG_FILE_DOWNLOADS = parse_bool(os.environ.get("DROPPR_ANALYTICS_LOG_F
 ANALYTICS_LOG_ZIP_DOWNLOADS = parse_bool(os.environ.get("DROPPR_ANALYTICS_LOG_ZIP_DOWNLOADS", "true"))
 ANALYTICS_IP_MODE = (os.environ.get("DROPPR_ANALYTICS_IP_MODE", "full") or "full").strip().lower()
 ANALYTICS_DB_TIMEOUT_SECONDS = float(os.environ.get("DROPPR_ANALYTICS_DB_TIMEOUT_SECONDS", "30"))
+# Events are queued in-process and written by one background thread per worker, in one transaction per flush.
+ANALYTICS_QUEUE_MAX = int(os.environ.get("DROPPR_ANALYTICS_QUEUE_MAX", "10000"))
+ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get("DROPPR_ANALYTICS_FLUSH_INTERVAL_SECONDS", "1"))
+ANALYTICS_FLUSH_MAX_ROWS = int(os.environ.get("DROPPR_ANALYTICS_FLUSH_MAX_ROWS", "1000"))
+# Events folded into the dashboard rollups per write transaction (bounds the catch-up on existing data).
+ANALYTICS_ROLLUP_BATCH_ROWS = int(os.environ.get("DROPPR_ANALYTICS_ROLLUP_BATCH_ROWS", "20000"))
+# Retention runs in the background, deleting expired rows in small batches so the write lock is held briefly.
+ANALYTICS_RETENTION_INTERVAL_SECONDS = int(os.environ.get("DROPPR_ANALYTICS_RETENTION_INTERVAL_SECONDS", "3600"))
+ANALYTICS_RETENTION_BATCH_ROWS = int(os.environ.get("DROPPR_ANALYTICS_RETENTION_BATCH_ROWS", "5000"))
+ANALYTICS_RETENTION_PAUSE_SECONDS = float(os.environ.get("DROPPR_ANALYTICS_RETENTION_PAUSE_SECONDS", "0.2"))
+# Switch the database to auto_vacuum=INCREMENTAL (one full VACUUM on first start) and hand freed pages
+# back to the filesystem after each retention run, ANALYTICS_VACUUM_PAGES at a time.
+ANALYTICS_INCREMENTAL_VACUUM = parse_bool(os.environ.get("DROPPR_ANALYTICS_INCREMENTAL_VACUUM", "false"))
+ANALYTICS_VACUUM_PAGES = int(os.environ.get("DROPPR_ANALYTICS_VACUUM_PAGES", "2000"))
 
 ALIASES_DB_PATH = os.environ.get("DROPPR_ALIASES_DB_PATH", "/database/droppr-aliases.sqlite3")
 ALIASES_DB_TIMEOUT_SECONDS = float(os.environ.get("DROPPR_ALIASES_DB_TIMEOUT_SECONDS", "30"))
@@ -162,10 +182,14 @@ ALIASES_DB_TIMEOUT_SECONDS = float(os.environ.get("DROPPR_ALIASES_DB_TIMEOUT_SEC
 VIDEO_META_DB_PATH = os.environ.get("DROPPR_VIDEO_META_DB_PATH", "/database/droppr-video-meta.sqlite3")
 VIDEO_META_DB_TIMEOUT_SECONDS = float(os.environ.get("DROPPR_VIDEO_META_DB_TIMEOUT_SECONDS", "10"))
 
+TRANSCODE_DB_PATH = os.environ.get("DROPPR_TRANSCODE_DB_PATH", "/database/droppr-transcode.sqlite3")
+TRANSCODE_DB_TIMEOUT_SECONDS = float(os.environ.get("DROPPR_TRANSCODE_DB_TIMEOUT_SECONDS", "30"))
+
 _last_retention_sweep_at: float = 0.0
 _analytics_db_ready: bool = False
 _aliases_db_ready: bool = False
 _video_meta_db_ready: bool = False
+_transcode_db_ready: bool = False
 
 
 def _get_client_ip() -> str | None:
@@ -247,6 +271,10 @@ def _init_analytics_db() -> None:
     conn.execute("PRAGMA busy_timeout=5000;")
     conn.execute("PRAGMA foreign_keys=ON;")
     try:
+        if ANALYTICS_INCREMENTAL_VACUUM and int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) != 2:
+            # Takes effect on an existing file only after a VACUUM; runs once, under the init lock.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS download_events (
@@ -268,6 +296,40 @@ def _init_analytics_db() -> None:
             "CREATE INDEX IF NOT EXISTS idx_download_events_created_at ON download_events(created_at)"
         )
         conn.execute("CREATE INDEX IF NOT EXISTS idx_download_events_ip ON download_events(ip)")
+        # Dashboard rollups: event counts and distinct download IPs per hour/day bucket (UTC, bucket = start time),
+        # built from download_events rows up to the `events_id` watermark.
+        for grain in ("hourly", "daily"):
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS analytics_rollup_{grain} (
+                    bucket INTEGER NOT NULL,
+                    share_hash TEXT NOT NULL,
+                    event_type TEXT NOT NULL,
+                    events INTEGER NOT NULL,
+                    last_at INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, share_hash, event_type)
+                )
+                """
+            )
+            conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS analytics_rollup_ips_{grain} (
+                    bucket INTEGER NOT NULL,
+                    share_hash TEXT NOT NULL,
+                    ip TEXT NOT NULL,
+                    PRIMARY KEY (bucket, share_hash, ip)
+                )
+                """
+            )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analytics_rollup_state (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO analytics_rollup_state (name, value) VALUES ('events_id', 0)")
     finally:
         conn.close()
 
@@ -493,6 +555,200 @@ def _video_meta_conn():
         conn.close()
 
 
+def _ensure_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    existing = {str(row["name"]) for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _init_transcode_db() -> None:
+    db_dir = os.path.dirname(TRANSCODE_DB_PATH)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+
+    conn = sqlite3.connect(
+        TRANSCODE_DB_PATH,
+        timeout=TRANSCODE_DB_TIMEOUT_SECONDS,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA busy_timeout=5000;")
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transcode_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                share_hash TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                size INTEGER,
+                modified TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at INTEGER,
+                error TEXT,
+                created_at INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL,
+                started_at INTEGER,
+                finished_at INTEGER
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transcode_jobs_status_created_at ON transcode_jobs(status, created_at)"
+        )
+        _ensure_columns(
+            conn,
+            "transcode_jobs",
+            {
+                "duration": "REAL",
+                "progress_seconds": "REAL",
+                "speed": "REAL",
+                "priority": "INTEGER NOT NULL DEFAULT 0",
+                "protected": "INTEGER NOT NULL DEFAULT 0",
+                "last_interest_at": "INTEGER",
+                "content_id": "TEXT",
+            },
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_transcode_jobs_status_priority
+            ON transcode_jobs(status, priority DESC, created_at)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS proxy_cache_entries (
+                cache_key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                share_hash TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                output_size INTEGER,
+                strategy TEXT,
+                reason TEXT,
+                created_at INTEGER NOT NULL
+            )
+            """
+        )
+        _ensure_columns(
+            conn,
+            "proxy_cache_entries",
+            {
+                "profile": "TEXT",
+                "last_access_at": "INTEGER",
+            },
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_proxy_cache_entries_last_access
+            ON proxy_cache_entries(last_access_at)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS source_identity (
+                share_hash TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                modified TEXT NOT NULL,
+                content_id TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (share_hash, file_path, size, modified)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_source_identity_content_id ON source_identity(content_id)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS zip_artifacts (
+                share_hash TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                size INTEGER,
+                built_at INTEGER,
+                last_access_at INTEGER NOT NULL,
+                PRIMARY KEY (share_hash, etag)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS zip_file_crcs (
+                share_hash TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                modified TEXT NOT NULL,
+                crc32 INTEGER NOT NULL,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (share_hash, file_path, size, modified)
+            )
+            """
+        )
+    finally:
+        conn.close()
+
+
+def _ensure_transcode_db() -> None:
+    global _transcode_db_ready
+
+    if _transcode_db_ready:
+        return
+
+    db_dir = os.path.dirname(TRANSCODE_DB_PATH)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+
+    lock_path = f"{TRANSCODE_DB_PATH}.init.lock"
+    lock_file = open(lock_path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        for attempt in range(10):
+            try:
+                _init_transcode_db()
+                _transcode_db_ready = True
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e).lower() and attempt < 9:
+                    time.sleep(0.05 * (attempt + 1))
+                    continue
+                app.logger.warning("Transcode db init failed: %s", e)
+                return
+            except Exception as e:
+                app.logger.warning("Transcode db init failed: %s", e)
+                return
+    finally:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
+
+@contextmanager
+def _transcode_conn():
+    _ensure_transcode_db()
+
+    conn = sqlite3.connect(
+        TRANSCODE_DB_PATH,
+        timeout=TRANSCODE_DB_TIMEOUT_SECONDS,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA busy_timeout=5000;")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
 MAX_ALIAS_DEPTH = 10
 
 
@@ -571,22 +827,188 @@ def _list_share_aliases(*, limit: int = 500) -> list[dict]:
     return result
 
 
-def _maybe_apply_retention(conn: sqlite3.Connection) -> None:
-    global _last_retention_sweep_at
+_analytics_retention_lock = threading.Lock()
 
-    if ANALYTICS_RETENTION_DAYS <= 0:
-        return
 
-    now = time.time()
-    if now - _last_retention_sweep_at < 3600:
-        return
+def _delete_in_batches(sql: str, params: tuple) -> int:
+    """Repeat a `DELETE ... LIMIT`-style statement (batch size as its last parameter) until it deletes nothing.
 
+    Each batch is its own short transaction, with a pause between batches so event writes get the lock.
+    """
+    deleted = 0
+    batch = max(1, ANALYTICS_RETENTION_BATCH_ROWS)
+    while True:
+        with _analytics_conn() as conn:
+            count = conn.execute(sql, (*params, batch)).rowcount
+        deleted += max(0, count)
+        if count < batch:
+            return deleted
+        time.sleep(max(0.0, ANALYTICS_RETENTION_PAUSE_SECONDS))
+
+
+def _run_analytics_retention(now: float) -> dict:
     cutoff = int(now - (ANALYTICS_RETENTION_DAYS * 86400))
-    try:
-        conn.execute("DELETE FROM download_events WHERE created_at < ?", (cutoff,))
-    finally:
+    report = {"cutoff": cutoff, "events_deleted": 0, "rollups_deleted": 0, "pages_vacuumed": 0}
+
+    report["events_deleted"] = _delete_in_batches(
+        """
+        DELETE FROM download_events
+        WHERE id IN (SELECT id FROM download_events WHERE created_at < ? ORDER BY created_at LIMIT ?)
+        """,
+        (cutoff,),
+    )
+    # Only buckets that end before the cutoff; a bucket straddling it keeps its counts until it is fully expired.
+    for grain, seconds in _ANALYTICS_ROLLUP_GRAINS:
+        for table in (f"analytics_rollup_{grain}", f"analytics_rollup_ips_{grain}"):
+            report["rollups_deleted"] += _delete_in_batches(
+                f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE bucket <= ? LIMIT ?)",
+                (cutoff - seconds,),
+            )
+
+    if ANALYTICS_INCREMENTAL_VACUUM:
+        while True:
+            with _analytics_conn() as conn:
+                if int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) != 2:
+                    break
+                free_before = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+                if not free_before:
+                    break
+                conn.execute(f"PRAGMA incremental_vacuum({max(1, ANALYTICS_VACUUM_PAGES)})").fetchall()
+                freed = free_before - int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+            report["pages_vacuumed"] += max(0, freed)
+            if freed <= 0:
+                break
+            time.sleep(max(0.0, ANALYTICS_RETENTION_PAUSE_SECONDS))
+    return report
+
+
+def _apply_analytics_retention(*, force: bool = False) -> dict | None:
+    """Run retention if it is due (or `force`); returns its report, or None if skipped."""
+    global _last_retention_sweep_at
+
+    if not ANALYTICS_ENABLED or ANALYTICS_RETENTION_DAYS <= 0:
+        return None
+
+    with _analytics_retention_lock:
+        now = time.time()
+        if not force and now - _last_retention_sweep_at < ANALYTICS_RETENTION_INTERVAL_SECONDS:
+            return None
         _last_retention_sweep_at = now
 
+        _ensure_analytics_db()
+        # One run at a time across the gunicorn workers; whoever loses the race just skips this round.
+        with open(f"{ANALYTICS_DB_PATH}.retention.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            report = _run_analytics_retention(now)
+
+    if report["events_deleted"] or report["rollups_deleted"] or report["pages_vacuumed"]:
+        app.logger.info("analytics retention: %s", report)
+    return report
+
+
+_ANALYTICS_ROLLUP_GRAINS = (("hourly", 3600), ("daily", 86400))
+_ANALYTICS_DOWNLOAD_TYPES_SQL = "('file_download', 'zip_download')"
+
+
+def _compact_analytics_rollups(conn: sqlite3.Connection, *, max_rows: int) -> int:
+    """Fold up to `max_rows` events past the watermark into the rollups; call inside a write transaction.
+
+    Returns how many events were folded in, so a caller catching up on a backlog knows when it is done.
+    """
+    watermark = int(
+        conn.execute("SELECT value FROM analytics_rollup_state WHERE name = 'events_id'").fetchone()["value"]
+    )
+    row = conn.execute(
+        """
+        SELECT COUNT(*) AS n, MAX(id) AS hi
+        FROM (SELECT id FROM download_events WHERE id > ? ORDER BY id LIMIT ?)
+        """,
+        (watermark, max(1, max_rows)),
+    ).fetchone()
+    if not row["n"]:
+        return 0
+
+    span = (watermark, int(row["hi"]))
+    for grain, seconds in _ANALYTICS_ROLLUP_GRAINS:
+        conn.execute(
+            f"""
+            INSERT INTO analytics_rollup_{grain} (bucket, share_hash, event_type, events, last_at)
+            SELECT created_at - created_at % {seconds}, share_hash, event_type, COUNT(*), MAX(created_at)
+            FROM download_events
+            WHERE id > ? AND id <= ?
+            GROUP BY 1, 2, 3
+            ON CONFLICT (bucket, share_hash, event_type) DO UPDATE SET
+                events = events + excluded.events,
+                last_at = MAX(last_at, excluded.last_at)
+            """,
+            span,
+        )
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO analytics_rollup_ips_{grain} (bucket, share_hash, ip)
+            SELECT DISTINCT created_at - created_at % {seconds}, share_hash, ip
+            FROM download_events
+            WHERE id > ? AND id <= ? AND ip IS NOT NULL AND event_type IN {_ANALYTICS_DOWNLOAD_TYPES_SQL}
+            """,
+            span,
+        )
+    conn.execute("UPDATE analytics_rollup_state SET value = ? WHERE name = 'events_id'", (span[1],))
+    return int(row["n"])
+
+
+def _analytics_rollup_source(conn: sqlite3.Connection, since: int, until: int, *, ips: bool = False) -> tuple[str, list]:
+    """Subquery (and params) covering events in `[since, until]`: whole days and hours from the rollups,
+    raw rows only for the partial hours at either end and for events not yet folded in.
+
+    Rows are `(share_hash, event_type, events, last_at)`, or `(share_hash, ip)` of downloads with `ips`.
+    """
+    watermark = int(
+        conn.execute("SELECT value FROM analytics_rollup_state WHERE name = 'events_id'").fetchone()["value"]
+    )
+    end = until + 1
+    hours_lo, hours_hi = -(-since // 3600) * 3600, end // 3600 * 3600
+    days_lo, days_hi = -(-since // 86400) * 86400, end // 86400 * 86400
+
+    segments: list[tuple[str, int, int]] = []
+    if hours_lo < hours_hi:
+        if days_lo < days_hi:
+            segments += [("hourly", hours_lo, days_lo), ("daily", days_lo, days_hi), ("hourly", days_hi, hours_hi)]
+        else:
+            segments.append(("hourly", hours_lo, hours_hi))
+        raw = [(since, hours_lo), (hours_hi, end)]
+    else:
+        raw = [(since, end)]
+
+    if ips:
+        columns, raw_columns = "share_hash, ip", "share_hash, ip"
+        raw_filter = f"ip IS NOT NULL AND event_type IN {_ANALYTICS_DOWNLOAD_TYPES_SQL} AND "
+    else:
+        columns = "share_hash, event_type, events, last_at"
+        raw_columns = "share_hash, event_type, 1 AS events, created_at AS last_at"
+        raw_filter = ""
+
+    parts, params = [], []
+    for grain, lo, hi in segments:
+        if lo < hi:
+            table = f"analytics_rollup_ips_{grain}" if ips else f"analytics_rollup_{grain}"
+            parts.append(f"SELECT {columns} FROM {table} WHERE bucket >= ? AND bucket < ?")
+            params += [lo, hi]
+
+    conditions = []
+    for lo, hi in raw:
+        if lo < hi:
+            conditions.append("(created_at >= ? AND created_at < ?)")
+            params += [lo, hi]
+    if hours_lo < hours_hi:
+        # `+` keeps SQLite on the rowid range (events past the watermark), not a scan of the covered span.
+        conditions.append("(id > ? AND +created_at >= ? AND +created_at < ?)")
+        params += [watermark, hours_lo, hours_hi]
+    parts.append(f"SELECT {raw_columns} FROM download_events WHERE {raw_filter}({' OR '.join(conditions) or '0'})")
+    return " UNION ALL ".join(parts), params
+
 
 def _should_log_event(event_type: str) -> bool:
     if not ANALYTICS_ENABLED:
@@ -600,7 +1022,22 @@ def _should_log_event(event_type: str) -> bool:
     return True
 
 
+_analytics_queue: queue.Queue = queue.Queue(maxsize=max(1, ANALYTICS_QUEUE_MAX))
+_analytics_writer_lock = threading.Lock()
+_analytics_flush_lock = threading.Lock()
+_analytics_writer_pid: int | None = None
+_analytics_dropped: int = 0
+# Assume a backlog of uncompacted events until this process has seen the rollups catch up.
+_analytics_rollup_backlog: bool = True
+
+
 def _log_event(event_type: str, share_hash: str, file_path: str | None = None) -> None:
+    """Queue an analytics event for the background writer; never touches the database on the request path.
+
+    When the queue is full the event is dropped and counted rather than making the request wait.
+    """
+    global _analytics_dropped
+
     if not _should_log_event(event_type):
         return
 
@@ -609,26 +1046,128 @@ def _log_event(event_type: str, share_hash: str, file_path: str | None = None) -
     referer = request.headers.get("Referer")
     created_at = int(time.time())
 
+    _ensure_analytics_writer()
+    try:
+        _analytics_queue.put_nowait((share_hash, event_type, file_path, ip, user_agent, referer, created_at))
+    except queue.Full:
+        with _analytics_writer_lock:
+            _analytics_dropped += 1
+
+
+def _write_analytics_events(rows: list[tuple]) -> None:
+    """Insert `rows` and fold them (plus any backlog, up to a batch) into the rollups, in one transaction.
+
+    With no rows this only advances the rollups.
+    """
+    global _analytics_rollup_backlog
+
     for attempt in range(3):
         try:
             with _analytics_conn() as conn:
-                _maybe_apply_retention(conn)
-                conn.execute(
-                    """
-                    INSERT INTO download_events (share_hash, event_type, file_path, ip, user_agent, referer, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (share_hash, event_type, file_path, ip, user_agent, referer, created_at),
-                )
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if rows:
+                        conn.executemany(
+                            """
+                            INSERT INTO download_events (
+                                share_hash, event_type, file_path, ip, user_agent, referer, created_at
+                            )
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            """,
+                            rows,
+                        )
+                    folded = _compact_analytics_rollups(conn, max_rows=ANALYTICS_ROLLUP_BATCH_ROWS)
+                    conn.execute("COMMIT")
+                    _analytics_rollup_backlog = folded >= ANALYTICS_ROLLUP_BATCH_ROWS
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
             return
         except sqlite3.OperationalError as e:
             if "locked" not in str(e).lower() or attempt == 2:
-                app.logger.warning("Analytics logging failed: %s", e)
-                return
-            time.sleep(0.05 * (attempt + 1))
+                raise
+            time.sleep(0.2 * (attempt + 1))
+
+
+def _flush_analytics_events() -> int:
+    """Write every queued event, ANALYTICS_FLUSH_MAX_ROWS per transaction. Returns the number written.
+
+    Each call also folds at least one batch of a rollup backlog, so existing data is caught up a batch per tick.
+    """
+    global _analytics_dropped
+
+    written = 0
+    compacted = False
+    with _analytics_flush_lock:
+        while True:
+            rows = []
+            while len(rows) < max(1, ANALYTICS_FLUSH_MAX_ROWS):
+                try:
+                    rows.append(_analytics_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not rows and (compacted or not _analytics_rollup_backlog):
+                break
+            try:
+                _write_analytics_events(rows)
+                written += len(rows)
+                compacted = True
+            except Exception as e:
+                app.logger.warning("Analytics logging failed; dropping %d event(s): %s", len(rows), e)
+                with _analytics_writer_lock:
+                    _analytics_dropped += len(rows)
+                break
+
+    with _analytics_writer_lock:
+        dropped, _analytics_dropped = _analytics_dropped, 0
+    if dropped:
+        app.logger.warning("Analytics dropped %d event(s) (queue full or database unavailable)", dropped)
+    return written
+
+
+def _analytics_writer_loop() -> None:
+    while True:
+        time.sleep(max(0.05, ANALYTICS_FLUSH_INTERVAL_SECONDS))
+        try:
+            _flush_analytics_events()
+        except Exception as e:
+            app.logger.warning("Analytics writer failed: %s", e)
+
+
+def _analytics_retention_loop() -> None:
+    while True:
+        try:
+            _apply_analytics_retention()
         except Exception as e:
-            app.logger.warning("Analytics logging failed: %s", e)
+            app.logger.warning("Analytics retention failed: %s", e)
+        time.sleep(max(1, min(60, ANALYTICS_RETENTION_INTERVAL_SECONDS)))
+
+
+def _ensure_analytics_writer() -> None:
+    """Start this process's event writer and retention threads (once per process, so again after a fork)."""
+    global _analytics_writer_pid
+
+    pid = os.getpid()
+    if _analytics_writer_pid == pid:
+        return
+
+    with _analytics_writer_lock:
+        if _analytics_writer_pid == pid:
             return
+        threading.Thread(target=_analytics_writer_loop, daemon=True).start()
+        threading.Thread(target=_analytics_retention_loop, daemon=True).start()
+        _analytics_writer_pid = pid
+
+
+def _flush_analytics_events_at_exit() -> None:
+    # Only a process that started the writer can have queued events; others must not touch the DB on exit.
+    if not ANALYTICS_ENABLED or _analytics_writer_pid != os.getpid():
+        return
+    _flush_analytics_events()
+
+
+# Gunicorn workers exit through the interpreter on a graceful stop, so queued events are not lost.
+atexit.register(_flush_analytics_events_at_exit)
 
 
 def _get_auth_token() -> str | None:
@@ -808,6 +1347,7 @@ def _build_folder_share_file_list(*, request_hash: str, source_hash: str, root:
                 "type": _infer_gallery_type(item, ext),
                 "extension": ext,
                 "size": int(item.get("size") or 0),
+                "modified": item.get("modified") if isinstance(item.get("modified"), str) else None,
                 "inline_url": f"/api/public/dl/{source_hash}/{quote(rel_path, safe='/')}?inline=true",
                 "download_url": f"/api/share/{request_hash}/file/{quote(rel_path, safe='/')}?download=1",
             }
@@ -836,6 +1376,7 @@ def _build_file_share_file_list(*, request_hash: str, source_hash: str, meta: di
             "type": _infer_gallery_type(meta, ext),
             "extension": ext,
             "size": int(meta.get("size") or 0),
+            "modified": meta.get("modified") if isinstance(meta.get("modified"), str) else None,
             # NOTE: /api/public/dl/<hash> is redirected to /gallery/<hash> by nginx, so we expose
             # a separate nginx route that proxies to FileBrowser without redirect.
             "inline_url": f"/api/public/file/{source_hash}?inline=true",
@@ -935,14 +1476,37 @@ THUMB_FFMPEG_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_THUMB_FFMPEG_TIMEOUT_S
 THUMB_MAX_CONCURRENCY = int(os.environ.get("DROPPR_THUMB_MAX_CONCURRENCY", "2"))
 _thumb_sema = threading.BoundedSemaphore(max(1, THUMB_MAX_CONCURRENCY))
 
+# Embedded previews (EXIF thumbnail, HEIF thumbnail item, MP4 cover art) let us skip decoding the full media.
+THUMB_EMBEDDED_ENABLED = parse_bool(os.environ.get("DROPPR_THUMB_EMBEDDED_ENABLED", "true"))
+THUMB_EMBEDDED_MIN_SIZE = int(os.environ.get("DROPPR_THUMB_EMBEDDED_MIN_SIZE", "320"))
+THUMB_EMBEDDED_PROBE_BYTES = int(os.environ.get("DROPPR_THUMB_EMBEDDED_PROBE_BYTES", str(256 * 1024)))
+THUMB_EMBEDDED_MAX_BOX_BYTES = int(os.environ.get("DROPPR_THUMB_EMBEDDED_MAX_BOX_BYTES", str(8 * 1024 * 1024)))
+
+# Video posters decode keyframes only, picking the first non-black one within the scan window.
+POSTER_SCAN_SECONDS = float(os.environ.get("DROPPR_POSTER_SCAN_SECONDS", "4"))
+POSTER_MIN_LUMA = int(os.environ.get("DROPPR_POSTER_MIN_LUMA", "24"))
+
 PROXY_CACHE_DIR = os.environ.get("DROPPR_PROXY_CACHE_DIR", "/tmp/proxy-cache")
 os.makedirs(PROXY_CACHE_DIR, exist_ok=True)
 
 PROXY_MAX_CONCURRENCY = int(os.environ.get("DROPPR_PROXY_MAX_CONCURRENCY", "1"))
 _proxy_sema = threading.BoundedSemaphore(max(1, PROXY_MAX_CONCURRENCY))
 
-_background_lock = threading.Lock()
-_background_tasks: set[str] = set()
+# Durable transcode job queue (SQLite, shared by all gunicorn workers). Workers claim jobs through a lease
+# that they keep renewing; a job whose lease expires (worker crashed or was restarted) is picked up again.
+TRANSCODE_WORKERS = int(os.environ.get("DROPPR_TRANSCODE_WORKERS", "1"))
+TRANSCODE_JOB_LEASE_SECONDS = int(os.environ.get("DROPPR_TRANSCODE_JOB_LEASE_SECONDS", "120"))
+TRANSCODE_JOB_MAX_ATTEMPTS = int(os.environ.get("DROPPR_TRANSCODE_JOB_MAX_ATTEMPTS", "3"))
+TRANSCODE_JOB_RETRY_FAILED_AFTER_SECONDS = int(os.environ.get("DROPPR_TRANSCODE_JOB_RETRY_FAILED_AFTER_SECONDS", "600"))
+TRANSCODE_JOB_RETENTION_SECONDS = int(os.environ.get("DROPPR_TRANSCODE_JOB_RETENTION_SECONDS", str(7 * 86400)))
+TRANSCODE_WORKER_POLL_SECONDS = float(os.environ.get("DROPPR_TRANSCODE_WORKER_POLL_SECONDS", "2"))
+# Jobs running at once across every process sharing the queue DB (<= 0: no limit beyond worker threads).
+TRANSCODE_MAX_RUNNING = int(os.environ.get("DROPPR_TRANSCODE_MAX_RUNNING", "2"))
+TRANSCODE_PROGRESS_INTERVAL_SECONDS = float(os.environ.get("DROPPR_TRANSCODE_PROGRESS_INTERVAL_SECONDS", "2"))
+# Viewer-requested jobs nobody has polled for this long are cancelled (0 disables); prewarm jobs are exempt.
+TRANSCODE_ABANDON_GRACE_SECONDS = int(os.environ.get("DROPPR_TRANSCODE_ABANDON_GRACE_SECONDS", "180"))
+TRANSCODE_INTEREST_TOUCH_SECONDS = 5
+FFPROBE_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_FFPROBE_TIMEOUT_SECONDS", "30"))
 
 PROXY_MAX_DIMENSION = int(os.environ.get("DROPPR_PROXY_MAX_DIMENSION", "1280"))
 PROXY_H264_PRESET = os.environ.get("DROPPR_PROXY_H264_PRESET", "veryfast")
@@ -950,6 +1514,44 @@ PROXY_CRF = int(os.environ.get("DROPPR_PROXY_CRF", "28"))
 PROXY_AAC_BITRATE = os.environ.get("DROPPR_PROXY_AAC_BITRATE", "128k")
 PROXY_FFMPEG_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_PROXY_FFMPEG_TIMEOUT_SECONDS", "900"))
 PROXY_PROFILE_VERSION = os.environ.get("DROPPR_PROXY_PROFILE_VERSION", "1")
+# Encode fast proxies as fragmented MP4 first so `/proxy-live/` can stream the output while it grows.
+PROXY_LIVE_ENABLED = parse_bool(os.environ.get("DROPPR_PROXY_LIVE_ENABLED", "true"))
+PROXY_LIVE_IDLE_TIMEOUT_SECONDS = float(os.environ.get("DROPPR_PROXY_LIVE_IDLE_TIMEOUT_SECONDS", "30"))
+PROXY_LIVE_WAIT_SECONDS = float(os.environ.get("DROPPR_PROXY_LIVE_WAIT_SECONDS", "10"))
+PROXY_LIVE_CHUNK_SIZE = 256 * 1024
+# Encode the opening seconds as a standalone clip ahead of the full proxy, so playback can start right away.
+PREVIEW_CLIP_ENABLED = parse_bool(os.environ.get("DROPPR_PREVIEW_CLIP_ENABLED", "true"))
+PREVIEW_CLIP_SECONDS = int(os.environ.get("DROPPR_PREVIEW_CLIP_SECONDS", "20"))
+# Shorter sources get no clip: their full proxy is ready about as quickly.
+PREVIEW_CLIP_MIN_SOURCE_SECONDS = int(os.environ.get("DROPPR_PREVIEW_CLIP_MIN_SOURCE_SECONDS", "120"))
+PREVIEW_CLIP_FFMPEG_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_PREVIEW_CLIP_FFMPEG_TIMEOUT_SECONDS", "120"))
+
+# Proxy cache manager: byte quota with LRU eviction (0 disables the quota), plus cleanup of temp files,
+# renditions of expired shares and renditions made with an old encoding profile.
+PROXY_CACHE_MAX_BYTES = int(os.environ.get("DROPPR_PROXY_CACHE_MAX_BYTES", "0"))
+PROXY_CACHE_SWEEP_SECONDS = int(os.environ.get("DROPPR_PROXY_CACHE_SWEEP_SECONDS", "600"))
+PROXY_CACHE_ORPHAN_SECONDS = int(os.environ.get("DROPPR_PROXY_CACHE_ORPHAN_SECONDS", "3600"))
+PROXY_CACHE_MIN_IDLE_SECONDS = int(os.environ.get("DROPPR_PROXY_CACHE_MIN_IDLE_SECONDS", "600"))
+# Renditions with no index row (made before the index, or under a retired cache-key scheme) and not viewed
+# since are removed once their file is older than this.
+PROXY_CACHE_UNINDEXED_GRACE_SECONDS = int(os.environ.get("DROPPR_PROXY_CACHE_UNINDEXED_GRACE_SECONDS", str(86400)))
+PROXY_CACHE_TOUCH_INTERVAL_SECONDS = 60
+
+# Prefetch: pre-generate renditions for the videos with the most recent gallery views / downloads,
+# only while the host is quiet and the cache has room.
+PREFETCH_ENABLED = parse_bool(os.environ.get("DROPPR_PREFETCH_ENABLED", "true"))
+PREFETCH_INTERVAL_SECONDS = int(os.environ.get("DROPPR_PREFETCH_INTERVAL_SECONDS", "300"))
+PREFETCH_WINDOW_HOURS = float(os.environ.get("DROPPR_PREFETCH_WINDOW_HOURS", "72"))
+PREFETCH_HALF_LIFE_HOURS = float(os.environ.get("DROPPR_PREFETCH_HALF_LIFE_HOURS", "24"))
+PREFETCH_TOP_N = int(os.environ.get("DROPPR_PREFETCH_TOP_N", "20"))
+PREFETCH_BATCH = int(os.environ.get("DROPPR_PREFETCH_BATCH", "2"))
+PREFETCH_HD = parse_bool(os.environ.get("DROPPR_PREFETCH_HD", "false"))
+# 1-minute load average per CPU above which nothing new is queued.
+PREFETCH_MAX_LOAD = float(os.environ.get("DROPPR_PREFETCH_MAX_LOAD", "0.5"))
+# Stop prefetching once indexed renditions reach this many bytes (0 = no limit); defaults to 80% of the quota.
+PREFETCH_MAX_CACHE_BYTES = int(os.environ.get("DROPPR_PREFETCH_MAX_CACHE_BYTES", str(PROXY_CACHE_MAX_BYTES * 4 // 5)))
+PREFETCH_MIN_FREE_BYTES = int(os.environ.get("DROPPR_PREFETCH_MIN_FREE_BYTES", str(5 * 1024 * 1024 * 1024)))
+PREFETCH_DOWNLOAD_WEIGHT = 3.0
 
 HD_MAX_CONCURRENCY = int(os.environ.get("DROPPR_HD_MAX_CONCURRENCY", "1"))
 _hd_sema = threading.BoundedSemaphore(max(1, HD_MAX_CONCURRENCY))
@@ -961,6 +1563,23 @@ HD_AAC_BITRATE = os.environ.get("DROPPR_HD_AAC_BITRATE", "192k")
 HD_FFMPEG_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_HD_FFMPEG_TIMEOUT_SECONDS", "1800"))
 HD_PROFILE_VERSION = os.environ.get("DROPPR_HD_PROFILE_VERSION", "1")
 
+# HLS ladder: comma-separated `<max dimension>:<video bitrate>` rungs, highest first.
+HLS_LADDER = os.environ.get("DROPPR_HLS_LADDER", "1920:6000k,1280:3000k,854:1200k")
+HLS_SEGMENT_SECONDS = int(os.environ.get("DROPPR_HLS_SEGMENT_SECONDS", "4"))
+HLS_H264_PRESET = os.environ.get("DROPPR_HLS_H264_PRESET", "veryfast")
+HLS_AAC_BITRATE = os.environ.get("DROPPR_HLS_AAC_BITRATE", "128k")
+HLS_FFMPEG_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_HLS_FFMPEG_TIMEOUT_SECONDS", "3600"))
+HLS_PROFILE_VERSION = os.environ.get("DROPPR_HLS_PROFILE_VERSION", "1")
+HLS_CACHE_DIR = os.path.join(PROXY_CACHE_DIR, "hls")
+os.makedirs(HLS_CACHE_DIR, exist_ok=True)
+
+# HD transcodes of sources at least this long (0 disables) are split at keyframes and the chunks encoded in parallel.
+TRANSCODE_CHUNKED_MIN_SECONDS = float(os.environ.get("DROPPR_TRANSCODE_CHUNKED_MIN_SECONDS", "600"))
+TRANSCODE_CHUNK_SECONDS = float(os.environ.get("DROPPR_TRANSCODE_CHUNK_SECONDS", "120"))
+TRANSCODE_CHUNK_PARALLELISM = int(
+    os.environ.get("DROPPR_TRANSCODE_CHUNK_PARALLELISM", str(max(1, (os.cpu_count() or 1) // 2)))
+)
+
 def _get_cache_path(share_hash: str, filename: str) -> str:
     # Create a safe unique filename for the cache
     unique_str = f"{share_hash}:{filename}"
@@ -968,6 +1587,31 @@ def _get_cache_path(share_hash: str, filename: str) -> str:
     return os.path.join(CACHE_DIR, f"{hashed_name}.jpg")
 
 
+def _poster_meta_path(share_hash: str, filename: str) -> str:
+    return _get_cache_path(share_hash, filename)[: -len(".jpg")] + ".poster.json"
+
+
+def _get_poster_time(share_hash: str, filename: str) -> float | None:
+    try:
+        with open(_poster_meta_path(share_hash, filename), "r") as f:
+            data = json.load(f)
+        value = float(data.get("time"))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return None
+    return value if value >= 0 else None
+
+
+def _record_poster_time(share_hash: str, filename: str, poster_time: float) -> None:
+    path = _poster_meta_path(share_hash, filename)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"time": round(poster_time, 3), "recorded_at": int(time.time())}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        app.logger.warning("Failed to record poster time for %s: %s", filename, e)
+
+
 def _ffmpeg_thumbnail_cmd(*, src_url: str, dst_path: str, seek_seconds: int | None) -> list[str]:
     cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-threads", "1"]
     if seek_seconds is not None:
@@ -991,60 +1635,1466 @@ def _ffmpeg_thumbnail_cmd(*, src_url: str, dst_path: str, seek_seconds: int | No
     return cmd
 
 
-def _proxy_cache_key(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
-    # Cache key is stable across requests and invalidates when the source changes or encoding profile changes.
-    mod = (modified or "").strip()
-    key = f"proxy:{PROXY_PROFILE_VERSION}:{PROXY_MAX_DIMENSION}:{PROXY_CRF}:{PROXY_H264_PRESET}:{share_hash}:{file_path}:{size}:{mod}"
-    return hashlib.sha256(key.encode()).hexdigest()
-
-
-def _hd_cache_key(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
-    mod = (modified or "").strip()
-    key = f"hd:{HD_PROFILE_VERSION}:{HD_MAX_DIMENSION}:{HD_CRF}:{HD_H264_PRESET}:{share_hash}:{file_path}:{size}:{mod}"
-    return hashlib.sha256(key.encode()).hexdigest()
-
+def _ffmpeg_poster_cmd(
+    *, src_url: str, dst_path: str, seek_seconds: float | None, stats_path: str | None = None
+) -> list[str]:
+    # `-skip_frame nokey` makes the decoder drop everything except keyframes, so we never decode a
+    # full GOP. With `stats_path`, scan the first POSTER_SCAN_SECONDS for the first non-black keyframe
+    # and write its timestamp; otherwise take the keyframe at (or just before) `seek_seconds`.
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-threads", "1", "-skip_frame", "nokey"]
+    if seek_seconds is not None:
+        cmd += ["-ss", f"{seek_seconds:.3f}", "-noaccurate_seek"]
+    if stats_path:
+        cmd += ["-t", str(POSTER_SCAN_SECONDS)]
+
+    vf = f"scale='min({THUMB_MAX_WIDTH},iw)':-2"
+    if stats_path:
+        vf += (
+            f",signalstats,metadata=mode=select:key=lavfi.signalstats.YAVG:value={POSTER_MIN_LUMA}:function=greater"
+            f",metadata=mode=print:key=lavfi.signalstats.YAVG:file={stats_path}"
+        )
 
-def _ffmpeg_proxy_cmd(*, src_url: str, dst_path: str) -> list[str]:
-    # Cap the longer side to PROXY_MAX_DIMENSION while preserving aspect ratio.
-    scale = (
-        f"scale='if(gt(iw,ih),min({PROXY_MAX_DIMENSION},iw),-2)':'if(gt(iw,ih),-2,min({PROXY_MAX_DIMENSION},ih))'"
-    )
-    return [
-        "ffmpeg",
-        "-hide_banner",
-        "-nostdin",
-        "-loglevel",
-        "error",
-        "-y",
+    cmd += [
         "-i",
         src_url,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
-        "-sn",
+        "-frames:v",
+        "1",
         "-vf",
-        scale,
-        "-c:v",
-        "libx264",
-        "-preset",
-        PROXY_H264_PRESET,
+        vf,
+        "-q:v",
+        str(THUMB_JPEG_QUALITY),
+        "-f",
+        "image2",
+        "-update",
+        "1",
+        "-y",
+        dst_path,
+    ]
+    return cmd
+
+
+def _read_poster_stats_time(stats_path: str) -> float | None:
+    try:
+        with open(stats_path, "r") as f:
+            match = re.search(r"pts_time:(-?[0-9.]+)", f.read())
+    except OSError:
+        return None
+    if not match:
+        return None
+    try:
+        return max(0.0, float(match.group(1)))
+    except ValueError:
+        return None
+
+
+def _extract_video_poster(*, share_hash: str, filename: str, src_url: str, dst_path: str) -> bool:
+    recorded = _get_poster_time(share_hash, filename)
+    if recorded is not None:
+        cmd = _ffmpeg_poster_cmd(src_url=src_url, dst_path=dst_path, seek_seconds=recorded)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=THUMB_FFMPEG_TIMEOUT_SECONDS)
+        if result.returncode == 0 and os.path.exists(dst_path):
+            return True
+
+    stats_path = dst_path + ".stats"
+    try:
+        cmd = _ffmpeg_poster_cmd(src_url=src_url, dst_path=dst_path, seek_seconds=None, stats_path=stats_path)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=THUMB_FFMPEG_TIMEOUT_SECONDS)
+        poster_time = _read_poster_stats_time(stats_path)
+    finally:
+        try:
+            os.remove(stats_path)
+        except OSError:
+            pass
+
+    if result.returncode == 0 and os.path.exists(dst_path):
+        _record_poster_time(share_hash, filename, poster_time or 0.0)
+        return True
+
+    # Every keyframe in the scan window was black (or the window was empty): use the first keyframe.
+    cmd = _ffmpeg_poster_cmd(src_url=src_url, dst_path=dst_path, seek_seconds=None)
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=THUMB_FFMPEG_TIMEOUT_SECONDS)
+    if result.returncode == 0 and os.path.exists(dst_path):
+        _record_poster_time(share_hash, filename, 0.0)
+        return True
+    return False
+
+
+def _fetch_source_range(src_url: str, start: int, length: int) -> bytes | None:
+    if start < 0 or length <= 0:
+        return None
+
+    headers = {"Range": f"bytes={start}-{start + length - 1}"}
+    with requests.get(src_url, headers=headers, stream=True, timeout=10) as resp:
+        if resp.status_code == 206:
+            return resp.content[:length]
+        if resp.status_code == 200 and start == 0:
+            # Upstream ignored the Range header; read only what we asked for.
+            buf = bytearray()
+            for chunk in resp.iter_content(chunk_size=65536):
+                buf += chunk
+                if len(buf) >= length:
+                    break
+            return bytes(buf[:length])
+    return None
+
+
+def _iter_jpeg_segments(data: bytes):
+    if data[:2] != b"\xff\xd8":
+        return
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            pos += 2
+            continue
+        if marker in {0xD9, 0xDA}:
+            return
+        seg_len = struct.unpack(">H", data[pos + 2 : pos + 4])[0]
+        if seg_len < 2:
+            return
+        yield marker, data[pos + 4 : pos + 2 + seg_len]
+        pos += 2 + seg_len
+
+
+def _jpeg_dimensions(data: bytes) -> tuple[int, int] | None:
+    for marker, payload in _iter_jpeg_segments(data):
+        if marker in {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}:
+            if len(payload) < 5:
+                return None
+            height, width = struct.unpack(">HH", payload[1:5])
+            return width, height
+    return None
+
+
+def _png_dimensions(data: bytes) -> tuple[int, int] | None:
+    if data[:8] != b"\x89PNG\r\n\x1a\n" or data[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", data[16:24])
+    return width, height
+
+
+def _read_tiff_ifd(tiff: bytes, offset: int, endian: str) -> tuple[dict[int, tuple[int, bytes]], int]:
+    entries: dict[int, tuple[int, bytes]] = {}
+    if offset <= 0 or offset + 2 > len(tiff):
+        return entries, 0
+
+    count = struct.unpack(endian + "H", tiff[offset : offset + 2])[0]
+    pos = offset + 2
+    for _ in range(count):
+        if pos + 12 > len(tiff):
+            return entries, 0
+        tag, typ = struct.unpack(endian + "HH", tiff[pos : pos + 4])
+        entries[tag] = (typ, tiff[pos + 8 : pos + 12])
+        pos += 12
+
+    next_offset = struct.unpack(endian + "I", tiff[pos : pos + 4])[0] if pos + 4 <= len(tiff) else 0
+    return entries, next_offset
+
+
+def _tiff_int(entry: tuple[int, bytes] | None, endian: str) -> int | None:
+    if entry is None:
+        return None
+    typ, raw = entry
+    if typ == 3:  # SHORT
+        return struct.unpack(endian + "H", raw[:2])[0]
+    if typ == 4:  # LONG
+        return struct.unpack(endian + "I", raw)[0]
+    return None
+
+
+_EXIF_ORIENTATION_FILTERS = {
+    2: ["hflip"],
+    3: ["hflip", "vflip"],
+    4: ["vflip"],
+    5: ["transpose=0"],
+    6: ["transpose=1"],
+    7: ["transpose=3"],
+    8: ["transpose=2"],
+}
+
+# HEIF `irot` stores anti-clockwise rotation in 90 degree steps.
+_HEIF_IROT_FILTERS = {
+    1: ["transpose=2"],
+    2: ["hflip", "vflip"],
+    3: ["transpose=1"],
+}
+
+
+def _extract_exif_thumbnail(head: bytes) -> dict | None:
+    for marker, payload in _iter_jpeg_segments(head):
+        if marker != 0xE1 or not payload.startswith(b"Exif\x00\x00"):
+            continue
+
+        tiff = payload[6:]
+        if tiff[:2] == b"II":
+            endian = "<"
+        elif tiff[:2] == b"MM":
+            endian = ">"
+        else:
+            return None
+        if len(tiff) < 8 or struct.unpack(endian + "H", tiff[2:4])[0] != 42:
+            return None
+
+        ifd0, ifd1_offset = _read_tiff_ifd(tiff, struct.unpack(endian + "I", tiff[4:8])[0], endian)
+        ifd1, _ = _read_tiff_ifd(tiff, ifd1_offset, endian)
+        thumb_offset = _tiff_int(ifd1.get(0x0201), endian)
+        thumb_length = _tiff_int(ifd1.get(0x0202), endian)
+        if not thumb_offset or not thumb_length or thumb_offset + thumb_length > len(tiff):
+            return None
+
+        data = tiff[thumb_offset : thumb_offset + thumb_length]
+        dims = _jpeg_dimensions(data)
+        if not dims:
+            return None
+
+        orientation = _tiff_int(ifd0.get(0x0112), endian) or 1
+        return {
+            "codec": "jpeg",
+            "data": data,
+            "width": dims[0],
+            "height": dims[1],
+            "filters": list(_EXIF_ORIENTATION_FILTERS.get(orientation, [])),
+        }
+    return None
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: int | None = None):
+    end = len(data) if end is None else min(end, len(data))
+    pos = start
+    while pos + 8 <= end:
+        size, raw_type = struct.unpack(">I4s", data[pos : pos + 8])
+        header_size = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack(">Q", data[pos + 8 : pos + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            return
+        yield raw_type.decode("latin-1"), pos + header_size, pos + size
+        pos += size
+
+
+def _child_boxes(data: bytes) -> dict[str, bytes]:
+    children: dict[str, bytes] = {}
+    for box_type, payload_start, box_end in _iter_boxes(data):
+        children.setdefault(box_type, data[payload_start:box_end])
+    return children
+
+
+def _fetch_top_level_box(src_url: str, box_type: str, head: bytes) -> bytes | None:
+    # Walk top-level boxes with small range reads (skipping over `mdat`) until `box_type` is found.
+    # Returns the box payload (without its header).
+    pos = 0
+    for _ in range(64):
+        header = head[pos : pos + 16] if pos + 16 <= len(head) else _fetch_source_range(src_url, pos, 16)
+        if not header or len(header) < 8:
+            return None
+
+        size, raw_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        if size < header_size:
+            return None
+
+        if raw_type.decode("latin-1") == box_type:
+            if size > THUMB_EMBEDDED_MAX_BOX_BYTES:
+                return None
+            box = head[pos : pos + size] if pos + size <= len(head) else _fetch_source_range(src_url, pos, size)
+            if not box or len(box) != size:
+                return None
+            return box[header_size:]
+
+        pos += size
+    return None
+
+
+def _parse_heif_item_locations(iloc: bytes) -> dict[int, tuple[int, list[tuple[int, int]]]]:
+    version = iloc[0]
+    offset_size = iloc[4] >> 4
+    length_size = iloc[4] & 0x0F
+    base_offset_size = iloc[5] >> 4
+    index_size = (iloc[5] & 0x0F) if version in {1, 2} else 0
+    pos = 6
+
+    def read_uint(nbytes: int) -> int:
+        nonlocal pos
+        value = int.from_bytes(iloc[pos : pos + nbytes], "big") if nbytes else 0
+        pos += nbytes
+        return value
+
+    item_count = read_uint(4 if version == 2 else 2)
+    locations: dict[int, tuple[int, list[tuple[int, int]]]] = {}
+    for _ in range(item_count):
+        item_id = read_uint(4 if version == 2 else 2)
+        construction_method = (read_uint(2) & 0x0F) if version in {1, 2} else 0
+        read_uint(2)  # data_reference_index
+        base_offset = read_uint(base_offset_size)
+        extent_count = read_uint(2)
+        extents = []
+        for _ in range(extent_count):
+            read_uint(index_size)
+            extent_offset = read_uint(offset_size)
+            extent_length = read_uint(length_size)
+            extents.append((base_offset + extent_offset, extent_length))
+        locations[item_id] = (construction_method, extents)
+    return locations
+
+
+def _parse_heif_item_properties(iprp: bytes) -> dict[int, list[tuple[str, bytes]]]:
+    children = _child_boxes(iprp)
+    ipco = children.get("ipco") or b""
+    ipma = children.get("ipma") or b""
+    properties = [(box_type, ipco[start:end]) for box_type, start, end in _iter_boxes(ipco)]
+
+    version = ipma[0]
+    flags = int.from_bytes(ipma[1:4], "big")
+    pos = 4
+    entry_count = struct.unpack(">I", ipma[pos : pos + 4])[0]
+    pos += 4
+
+    associations: dict[int, list[tuple[str, bytes]]] = {}
+    for _ in range(entry_count):
+        if version < 1:
+            item_id = struct.unpack(">H", ipma[pos : pos + 2])[0]
+            pos += 2
+        else:
+            item_id = struct.unpack(">I", ipma[pos : pos + 4])[0]
+            pos += 4
+        assoc_count = ipma[pos]
+        pos += 1
+        props = []
+        for _ in range(assoc_count):
+            if flags & 1:
+                index = struct.unpack(">H", ipma[pos : pos + 2])[0] & 0x7FFF
+                pos += 2
+            else:
+                index = ipma[pos] & 0x7F
+                pos += 1
+            if 0 < index <= len(properties):
+                props.append(properties[index - 1])
+        associations[item_id] = props
+    return associations
+
+
+def _hevc_config_to_annexb(hvcc: bytes) -> tuple[bytes, int]:
+    nal_length_size = (hvcc[21] & 0x03) + 1
+    num_arrays = hvcc[22]
+    pos = 23
+    out = bytearray()
+    for _ in range(num_arrays):
+        pos += 1  # array_completeness + NAL unit type
+        num_nalus = struct.unpack(">H", hvcc[pos : pos + 2])[0]
+        pos += 2
+        for _ in range(num_nalus):
+            nal_len = struct.unpack(">H", hvcc[pos : pos + 2])[0]
+            pos += 2
+            out += b"\x00\x00\x00\x01" + hvcc[pos : pos + nal_len]
+            pos += nal_len
+    return bytes(out), nal_length_size
+
+
+def _length_prefixed_to_annexb(data: bytes, nal_length_size: int) -> bytes:
+    out = bytearray()
+    pos = 0
+    while pos + nal_length_size <= len(data):
+        nal_len = int.from_bytes(data[pos : pos + nal_length_size], "big")
+        pos += nal_length_size
+        out += b"\x00\x00\x00\x01" + data[pos : pos + nal_len]
+        pos += nal_len
+    return bytes(out)
+
+
+def _extract_heif_thumbnail(src_url: str, head: bytes) -> dict | None:
+    meta = _fetch_top_level_box(src_url, "meta", head)
+    if not meta or len(meta) < 4:
+        return None
+    boxes = _child_boxes(meta[4:])  # `meta` is a full box
+
+    pitm = boxes.get("pitm")
+    iinf = boxes.get("iinf")
+    iref = boxes.get("iref")
+    iloc = boxes.get("iloc")
+    iprp = boxes.get("iprp")
+    if not pitm or not iinf or not iref or not iloc or not iprp:
+        return None
+
+    primary_id = struct.unpack(">H", pitm[4:6])[0] if pitm[0] == 0 else struct.unpack(">I", pitm[4:8])[0]
+
+    item_types: dict[int, str] = {}
+    entries_start = 6 if iinf[0] == 0 else 8
+    for box_type, start, end in _iter_boxes(iinf, entries_start):
+        if box_type != "infe":
+            continue
+        infe = iinf[start:end]
+        if infe[0] == 2:
+            item_id = struct.unpack(">H", infe[4:6])[0]
+            item_type = infe[8:12]
+        elif infe[0] == 3:
+            item_id = struct.unpack(">I", infe[4:8])[0]
+            item_type = infe[10:14]
+        else:
+            continue
+        item_types[item_id] = item_type.decode("latin-1")
+
+    id_size = 2 if iref[0] == 0 else 4
+    thumbnail_ids = []
+    for box_type, start, end in _iter_boxes(iref, 4):
+        if box_type != "thmb":
+            continue
+        ref = iref[start:end]
+        from_id = int.from_bytes(ref[0:id_size], "big")
+        ref_count = struct.unpack(">H", ref[id_size : id_size + 2])[0]
+        to_ids = [
+            int.from_bytes(ref[id_size + 2 + i * id_size : id_size + 2 + (i + 1) * id_size], "big")
+            for i in range(ref_count)
+        ]
+        if primary_id in to_ids and item_types.get(from_id) in {"hvc1", "jpeg"}:
+            thumbnail_ids.append(from_id)
+
+    if not thumbnail_ids:
+        return None
+
+    properties = _parse_heif_item_properties(iprp)
+    candidates = []
+    for item_id in thumbnail_ids:
+        props = dict(properties.get(item_id) or [])
+        ispe = props.get("ispe")
+        if not ispe or len(ispe) < 12:
+            continue
+        width, height = struct.unpack(">II", ispe[4:12])
+        rotation = (props["irot"][0] & 0x03) if props.get("irot") else 0
+        candidates.append((width * height, item_id, width, height, rotation, props.get("hvcC")))
+
+    if not candidates:
+        return None
+    _, item_id, width, height, rotation, hvcc = max(candidates)
+
+    location = _parse_heif_item_locations(iloc).get(item_id)
+    if not location:
+        return None
+    construction_method, extents = location
+    if sum(length for _, length in extents) > THUMB_EMBEDDED_MAX_BOX_BYTES:
+        return None
+
+    chunks = []
+    for offset, length in extents:
+        if construction_method == 1:
+            chunk = (boxes.get("idat") or b"")[offset : offset + length]
+        elif construction_method == 0:
+            chunk = head[offset : offset + length] if offset + length <= len(head) else None
+            if chunk is None:
+                chunk = _fetch_source_range(src_url, offset, length)
+        else:
+            return None
+        if not chunk or len(chunk) != length:
+            return None
+        chunks.append(chunk)
+    data = b"".join(chunks)
+
+    if rotation in {1, 3}:
+        width, height = height, width
+
+    if item_types.get(item_id) == "jpeg":
+        return {"codec": "jpeg", "data": data, "width": width, "height": height, "filters": list(_HEIF_IROT_FILTERS.get(rotation, []))}
+
+    if not hvcc or len(hvcc) < 23:
+        return None
+    parameter_sets, nal_length_size = _hevc_config_to_annexb(hvcc)
+    return {
+        "codec": "hevc",
+        "data": parameter_sets + _length_prefixed_to_annexb(data, nal_length_size),
+        "width": width,
+        "height": height,
+        "filters": list(_HEIF_IROT_FILTERS.get(rotation, [])),
+    }
+
+
+def _extract_mp4_cover(src_url: str, head: bytes) -> dict | None:
+    moov = _fetch_top_level_box(src_url, "moov", head)
+    if not moov:
+        return None
+
+    moov_children = _child_boxes(moov)
+    meta_boxes = []
+    udta = moov_children.get("udta")
+    if udta:
+        meta_boxes.append(_child_boxes(udta).get("meta"))
+    meta_boxes.append(moov_children.get("meta"))
+
+    for meta in meta_boxes:
+        if not meta:
+            continue
+        # iTunes-style `meta` is a full box; QuickTime-style starts directly with `hdlr`.
+        ilst = _child_boxes(meta if meta[4:8] == b"hdlr" else meta[4:]).get("ilst")
+        covr = _child_boxes(ilst).get("covr") if ilst else None
+        data_box = _child_boxes(covr).get("data") if covr else None
+        if not data_box or len(data_box) <= 8:
+            continue
+
+        data = data_box[8:]
+        if data[:2] == b"\xff\xd8":
+            codec, dims = "jpeg", _jpeg_dimensions(data)
+        elif data[:8] == b"\x89PNG\r\n\x1a\n":
+            codec, dims = "png", _png_dimensions(data)
+        else:
+            continue
+        if dims:
+            return {"codec": codec, "data": data, "width": dims[0], "height": dims[1], "filters": []}
+    return None
+
+
+def _extract_embedded_preview(src_url: str, ext: str) -> dict | None:
+    if ext in {"jpg", "jpeg"}:
+        extractor = None
+    elif ext in {"heic", "heif"}:
+        extractor = _extract_heif_thumbnail
+    elif ext in {"mp4", "mov", "m4v"}:
+        extractor = _extract_mp4_cover
+    else:
+        return None
+
+    head = _fetch_source_range(src_url, 0, THUMB_EMBEDDED_PROBE_BYTES)
+    if not head:
+        return None
+
+    preview = _extract_exif_thumbnail(head) if extractor is None else extractor(src_url, head)
+    if not preview or max(preview["width"], preview["height"]) < THUMB_EMBEDDED_MIN_SIZE:
+        return None
+    return preview
+
+
+def _try_embedded_thumbnail(*, src_url: str, ext: str, dst_path: str) -> bool:
+    try:
+        preview = _extract_embedded_preview(src_url, ext)
+    except Exception as e:
+        app.logger.info("embedded preview lookup failed for %s: %s", src_url, e)
+        return False
+    if not preview:
+        return False
+
+    tmp_path = dst_path + ".tmp"
+    if preview["codec"] == "jpeg" and not preview["filters"] and preview["width"] <= THUMB_MAX_WIDTH:
+        # Already a JPEG of the right size: serve the embedded bytes as-is (no decode at all).
+        with open(tmp_path, "wb") as f:
+            f.write(preview["data"])
+        os.replace(tmp_path, dst_path)
+        return True
+
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-threads", "1"]
+    if preview["codec"] == "hevc":
+        cmd += ["-f", "hevc"]
+    cmd += [
+        "-i",
+        "pipe:0",
+        "-frames:v",
+        "1",
+        "-vf",
+        ",".join(preview["filters"] + [f"scale='min({THUMB_MAX_WIDTH},iw)':-2"]),
+        "-q:v",
+        str(THUMB_JPEG_QUALITY),
+        "-f",
+        "image2",
+        "-update",
+        "1",
+        "-y",
+        tmp_path,
+    ]
+    with _thumb_sema:
+        result = subprocess.run(
+            cmd,
+            input=preview["data"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=THUMB_FFMPEG_TIMEOUT_SECONDS,
+        )
+    if result.returncode != 0 or not os.path.exists(tmp_path):
+        app.logger.info("embedded preview decode failed for %s: %s", src_url, result.stderr.decode(errors="replace"))
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+    os.replace(tmp_path, dst_path)
+    return True
+
+
+def _probe_source(src_url: str) -> dict | None:
+    cmd = [
+        "ffprobe",
+        "-hide_banner",
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        src_url,
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=FFPROBE_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0:
+        return None
+
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _probe_duration(src_url: str) -> float | None:
+    return _duration_from_probe(_probe_source(src_url))
+
+
+def _duration_from_probe(probe: dict | None) -> float | None:
+    fmt = probe.get("format") if isinstance(probe, dict) else None
+    try:
+        duration = float(fmt.get("duration")) if isinstance(fmt, dict) else None
+    except (TypeError, ValueError):
+        return None
+    return duration if duration and duration > 0 else None
+
+
+def _run_ffmpeg(cmd: list[str], *, timeout: float, on_progress=None) -> subprocess.CompletedProcess:
+    """Run ffmpeg like subprocess.run; with `on_progress`, also report `(out_time_seconds, speed)` as it encodes."""
+    if on_progress is None:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + cmd[1:]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    stderr_chunks: list[bytes] = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    drain.start()
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+
+    out_time = 0.0
+    speed = None
+    try:
+        for raw in proc.stdout:
+            key, _, value = raw.decode(errors="replace").strip().partition("=")
+            if key == "out_time_us":
+                try:
+                    out_time = max(0.0, int(value) / 1_000_000)
+                except ValueError:
+                    pass
+            elif key == "speed":
+                try:
+                    speed = float(value.rstrip("x"))
+                except ValueError:
+                    speed = None
+            elif key == "progress":
+                on_progress(out_time, speed)
+        proc.wait()
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        drain.join(timeout=5)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return subprocess.CompletedProcess(cmd, proc.returncode, b"", b"".join(stderr_chunks))
+
+
+# Bumped when the way cache keys are derived changes, so the cache sweep retires renditions under old keys.
+CACHE_KEY_SCHEME = "content-v1"
+CONTENT_SAMPLE_BYTES = int(os.environ.get("DROPPR_CONTENT_SAMPLE_BYTES", str(64 * 1024)))
+CONTENT_ID_MEMO_MAX = 4096
+# After a failed sample, the share-scoped fallback is reused this long before FileBrowser is sampled again.
+CONTENT_ID_RETRY_SECONDS = int(os.environ.get("DROPPR_CONTENT_ID_RETRY_SECONDS", "60"))
+
+_content_id_memo: dict[tuple[str, str, int, str], str] = {}
+_content_id_fallback_at: dict[tuple[str, str, int, str], float] = {}
+_content_id_memo_lock = threading.Lock()
+
+
+def _cache_profile(kind: str) -> str:
+    """Encoding settings baked into a rendition's cache key; a change means old renditions are stale."""
+    if kind == "fast":
+        return f"{CACHE_KEY_SCHEME}:{PROXY_PROFILE_VERSION}:{PROXY_MAX_DIMENSION}:{PROXY_CRF}:{PROXY_H264_PRESET}"
+    if kind == "preview":
+        return f"{_cache_profile('fast')}:{PREVIEW_CLIP_SECONDS}s"
+    if kind == "hd":
+        return f"{CACHE_KEY_SCHEME}:{HD_PROFILE_VERSION}:{HD_MAX_DIMENSION}:{HD_CRF}:{HD_H264_PRESET}"
+    if kind == "hls":
+        return f"{CACHE_KEY_SCHEME}:{HLS_PROFILE_VERSION}:{HLS_LADDER}:{HLS_SEGMENT_SECONDS}:{HLS_H264_PRESET}"
+    raise ValueError(f"Unknown cache kind: {kind}")
+
+
+def _sample_content_id(src_url: str, size: int) -> str | None:
+    """Hash the size plus head/middle/tail samples of the source, read with range requests."""
+    if size <= 0:
+        return None
+
+    n = max(4096, CONTENT_SAMPLE_BYTES)
+    if size <= 3 * n:
+        ranges = [(0, size)]
+    else:
+        ranges = [(0, n), ((size - n) // 2, n), (size - n, n)]
+
+    digest = hashlib.sha256(f"{size}:".encode())
+    for start, length in ranges:
+        chunk = _fetch_source_range(src_url, start, length)
+        if chunk is None or len(chunk) != length:
+            return None
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _source_content_id(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
+    """Identity of the file behind a share path, independent of which share (or alias) it was reached through.
+
+    Looked up in `source_identity` by (share, path, size, modified) and sampled from FileBrowser on a miss.
+    """
+    mod = (modified or "").strip()
+    ident = (share_hash, file_path, int(size or 0), mod)
+    fallback = hashlib.sha256(f"share:{share_hash}:{file_path}:{size}:{mod}".encode()).hexdigest()
+    with _content_id_memo_lock:
+        cached = _content_id_memo.get(ident)
+        failed_at = _content_id_fallback_at.get(ident)
+    if cached:
+        return cached
+    if failed_at is not None and time.time() - failed_at < CONTENT_ID_RETRY_SECONDS:
+        return fallback
+
+    content_id = None
+    try:
+        with _transcode_conn() as conn:
+            row = conn.execute(
+                """
+                SELECT content_id FROM source_identity
+                WHERE share_hash = ? AND file_path = ? AND size = ? AND modified = ?
+                """,
+                ident,
+            ).fetchone()
+        if row:
+            content_id = str(row["content_id"])
+        else:
+            src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+            content_id = _sample_content_id(src_url, int(size or 0))
+            if content_id:
+                with _transcode_conn() as conn:
+                    conn.execute(
+                        """
+                        INSERT OR REPLACE INTO source_identity (
+                            share_hash, file_path, size, modified, content_id, created_at
+                        )
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        """,
+                        (*ident, content_id, int(time.time())),
+                    )
+    except Exception as e:
+        app.logger.warning("Failed to identify source %s/%s: %s", share_hash, file_path, e)
+        content_id = None
+
+    if not content_id:
+        # Sampling failed: fall back to a share-scoped identity without recording it, so it is retried later.
+        # Jobs store the id they were keyed with, so the worker writes where this process will look.
+        with _content_id_memo_lock:
+            if len(_content_id_fallback_at) >= CONTENT_ID_MEMO_MAX:
+                _content_id_fallback_at.clear()
+            _content_id_fallback_at[ident] = time.time()
+        return fallback
+
+    _remember_content_id(ident, content_id)
+    return content_id
+
+
+def _remember_content_id(ident: tuple[str, str, int, str], content_id: str) -> None:
+    with _content_id_memo_lock:
+        if len(_content_id_memo) >= CONTENT_ID_MEMO_MAX:
+            _content_id_memo.clear()
+        _content_id_memo[ident] = content_id
+        _content_id_fallback_at.pop(ident, None)
+
+
+def _proxy_cache_key(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
+    # Keyed on the source's content rather than the share, so re-shares and aliases reuse renditions;
+    # invalidates when the source changes or the encoding profile changes.
+    content_id = _source_content_id(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    key = f"proxy:{_cache_profile('fast')}:{content_id}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _preview_cache_key(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
+    content_id = _source_content_id(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    key = f"preview:{_cache_profile('preview')}:{content_id}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _hd_cache_key(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
+    content_id = _source_content_id(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    key = f"hd:{_cache_profile('hd')}:{content_id}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _proxy_scale_filter() -> str:
+    # Cap the longer side to PROXY_MAX_DIMENSION while preserving aspect ratio.
+    return f"scale='if(gt(iw,ih),min({PROXY_MAX_DIMENSION},iw),-2)':'if(gt(iw,ih),-2,min({PROXY_MAX_DIMENSION},ih))'"
+
+
+def _ffmpeg_proxy_cmd(
+    *, src_url: str, dst_path: str, fragmented: bool = False, max_seconds: int | None = None
+) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+    ] + (
+        # As an input option, so ffmpeg stops reading the source once the clip is long enough.
+        ["-t", str(max_seconds)] if max_seconds else []
+    ) + [
+        "-i",
+        src_url,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-sn",
+        "-vf",
+        _proxy_scale_filter(),
+    ] + _proxy_output_args(dst_path=dst_path, fragmented=fragmented)
+
+
+def _proxy_video_args() -> list[str]:
+    return [
+        "-c:v",
+        "libx264",
+        "-preset",
+        PROXY_H264_PRESET,
+        "-crf",
+        str(PROXY_CRF),
+        "-pix_fmt",
+        "yuv420p",
+        "-profile:v",
+        "main",
+        "-g",
+        "60",
+        "-keyint_min",
+        "60",
+        "-sc_threshold",
+        "0",
+    ]
+
+
+def _proxy_output_args(*, dst_path: str, fragmented: bool = False) -> list[str]:
+    """Encoder/muxer options for one fast proxy output (everything after the input and stream maps)."""
+    return _proxy_video_args() + [
+        "-c:a",
+        "aac",
+        "-b:a",
+        str(PROXY_AAC_BITRATE),
+    ] + (
+        # Self-contained ~1s fragments are playable as soon as they hit the disk.
+        ["-movflags", "+frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "1000000"]
+        if fragmented
+        else ["-movflags", "+faststart"]
+    ) + [
+        "-f",
+        "mp4",
+        dst_path,
+    ]
+
+
+def _ffmpeg_faststart_remux_cmd(*, src_path: str, dst_path: str) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        src_path,
+        "-map",
+        "0",
+        "-c",
+        "copy",
+        "-movflags",
+        "+faststart",
+        "-f",
+        "mp4",
+        dst_path,
+    ]
+
+
+def _proxy_live_path(output_path: str) -> str:
+    return output_path + ".live"
+
+
+def _bind_duration(progress, src_url: str, duration: float | None = None):
+    # Adapt a `progress(out_time, duration, speed)` callback to `_run_ffmpeg`'s `(out_time, speed)`.
+    if progress is None:
+        return None
+    if duration is None:
+        duration = _probe_duration(src_url)
+    return lambda out_time, speed: progress(out_time, duration, speed)
+
+
+def _chunked_encode_eligible(duration: float | None) -> bool:
+    return bool(
+        TRANSCODE_CHUNKED_MIN_SECONDS > 0
+        and TRANSCODE_CHUNK_PARALLELISM > 1
+        and duration
+        and duration >= TRANSCODE_CHUNKED_MIN_SECONDS
+    )
+
+
+def _plan_chunks(src_url: str, duration: float) -> tuple[list[tuple[float, float | None]], bool] | None:
+    """Split the source at keyframes into ~TRANSCODE_CHUNK_SECONDS pieces.
+
+    Returns `(start, length)` pairs relative to the start of the input (the last length is None, meaning
+    "to the end") and whether the source has audio, or None if it cannot be split.
+    """
+    chunk = max(10.0, TRANSCODE_CHUNK_SECONDS)
+    targets = []
+    t = chunk
+    while t < duration - chunk / 2:
+        targets.append(t)
+        t += chunk
+    if not targets:
+        return None
+
+    # Seeking lands on the keyframe at or before each target; read a second past it to see that keyframe.
+    cmd = [
+        "ffprobe",
+        "-hide_banner",
+        "-v",
+        "error",
+        "-read_intervals",
+        ",".join(f"{target:.3f}%+1" for target in targets),
+        "-show_entries",
+        "packet=stream_index,pts_time,flags:stream=index,codec_type:format=start_time",
+        "-print_format",
+        "json",
+        src_url,
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=FFPROBE_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        return None
+
+    streams = data.get("streams") or []
+    video_index = next((s.get("index") for s in streams if s.get("codec_type") == "video"), None)
+    has_audio = any(s.get("codec_type") == "audio" for s in streams)
+    try:
+        start_time = float((data.get("format") or {}).get("start_time") or 0)
+    except (TypeError, ValueError):
+        start_time = 0.0
+
+    keyframes = []
+    for packet in data.get("packets") or []:
+        if packet.get("stream_index") != video_index or "K" not in str(packet.get("flags") or ""):
+            continue
+        try:
+            keyframes.append(float(packet["pts_time"]) - start_time)
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    bounds = set()
+    for target in targets:
+        candidates = [k for k in keyframes if k <= target + 0.001]
+        if candidates and max(candidates) > 1.0:
+            bounds.add(round(max(candidates), 6))
+    if not bounds:
+        return None
+
+    starts = [0.0] + sorted(bounds)
+    chunks = [(start, round(end - start, 6)) for start, end in zip(starts, starts[1:])]
+    chunks.append((starts[-1], None))
+    return chunks, has_audio
+
+
+def _ffmpeg_chunk_cmd(
+    *, src_url: str, start: float, length: float | None, scale: str | None, video_args: list[str], dst_path: str
+) -> list[str]:
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y"]
+    if start > 0:
+        cmd += ["-ss", f"{start:.6f}"]
+    cmd += ["-i", src_url]
+    if length is not None:
+        cmd += ["-t", f"{length:.6f}"]
+    cmd += ["-map", "0:v:0", "-an", "-sn"]
+    if scale:
+        cmd += ["-vf", scale]
+    threads = max(1, (os.cpu_count() or 1) // max(1, TRANSCODE_CHUNK_PARALLELISM))
+    return cmd + ["-threads", str(threads)] + video_args + ["-f", "mp4", dst_path]
+
+
+def _ffmpeg_chunk_audio_cmd(*, src_url: str, audio_bitrate: str, dst_path: str) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        src_url,
+        "-map",
+        "0:a?",
+        "-vn",
+        "-sn",
+        "-c:a",
+        "aac",
+        "-b:a",
+        str(audio_bitrate),
+        "-f",
+        "mp4",
+        dst_path,
+    ]
+
+
+def _ffmpeg_chunk_concat_cmd(*, list_path: str, audio_path: str | None, dst_path: str) -> list[str]:
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y"]
+    cmd += ["-f", "concat", "-safe", "0", "-i", list_path]
+    cmd += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a"] if audio_path else ["-map", "0:v:0"]
+    return cmd + ["-c", "copy", "-movflags", "+faststart", "-f", "mp4", dst_path]
+
+
+def _run_chunked_encode(
+    *,
+    src_url: str,
+    dst_path: str,
+    work_dir: str,
+    duration: float | None,
+    scale: str | None,
+    video_args: list[str],
+    audio_bitrate: str,
+    timeout: float,
+    on_progress=None,
+) -> subprocess.CompletedProcess | None:
+    """Encode keyframe-aligned chunks of the source in parallel and concatenate them (stream copy) into
+    a faststart MP4 at `dst_path`; audio is encoded once alongside the chunks.
+
+    Returns None when the source is too short or cannot be split, so the caller runs a single encode.
+    """
+    if not _chunked_encode_eligible(duration):
+        return None
+    plan = _plan_chunks(src_url, duration)
+    if plan is None or len(plan[0]) < 2:
+        return None
+    chunks, has_audio = plan
+
+    deadline = time.time() + timeout
+    started = time.time()
+    done = [0.0] * len(chunks)
+    done_lock = threading.Lock()
+    abort = threading.Event()
+
+    def chunk_progress(index: int):
+        def report(out_time: float, speed: float | None) -> None:
+            if abort.is_set():
+                # Raising inside `_run_ffmpeg`'s progress loop kills this chunk's ffmpeg.
+                raise RuntimeError("Chunked encode aborted")
+            if on_progress is None:
+                return
+            with done_lock:
+                done[index] = out_time
+                total = sum(done)
+            elapsed = time.time() - started
+            on_progress(total, total / elapsed if elapsed > 0 else None)
+
+        return report
+
+    def run(cmd: list[str], report) -> subprocess.CompletedProcess:
+        if abort.is_set():
+            return subprocess.CompletedProcess(cmd, 1, b"", b"aborted")
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        result = _run_ffmpeg(cmd, timeout=remaining, on_progress=report)
+        if result.returncode != 0:
+            abort.set()
+        return result
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        chunk_paths = [os.path.join(work_dir, f"chunk-{i:04d}.mp4") for i in range(len(chunks))]
+        audio_path = os.path.join(work_dir, "audio.m4a") if has_audio else None
+
+        with ThreadPoolExecutor(max_workers=TRANSCODE_CHUNK_PARALLELISM) as pool:
+            futures = []
+            if audio_path:
+                cmd = _ffmpeg_chunk_audio_cmd(src_url=src_url, audio_bitrate=audio_bitrate, dst_path=audio_path)
+                futures.append(pool.submit(run, cmd, None))
+            for i, (start, length) in enumerate(chunks):
+                cmd = _ffmpeg_chunk_cmd(
+                    src_url=src_url,
+                    start=start,
+                    length=length,
+                    scale=scale,
+                    video_args=video_args,
+                    dst_path=chunk_paths[i],
+                )
+                futures.append(pool.submit(run, cmd, chunk_progress(i)))
+
+            results = []
+            error = None
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    abort.set()
+                    if error is None or isinstance(error, RuntimeError):
+                        error = e
+            if error is not None:
+                raise error
+
+        failed = next((r for r in results if r.returncode != 0), None)
+        if failed is not None:
+            return failed
+
+        list_path = os.path.join(work_dir, "chunks.txt")
+        with open(list_path, "w") as f:
+            for path in chunk_paths:
+                f.write(f"file '{path}'\n")
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired("concat", timeout)
+        return _run_ffmpeg(
+            _ffmpeg_chunk_concat_cmd(list_path=list_path, audio_path=audio_path, dst_path=dst_path),
+            timeout=remaining,
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _ensure_fast_proxy_mp4(
+    *,
+    share_hash: str,
+    file_path: str,
+    size: int,
+    modified: str | None = None,
+    progress=None,
+) -> tuple[str, str, str, int | None]:
+    cache_key = _proxy_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
+    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+
+    if os.path.exists(output_path):
+        return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+    lock_path = output_path + ".lock"
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        if os.path.exists(output_path):
+            return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+        tmp_path = output_path + ".tmp"
+        live_path = _proxy_live_path(output_path)
+        for stale in (tmp_path, live_path):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+        src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+        # Always one serial encode, even for long sources: its growing output is what proxy-live streams.
+        encode_path = live_path if PROXY_LIVE_ENABLED else tmp_path
+
+        on_progress = _bind_duration(progress, src_url)
+        try:
+            with _proxy_sema:
+                cmd = _ffmpeg_proxy_cmd(src_url=src_url, dst_path=encode_path, fragmented=PROXY_LIVE_ENABLED)
+                result = _run_ffmpeg(cmd, timeout=PROXY_FFMPEG_TIMEOUT_SECONDS, on_progress=on_progress)
+        except (subprocess.TimeoutExpired, TranscodeCancelled):
+            try:
+                os.remove(encode_path)
+            except OSError:
+                pass
+            raise
+
+        if result.returncode != 0:
+            app.logger.error(
+                "ffmpeg proxy failed for %s: %s",
+                file_path,
+                result.stderr.decode(errors="replace"),
+            )
+            try:
+                os.remove(encode_path)
+            except OSError:
+                pass
+            raise RuntimeError("Proxy generation failed")
+
+        _publish_fast_proxy(file_path=file_path, output_path=output_path, fragmented=PROXY_LIVE_ENABLED)
+        _record_cache_entry(
+            cache_key=cache_key,
+            kind="fast",
+            share_hash=share_hash,
+            file_path=file_path,
+            output_path=output_path,
+            strategy="transcode",
+        )
+        _drop_preview_clip(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+        return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+
+def _publish_fast_proxy(*, file_path: str, output_path: str, fragmented: bool) -> None:
+    """Move a finished fast proxy encode (`.live` if it was fragmented, else `.tmp`) into place."""
+    tmp_path = output_path + ".tmp"
+    live_path = _proxy_live_path(output_path)
+
+    if fragmented:
+        # The fragmented file plays fine but seeks poorly; remux it (no re-encode) into a faststart MP4.
+        remux = subprocess.run(
+            _ffmpeg_faststart_remux_cmd(src_path=live_path, dst_path=tmp_path),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=PROXY_FFMPEG_TIMEOUT_SECONDS,
+        )
+        if remux.returncode != 0:
+            app.logger.warning(
+                "faststart remux failed for %s, keeping fragmented proxy: %s",
+                file_path,
+                remux.stderr.decode(errors="replace"),
+            )
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            os.replace(live_path, output_path)
+            return
+
+    os.replace(tmp_path, output_path)
+    try:
+        os.remove(live_path)
+    except FileNotFoundError:
+        pass
+
+
+def _ensure_preview_clip(
+    *,
+    share_hash: str,
+    file_path: str,
+    size: int,
+    modified: str | None = None,
+    progress=None,
+) -> tuple[str, str, str, int | None]:
+    """Encode the first PREVIEW_CLIP_SECONDS at fast proxy settings; sources too short for a clip get none."""
+    cache_key = _preview_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
+    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+
+    if os.path.exists(output_path):
+        return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+    lock_path = output_path + ".lock"
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        if os.path.exists(output_path):
+            return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+        # Nothing to do if the full proxy already finished.
+        proxy_key = _proxy_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+        if os.path.exists(os.path.join(PROXY_CACHE_DIR, f"{proxy_key}.mp4")):
+            return cache_key, output_path, public_url, None
+
+        src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+        summary = _source_media_summary(src_url=src_url, file_path=file_path, size=size)
+        duration = summary.get("duration") if summary else None
+        if duration is not None and duration < PREVIEW_CLIP_MIN_SOURCE_SECONDS:
+            raise TranscodeSkipped(f"source is {duration:.0f}s, under {PREVIEW_CLIP_MIN_SOURCE_SECONDS}s")
+
+        # No _proxy_sema: the clip is a few seconds of work and must not queue behind full encodes.
+        tmp_path = output_path + ".tmp"
+        cmd = _ffmpeg_proxy_cmd(src_url=src_url, dst_path=tmp_path, max_seconds=PREVIEW_CLIP_SECONDS)
+        on_progress = _bind_duration(progress, src_url, float(PREVIEW_CLIP_SECONDS))
+        try:
+            result = _run_ffmpeg(cmd, timeout=PREVIEW_CLIP_FFMPEG_TIMEOUT_SECONDS, on_progress=on_progress)
+        except (subprocess.TimeoutExpired, TranscodeCancelled):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        if result.returncode != 0:
+            app.logger.error("ffmpeg preview clip failed for %s: %s", file_path, result.stderr.decode(errors="replace"))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise RuntimeError("Preview clip generation failed")
+
+        os.replace(tmp_path, output_path)
+        _record_cache_entry(
+            cache_key=cache_key,
+            kind="preview",
+            share_hash=share_hash,
+            file_path=file_path,
+            output_path=output_path,
+            strategy="transcode",
+            reason=f"first {PREVIEW_CLIP_SECONDS}s",
+        )
+        return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+
+def _drop_preview_clip(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> None:
+    """Remove the preview clip once the full proxy is published; it has no viewers left after that."""
+    cache_key = _preview_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
+    if not os.path.exists(output_path) or not _lock_is_free(output_path + ".lock"):
+        return
+    try:
+        _remove_cache_path(output_path)
+        with _transcode_conn() as conn:
+            conn.execute("DELETE FROM proxy_cache_entries WHERE cache_key = ?", (cache_key,))
+    except Exception as e:
+        app.logger.warning("Failed to drop preview clip for %s: %s", file_path, e)
+
+
+def _ffmpeg_hd_remux_cmd(*, src_url: str, dst_path: str) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        src_url,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-sn",
+        "-c",
+        "copy",
+        "-movflags",
+        "+faststart",
+        "-f",
+        "mp4",
+        dst_path,
+    ]
+
+
+def _ffmpeg_hd_copy_video_cmd(*, src_url: str, dst_path: str) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        src_url,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-sn",
+        "-c:v",
+        "copy",
+        "-c:a",
+        "aac",
+        "-b:a",
+        str(HD_AAC_BITRATE),
+        "-movflags",
+        "+faststart",
+        "-f",
+        "mp4",
+        dst_path,
+    ]
+
+
+def _hd_scale_filter() -> str | None:
+    if HD_MAX_DIMENSION and HD_MAX_DIMENSION > 0:
+        return f"scale='if(gt(iw,ih),min({HD_MAX_DIMENSION},iw),-2)':'if(gt(iw,ih),-2,min({HD_MAX_DIMENSION},ih))'"
+    return None
+
+
+def _ffmpeg_hd_transcode_cmd(*, src_url: str, dst_path: str) -> list[str]:
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        src_url,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-sn",
+    ]
+
+    scale = _hd_scale_filter()
+    if scale:
+        cmd += ["-vf", scale]
+
+    return cmd + _hd_transcode_output_args(dst_path=dst_path)
+
+
+def _hd_video_args() -> list[str]:
+    return [
+        "-c:v",
+        "libx264",
+        "-preset",
+        HD_H264_PRESET,
         "-crf",
-        str(PROXY_CRF),
+        str(HD_CRF),
         "-pix_fmt",
         "yuv420p",
         "-profile:v",
-        "main",
+        "high",
         "-g",
         "60",
         "-keyint_min",
         "60",
         "-sc_threshold",
         "0",
+    ]
+
+
+def _hd_transcode_output_args(*, dst_path: str) -> list[str]:
+    """Encoder/muxer options for one HD transcode output (everything after the input and stream maps)."""
+    return _hd_video_args() + [
         "-c:a",
         "aac",
         "-b:a",
-        str(PROXY_AAC_BITRATE),
+        str(HD_AAC_BITRATE),
         "-movflags",
         "+faststart",
         "-f",
@@ -1053,62 +3103,1021 @@ def _ffmpeg_proxy_cmd(*, src_url: str, dst_path: str) -> list[str]:
     ]
 
 
-def _ensure_fast_proxy_mp4(
+def _ensure_hd_mp4(
+    *,
+    share_hash: str,
+    file_path: str,
+    size: int,
+    modified: str | None = None,
+    progress=None,
+) -> tuple[str, str, str, int | None]:
+    cache_key = _hd_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
+    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+
+    if os.path.exists(output_path):
+        return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+    lock_path = output_path + ".lock"
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        if os.path.exists(output_path):
+            return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+        tmp_path = output_path + ".tmp"
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+        src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+        summary = _source_media_summary(src_url=src_url, file_path=file_path, size=size)
+        strategy, reason = _choose_hd_strategy(summary)
+
+        commands = {
+            "remux": _ffmpeg_hd_remux_cmd(src_url=src_url, dst_path=tmp_path),
+            "copy_video": _ffmpeg_hd_copy_video_cmd(src_url=src_url, dst_path=tmp_path),
+            "transcode": _ffmpeg_hd_transcode_cmd(src_url=src_url, dst_path=tmp_path),
+        }
+        if strategy is None:
+            # Nothing to go on; fall back to trying the cheap paths first.
+            attempts = list(commands)
+        elif strategy == "transcode":
+            attempts = ["transcode"]
+        else:
+            # A stream copy the probe approved should work; keep a transcode as the safety net.
+            attempts = [strategy, "transcode"]
+
+        duration = summary.get("duration") if summary else None
+        on_progress = _bind_duration(progress, src_url, duration)
+        last_err = None
+        failed: list[str] = []
+        with _hd_sema:
+            for label in attempts:
+                try:
+                    result = None
+                    if label == "transcode":
+                        result = _run_chunked_encode(
+                            src_url=src_url,
+                            dst_path=tmp_path,
+                            work_dir=output_path + ".chunks",
+                            duration=duration,
+                            scale=_hd_scale_filter(),
+                            video_args=_hd_video_args(),
+                            audio_bitrate=HD_AAC_BITRATE,
+                            timeout=HD_FFMPEG_TIMEOUT_SECONDS,
+                            on_progress=on_progress,
+                        )
+                        if result is not None and result.returncode != 0:
+                            app.logger.warning(
+                                "chunked hd encode failed for %s, retrying as one encode: %s",
+                                file_path,
+                                result.stderr.decode(errors="replace"),
+                            )
+                            result = None
+                        elif result is not None:
+                            reason = f"{reason}; chunked parallel encode"
+                    if result is None:
+                        result = _run_ffmpeg(
+                            commands[label], timeout=HD_FFMPEG_TIMEOUT_SECONDS, on_progress=on_progress
+                        )
+                except subprocess.TimeoutExpired:
+                    last_err = f"{label}: timeout"
+                    failed.append(label)
+                    continue
+                except TranscodeCancelled:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                    raise
+
+                if result.returncode == 0:
+                    os.replace(tmp_path, output_path)
+                    if failed:
+                        reason = f"{reason}; {', '.join(failed)} failed"
+                    _record_cache_entry(
+                        cache_key=cache_key,
+                        kind="hd",
+                        share_hash=share_hash,
+                        file_path=file_path,
+                        output_path=output_path,
+                        strategy=label,
+                        reason=reason,
+                    )
+                    return cache_key, output_path, public_url, os.path.getsize(output_path)
+
+                last_err = f"{label}: {result.stderr.decode(errors='replace')}"
+                failed.append(label)
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+        if last_err:
+            app.logger.error("ffmpeg hd failed for %s: %s", file_path, last_err)
+        raise RuntimeError("HD generation failed")
+
+
+# What browsers play from an MP4 without re-encoding; anything else gets an H.264 HD transcode.
+HD_COPY_VIDEO_CODECS = {"h264"}
+HD_COPY_PIX_FMTS = {"yuv420p", "yuvj420p"}
+HD_COPY_AUDIO_CODECS = {"aac", "mp3"}
+
+
+def _media_summary_from_probe(probe: dict | None) -> dict | None:
+    """Reduce ffprobe JSON to the same shape faststart stores in `video_meta`."""
+    if not isinstance(probe, dict):
+        return None
+    streams = probe.get("streams") if isinstance(probe.get("streams"), list) else []
+    fmt = probe.get("format") if isinstance(probe.get("format"), dict) else {}
+    video = next((st for st in streams if isinstance(st, dict) and st.get("codec_type") == "video"), None)
+    audio = next((st for st in streams if isinstance(st, dict) and st.get("codec_type") == "audio"), None)
+
+    return {
+        "container": fmt.get("format_name"),
+        "duration": _duration_from_probe(probe),
+        "video": {
+            "codec": video.get("codec_name"),
+            "profile": video.get("profile"),
+            "pix_fmt": video.get("pix_fmt"),
+            "width": int(video.get("width") or 0) or None,
+            "height": int(video.get("height") or 0) or None,
+        }
+        if video
+        else None,
+        "audio": {"codec": audio.get("codec_name")} if audio else None,
+    }
+
+
+def _recorded_media_summary(file_path: str, size: int) -> dict | None:
+    """Use faststart's stored ffprobe summary when it describes the file currently at `file_path`."""
+    try:
+        with _video_meta_conn() as conn:
+            row = conn.execute(
+                """
+                SELECT original_size, processed_size, original_meta_json, processed_meta_json
+                FROM video_meta WHERE path = ? LIMIT 1
+                """,
+                ("/" + file_path.lstrip("/"),),
+            ).fetchone()
+    except Exception as e:
+        app.logger.warning("Failed to read video meta for %s: %s", file_path, e)
+        return None
+    if not row:
+        return None
+
+    # faststart may have replaced the upload; only trust a summary whose size matches what FileBrowser serves.
+    for size_col, json_col in (("processed_size", "processed_meta_json"), ("original_size", "original_meta_json")):
+        if not row[json_col] or not size or int(row[size_col] or 0) != size:
+            continue
+        try:
+            meta = json.loads(row[json_col])
+        except ValueError:
+            continue
+        if isinstance(meta, dict) and isinstance(meta.get("video"), dict) and meta["video"].get("codec"):
+            return meta
+    return None
+
+
+def _source_media_summary(*, src_url: str, file_path: str, size: int) -> dict | None:
+    return _recorded_media_summary(file_path, size) or _media_summary_from_probe(_probe_source(src_url))
+
+
+def _choose_hd_strategy(summary: dict | None) -> tuple[str | None, str]:
+    """Pick `remux`, `copy_video` or `transcode` for the HD MP4 from a media summary, with the reason."""
+    video = summary.get("video") if isinstance(summary, dict) else None
+    if not isinstance(video, dict) or not video.get("codec"):
+        return None, "source probe unavailable"
+
+    codec = str(video.get("codec") or "").lower()
+    if codec not in HD_COPY_VIDEO_CODECS:
+        return "transcode", f"video codec {codec}"
+
+    pix_fmt = str(video.get("pix_fmt") or "").lower()
+    if pix_fmt and pix_fmt not in HD_COPY_PIX_FMTS:
+        return "transcode", f"pixel format {pix_fmt}"
+
+    profile = str(video.get("profile") or "")
+    if profile.startswith(("High 10", "High 4:2:2", "High 4:4:4")):
+        return "transcode", f"h264 profile {profile}"
+
+    if HD_MAX_DIMENSION and HD_MAX_DIMENSION > 0:
+        longest = max(int(video.get("width") or 0), int(video.get("height") or 0))
+        if longest > HD_MAX_DIMENSION:
+            return "transcode", f"{longest}px exceeds DROPPR_HD_MAX_DIMENSION={HD_MAX_DIMENSION}"
+
+    audio = summary.get("audio") if isinstance(summary.get("audio"), dict) else None
+    audio_codec = str(audio.get("codec") or "").lower() if audio else ""
+    container = summary.get("container") or "unknown container"
+    if audio_codec and audio_codec not in HD_COPY_AUDIO_CODECS:
+        return "copy_video", f"h264 video, audio codec {audio_codec} ({container})"
+    return "remux", f"h264 {pix_fmt or 'video'}, audio {audio_codec or 'none'} ({container})"
+
+
+# faststart outcomes that leave `moov` ahead of `mdat` (its "none" action means the atoms were not found).
+FASTSTART_STREAMABLE_ACTIONS = {
+    "already_faststart",
+    "faststart",
+    "transcode_hevc_to_h264",
+    "fix_video_errors_extra_streams",
+    "fix_video_errors_timestamp",
+}
+ORIGINAL_AS_RENDITION_ENABLED = parse_bool(os.environ.get("DROPPR_ORIGINAL_AS_RENDITION_ENABLED", "true"))
+ORIGINAL_AS_HD_MAX_BITRATE = int(os.environ.get("DROPPR_ORIGINAL_AS_HD_MAX_BITRATE", str(25_000_000)))
+ORIGINAL_AS_HD_MAX_DIMENSION = int(os.environ.get("DROPPR_ORIGINAL_AS_HD_MAX_DIMENSION", "3840"))
+ORIGINAL_AS_FAST_MAX_BITRATE = int(os.environ.get("DROPPR_ORIGINAL_AS_FAST_MAX_BITRATE", str(3_000_000)))
+
+
+def _stream_ready_original(file_path: str, size: int) -> dict | None:
+    """Whether faststart left the original directly playable, so it can stand in for the HD (and maybe fast) MP4.
+
+    Returns `{"hd": True, "fast": bool, "reason": str}`, or None when the original still needs a rendition.
+    """
+    if not ORIGINAL_AS_RENDITION_ENABLED or not size:
+        return None
+    try:
+        with _video_meta_conn() as conn:
+            row = conn.execute(
+                "SELECT status, action, processed_size, processed_meta_json FROM video_meta WHERE path = ? LIMIT 1",
+                ("/" + file_path.lstrip("/"),),
+            ).fetchone()
+    except Exception as e:
+        app.logger.warning("Failed to read video meta for %s: %s", file_path, e)
+        return None
+
+    if not row or row["status"] != "done" or row["action"] not in FASTSTART_STREAMABLE_ACTIONS:
+        return None
+    if int(row["processed_size"] or 0) != size or not row["processed_meta_json"]:
+        return None
+    try:
+        meta = json.loads(row["processed_meta_json"])
+    except ValueError:
+        return None
+    if not isinstance(meta, dict) or "mp4" not in str(meta.get("container") or ""):
+        return None
+
+    strategy, reason = _choose_hd_strategy(meta)
+    if strategy != "remux":
+        return None
+
+    video = meta.get("video") or {}
+    longest = max(int(video.get("width") or 0), int(video.get("height") or 0))
+    duration = float(meta.get("duration") or 0)
+    bit_rate = int(meta.get("bit_rate") or 0) or (int(size * 8 / duration) if duration > 0 else 0)
+    if not bit_rate or longest > ORIGINAL_AS_HD_MAX_DIMENSION:
+        return None
+    if ORIGINAL_AS_HD_MAX_BITRATE > 0 and bit_rate > ORIGINAL_AS_HD_MAX_BITRATE:
+        return None
+
+    fast = longest <= PROXY_MAX_DIMENSION and bit_rate <= ORIGINAL_AS_FAST_MAX_BITRATE
+    reason = f"original is stream-ready ({row['action']}): {reason}, {bit_rate // 1000} kbps"
+    return {"hd": True, "fast": fast, "reason": reason}
+
+
+def _record_cache_entry(
+    *,
+    cache_key: str,
+    kind: str,
+    share_hash: str,
+    file_path: str,
+    output_path: str,
+    strategy: str | None = None,
+    reason: str | None = None,
+) -> None:
+    try:
+        output_size = os.path.getsize(output_path) if os.path.isfile(output_path) else None
+        if os.path.isdir(output_path):
+            output_size = _dir_size(output_path)
+        now = int(time.time())
+        with _transcode_conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO proxy_cache_entries (
+                    cache_key, kind, share_hash, file_path, output_size, strategy, reason, profile,
+                    created_at, last_access_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    output_size = excluded.output_size,
+                    strategy = excluded.strategy,
+                    reason = excluded.reason,
+                    profile = excluded.profile,
+                    created_at = excluded.created_at,
+                    last_access_at = excluded.last_access_at
+                """,
+                (
+                    cache_key,
+                    kind,
+                    share_hash,
+                    file_path,
+                    output_size,
+                    strategy,
+                    reason,
+                    _cache_profile(kind),
+                    now,
+                    now,
+                ),
+            )
+    except Exception as e:
+        app.logger.warning("Failed to record cache entry %s: %s", cache_key, e)
+
+
+def _touch_cache_entries(entries: list[tuple[str, str, str, str, str]]) -> None:
+    """Record a view of ready renditions, given as (cache_key, kind, share_hash, file_path, output_path).
+
+    Renditions made before the index existed are adopted here, so the LRU sees them too.
+    """
+    if not entries:
+        return
+    now = int(time.time())
+    with _transcode_conn() as conn:
+        for cache_key, kind, share_hash, file_path, output_path in entries:
+            cur = conn.execute(
+                "UPDATE proxy_cache_entries SET last_access_at = ? WHERE cache_key = ? AND last_access_at < ?",
+                (now, cache_key, now - PROXY_CACHE_TOUCH_INTERVAL_SECONDS),
+            )
+            if cur.rowcount:
+                continue
+            output_size = _dir_size(output_path) if os.path.isdir(output_path) else os.path.getsize(output_path)
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO proxy_cache_entries (
+                    cache_key, kind, share_hash, file_path, output_size, profile, created_at, last_access_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (cache_key, kind, share_hash, file_path, output_size, _cache_profile(kind), now, now),
+            )
+
+
+def _get_cache_entry(cache_key: str) -> dict | None:
+    try:
+        with _transcode_conn() as conn:
+            row = conn.execute("SELECT * FROM proxy_cache_entries WHERE cache_key = ?", (cache_key,)).fetchone()
+    except Exception as e:
+        app.logger.warning("Failed to read cache entry %s: %s", cache_key, e)
+        return None
+    return dict(row) if row else None
+
+
+_proxy_cache_sweep_lock = threading.Lock()
+_last_proxy_cache_sweep_at: float = 0.0
+PROXY_CACHE_REPORT_PATH = f"{TRANSCODE_DB_PATH}.cache-sweep.json"
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _lock_is_free(lock_path: str) -> bool:
+    """True if no encode holds the flock on `lock_path` (a missing lock file counts as free)."""
+    try:
+        fd = os.open(lock_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def _remove_cache_path(path: str) -> int:
+    """Delete a cached file or HLS directory and return the bytes freed."""
+    try:
+        if os.path.isdir(path):
+            size = _dir_size(path)
+            shutil.rmtree(path)
+        else:
+            size = os.path.getsize(path)
+            os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return size
+
+
+def _scan_proxy_cache(now: float) -> tuple[dict[str, dict], list[str]]:
+    """Return finished renditions by cache key, and temp/lock/partial paths that are safe to delete."""
+    renditions: dict[str, dict] = {}
+    orphans: list[str] = []
+
+    def is_orphan(path: str, lock_path: str, mtime: float) -> bool:
+        return now - mtime > PROXY_CACHE_ORPHAN_SECONDS and _lock_is_free(lock_path)
+
+    for base, is_hls in ((PROXY_CACHE_DIR, False), (HLS_CACHE_DIR, True)):
+        try:
+            entries = list(os.scandir(base))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            name = entry.name
+
+            if is_hls and entry.is_dir():
+                if _hls_is_complete(entry.path):
+                    renditions[name] = {"path": entry.path, "size": _dir_size(entry.path), "mtime": mtime}
+                elif is_orphan(entry.path, entry.path + ".lock", mtime):
+                    orphans.append(entry.path)
+            elif not is_hls and entry.is_dir() and name.endswith(".mp4.chunks"):
+                # Chunk work directory left behind by a chunked encode that was killed mid-way.
+                if is_orphan(entry.path, entry.path[: -len(".chunks")] + ".lock", mtime):
+                    orphans.append(entry.path)
+            elif not entry.is_file():
+                continue
+            elif not is_hls and name.endswith(".mp4"):
+                renditions[name[: -len(".mp4")]] = {"path": entry.path, "size": entry.stat().st_size, "mtime": mtime}
+            elif name.endswith((".mp4.tmp", ".mp4.live")):
+                if is_orphan(entry.path, entry.path.rsplit(".", 1)[0] + ".lock", mtime):
+                    orphans.append(entry.path)
+            elif name.endswith(".lock"):
+                # Lock files are re-opened (and so re-touched) on every encode attempt.
+                if is_orphan(entry.path, entry.path, mtime):
+                    orphans.append(entry.path)
+
+    return renditions, orphans
+
+
+def _expired_share_hashes(now: float) -> set[str]:
+    """Share hashes whose FileBrowser share has expired, per `target_expire` on every alias pointing at them."""
+    never = 1 << 62
+    with _aliases_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT to_hash FROM share_aliases
+            GROUP BY to_hash
+            HAVING MAX(CASE WHEN target_expire > 0 THEN target_expire ELSE ? END) < ?
+            """,
+            (never, int(now)),
+        ).fetchall()
+    return {str(row["to_hash"]) for row in rows}
+
+
+def _run_proxy_cache_sweep(now: float) -> dict:
+    report = {
+        "orphans_removed": 0,
+        "expired_removed": 0,
+        "stale_removed": 0,
+        "evicted": 0,
+        "bytes_freed": 0,
+    }
+
+    renditions, orphans = _scan_proxy_cache(now)
+    for path in orphans:
+        report["bytes_freed"] += _remove_cache_path(path)
+        report["orphans_removed"] += 1
+
+    with _transcode_conn() as conn:
+        index = {str(row["cache_key"]): dict(row) for row in conn.execute("SELECT * FROM proxy_cache_entries")}
+        gone = [key for key in index if key not in renditions]
+        conn.executemany("DELETE FROM proxy_cache_entries WHERE cache_key = ?", [(key,) for key in gone])
+
+    try:
+        expired = _expired_share_hashes(now)
+    except Exception as e:
+        app.logger.warning("Failed to read share expiry for cache sweep: %s", e)
+        expired = set()
+    current_profiles = {kind: _cache_profile(kind) for kind in ("fast", "preview", "hd", "hls")}
+
+    def drop(key: str, counter: str) -> bool:
+        item = renditions[key]
+        # Never pull a rendition out from under an encode that still holds its lock.
+        if not _lock_is_free(item["path"] + ".lock"):
+            return False
+        report["bytes_freed"] += _remove_cache_path(item["path"])
+        report[counter] += 1
+        with _transcode_conn() as conn:
+            conn.execute("DELETE FROM proxy_cache_entries WHERE cache_key = ?", (key,))
+        del renditions[key]
+        return True
+
+    def all_shares_expired(entry: dict) -> bool:
+        # Renditions are shared by every share of the same content; keep them while any of those is live.
+        if entry["share_hash"] not in expired:
+            return False
+        with _transcode_conn() as conn:
+            rows = conn.execute(
+                """
+                SELECT DISTINCT other.share_hash FROM source_identity AS mine
+                JOIN source_identity AS other ON other.content_id = mine.content_id
+                WHERE mine.share_hash = ? AND mine.file_path = ?
+                """,
+                (entry["share_hash"], entry["file_path"]),
+            ).fetchall()
+        return all(str(row["share_hash"]) in expired for row in rows)
+
+    for key in list(renditions):
+        entry = index.get(key)
+        if not entry:
+            # A view would have adopted it into the index, so nothing vouches for its key still being current.
+            if now - renditions[key]["mtime"] > PROXY_CACHE_UNINDEXED_GRACE_SECONDS:
+                drop(key, "stale_removed")
+            continue
+        if all_shares_expired(entry):
+            drop(key, "expired_removed")
+        elif entry.get("profile") and entry["profile"] != current_profiles.get(entry["kind"]):
+            drop(key, "stale_removed")
+
+    total = sum(item["size"] for item in renditions.values())
+    if PROXY_CACHE_MAX_BYTES > 0 and total > PROXY_CACHE_MAX_BYTES:
+        # Evict down to 90% of the quota so the next few encodes do not immediately trigger another round.
+        target = int(PROXY_CACHE_MAX_BYTES * 0.9)
+
+        def last_used(key: str) -> float:
+            entry = index.get(key) or {}
+            return float(entry.get("last_access_at") or entry.get("created_at") or renditions[key]["mtime"])
+
+        for key in sorted(renditions, key=last_used):
+            if total <= target:
+                break
+            if now - last_used(key) < PROXY_CACHE_MIN_IDLE_SECONDS:
+                continue
+            size = renditions[key]["size"]
+            if drop(key, "evicted"):
+                total -= size
+
+    try:
+        report["identities_removed"] = _prune_source_identity(expired)
+    except Exception as e:
+        app.logger.warning("Source identity prune failed: %s", e)
+
+    try:
+        report["zip"] = _sweep_zip_cache(now, expired)
+    except Exception as e:
+        app.logger.warning("ZIP artifact sweep failed: %s", e)
+
+    report["total_bytes"] = total
+    report["renditions"] = len(renditions)
+    report["max_bytes"] = PROXY_CACHE_MAX_BYTES or None
+    report["finished_at"] = int(time.time())
+    return report
+
+
+def _prune_source_identity(expired: set[str]) -> int:
+    """Forget identities of replaced file versions, and of expired shares with no renditions left in the index."""
+    with _transcode_conn() as conn:
+        removed = conn.execute(
+            """
+            DELETE FROM source_identity
+            WHERE EXISTS (
+                SELECT 1 FROM source_identity AS newer
+                WHERE newer.share_hash = source_identity.share_hash
+                    AND newer.file_path = source_identity.file_path
+                    AND newer.created_at > source_identity.created_at
+            )
+            """
+        ).rowcount
+        for share_hash in expired:
+            removed += conn.execute(
+                """
+                DELETE FROM source_identity
+                WHERE share_hash = ? AND NOT EXISTS (
+                    SELECT 1 FROM proxy_cache_entries AS entry
+                    WHERE entry.share_hash = source_identity.share_hash
+                        AND entry.file_path = source_identity.file_path
+                )
+                """,
+                (share_hash,),
+            ).rowcount
+    return removed
+
+
+def _sweep_proxy_cache(*, force: bool = False) -> dict | None:
+    """Run the cache manager if it is due (or `force`); returns its report, or None if skipped."""
+    global _last_proxy_cache_sweep_at
+
+    with _proxy_cache_sweep_lock:
+        now = time.time()
+        if not force and now - _last_proxy_cache_sweep_at < PROXY_CACHE_SWEEP_SECONDS:
+            return None
+        _last_proxy_cache_sweep_at = now
+
+        # One sweep at a time across processes; whoever loses the race just skips this round.
+        with open(f"{TRANSCODE_DB_PATH}.cache-sweep.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            report = _run_proxy_cache_sweep(now)
+
+        # Sweeps run in the transcode worker; keep the last report where the web workers can read it.
+        tmp_path = PROXY_CACHE_REPORT_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f)
+        os.replace(tmp_path, PROXY_CACHE_REPORT_PATH)
+
+        zip_report = report.get("zip") or {}
+        if any(report[k] for k in ("orphans_removed", "expired_removed", "stale_removed", "evicted")) or any(
+            zip_report.get(k) for k in ("removed", "evicted")
+        ):
+            app.logger.info("proxy cache sweep: %s", report)
+        return report
+
+
+def _read_proxy_cache_report() -> dict | None:
+    try:
+        with open(PROXY_CACHE_REPORT_PATH) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return report if isinstance(report, dict) else None
+
+
+_prefetch_lock = threading.Lock()
+_last_prefetch_at: float = 0.0
+PREFETCH_REPORT_PATH = f"{TRANSCODE_DB_PATH}.prefetch.json"
+
+
+def _prefetch_activity_scores(now: float) -> tuple[dict[str, float], dict[tuple[str, str], float]]:
+    """Recency-weighted activity from `download_events`, per source share and per (source share, file)."""
+    since = int(now - PREFETCH_WINDOW_HOURS * 3600)
+    with _analytics_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT share_hash, file_path, event_type, created_at / 3600 AS hour, COUNT(*) AS n
+            FROM download_events
+            WHERE created_at >= ? AND event_type IN ('gallery_view', 'file_download')
+            GROUP BY share_hash, file_path, event_type, hour
+            """,
+            (since,),
+        ).fetchall()
+
+    half_life = max(1.0, PREFETCH_HALF_LIFE_HOURS) * 3600
+    sources: dict[str, str] = {}
+    share_scores: dict[str, float] = {}
+    file_scores: dict[tuple[str, str], float] = {}
+    for row in rows:
+        share_hash = str(row["share_hash"])
+        if share_hash not in sources:
+            sources[share_hash] = _resolve_share_hash(share_hash)
+        source_hash = sources[share_hash]
+
+        weight = PREFETCH_DOWNLOAD_WEIGHT if row["event_type"] == "file_download" else 1.0
+        score = weight * int(row["n"]) * 0.5 ** (max(0.0, now - int(row["hour"]) * 3600) / half_life)
+        if row["file_path"]:
+            key = (source_hash, str(row["file_path"]))
+            file_scores[key] = file_scores.get(key, 0.0) + score
+        else:
+            share_scores[source_hash] = share_scores.get(source_hash, 0.0) + score
+    return share_scores, file_scores
+
+
+def _prefetch_candidates(now: float) -> list[tuple[float, str, str]]:
+    """The PREFETCH_TOP_N videos most likely to be opened next, as `(score, source_hash, path)`."""
+    share_scores, file_scores = _prefetch_activity_scores(now)
+
+    scores = {
+        key: score
+        for key, score in file_scores.items()
+        if os.path.splitext(key[1])[1].lstrip(".").lower() in VIDEO_EXTS
+    }
+
+    # A gallery view is interest in the whole share; spread it over the share's videos.
+    top_shares = sorted(share_scores.items(), key=lambda item: item[1], reverse=True)[: max(1, PREFETCH_TOP_N)]
+    for source_hash, share_score in top_shares:
+        files = _get_share_files(
+            source_hash,
+            source_hash=source_hash,
+            force_refresh=False,
+            max_age_seconds=DEFAULT_CACHE_TTL_SECONDS,
+        )
+        videos = [f["path"] for f in files or [] if f.get("type") == "video"]
+        for path in videos:
+            key = (source_hash, path)
+            scores[key] = scores.get(key, 0.0) + share_score / len(videos)
+
+    ranked = sorted(((score, share, path) for (share, path), score in scores.items()), reverse=True)
+    return ranked[: max(0, PREFETCH_TOP_N)]
+
+
+def _prefetch_budget_blocker() -> str | None:
+    """Why prefetching should wait right now (busy CPU or queue, cache over budget, low disk), or None."""
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        load = 0.0
+    if load > PREFETCH_MAX_LOAD:
+        return f"load {load:.2f} per cpu"
+
+    with _transcode_conn() as conn:
+        busy = conn.execute("SELECT COUNT(*) FROM transcode_jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        cached = conn.execute("SELECT COALESCE(SUM(output_size), 0) FROM proxy_cache_entries").fetchone()[0]
+    if busy:
+        return f"{busy} transcode job(s) pending"
+    if PREFETCH_MAX_CACHE_BYTES > 0 and cached >= PREFETCH_MAX_CACHE_BYTES:
+        return f"cache at {cached} bytes"
+
+    free = shutil.disk_usage(PROXY_CACHE_DIR).free
+    if free < PREFETCH_MIN_FREE_BYTES:
+        return f"{free} bytes free"
+    return None
+
+
+def _run_prefetch(now: float) -> dict:
+    report: dict = {"checked_at": int(now), "skipped": None, "candidates": 0, "enqueued": []}
+    # Popularity comes from the analytics events, so there is nothing to rank with analytics off.
+    blocker = "analytics disabled" if not ANALYTICS_ENABLED else _prefetch_budget_blocker()
+    if blocker:
+        report["skipped"] = blocker
+        return report
+
+    candidates = _prefetch_candidates(now)
+    report["candidates"] = len(candidates)
+    for score, source_hash, path in candidates:
+        if len(report["enqueued"]) >= PREFETCH_BATCH:
+            break
+
+        meta = _fetch_public_share_json(source_hash, subpath="/" + path)
+        if not meta or isinstance(meta.get("items"), list) or parse_bool(meta.get("isDir")):
+            continue
+        size = int(meta.get("size") or 0)
+        modified = meta.get("modified") if isinstance(meta.get("modified"), str) else None
+        kwargs = {"share_hash": source_hash, "file_path": path, "size": size, "modified": modified}
+
+        proxy_key = _proxy_cache_key(**kwargs)
+        proxy_ready = os.path.exists(os.path.join(PROXY_CACHE_DIR, f"{proxy_key}.mp4"))
+        hd_key = _hd_cache_key(**kwargs)
+        hd_ready = not PREFETCH_HD or os.path.exists(os.path.join(PROXY_CACHE_DIR, f"{hd_key}.mp4"))
+
+        original_ready = _stream_ready_original(path, size)
+        if original_ready:
+            hd_ready = True
+            proxy_ready = proxy_ready or original_ready["fast"]
+
+        if not proxy_ready and not hd_ready:
+            job_id, kind = _fast_hd_job_id(proxy_key, hd_key), "fast+hd"
+        elif not proxy_ready:
+            job_id, kind = f"fast:{proxy_key}", "fast"
+        elif not hd_ready:
+            job_id, kind = f"hd:{hd_key}", "hd"
+        else:
+            continue
+
+        if _enqueue_transcode_job(job_id=job_id, kind=kind, priority="prewarm", **kwargs):
+            report["enqueued"].append({"share_hash": source_hash, "path": path, "kind": kind, "score": round(score, 3)})
+
+    return report
+
+
+def _prefetch_popular_videos(*, force: bool = False) -> dict | None:
+    """Queue prewarm jobs for popular videos if due (or `force`); returns the run's report, or None if skipped."""
+    global _last_prefetch_at
+
+    if not PREFETCH_ENABLED and not force:
+        return None
+
+    with _prefetch_lock:
+        now = time.time()
+        if not force and now - _last_prefetch_at < PREFETCH_INTERVAL_SECONDS:
+            return None
+        _last_prefetch_at = now
+
+        with open(f"{TRANSCODE_DB_PATH}.prefetch.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            report = _run_prefetch(now)
+
+        tmp_path = PREFETCH_REPORT_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f)
+        os.replace(tmp_path, PREFETCH_REPORT_PATH)
+
+        if report["enqueued"]:
+            app.logger.info("prefetch: %s", report)
+        return report
+
+
+def _read_prefetch_report() -> dict | None:
+    try:
+        with open(PREFETCH_REPORT_PATH) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return report if isinstance(report, dict) else None
+
+
+def _ffmpeg_fast_hd_cmd(*, src_url: str, fast_path: str, hd_path: str, fast_fragmented: bool) -> list[str]:
+    """One decode, two encodes: the fast proxy and the HD transcode as separate outputs."""
+    hd_scale = _hd_scale_filter()
+    filter_complex = f"[0:v:0]split=2[fast][hd];[fast]{_proxy_scale_filter()}[fastv];" + (
+        f"[hd]{hd_scale}[hdv]" if hd_scale else "[hd]null[hdv]"
+    )
+    return (
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-nostdin",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            src_url,
+            "-filter_complex",
+            filter_complex,
+            "-map",
+            "[fastv]",
+            "-map",
+            "0:a?",
+            "-sn",
+        ]
+        + _proxy_output_args(dst_path=fast_path, fragmented=fast_fragmented)
+        + ["-map", "[hdv]", "-map", "0:a?", "-sn"]
+        + _hd_transcode_output_args(dst_path=hd_path)
+    )
+
+
+def _fast_hd_job_id(proxy_key: str, hd_key: str) -> str:
+    return f"fast+hd:{proxy_key}:{hd_key}"
+
+
+def _ensure_fast_and_hd_mp4(
     *,
     share_hash: str,
     file_path: str,
     size: int,
     modified: str | None = None,
+    progress=None,
 ) -> tuple[str, str, str, int | None]:
-    cache_key = _proxy_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
-    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
-    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+    """Produce both the fast proxy and the HD MP4, decoding the source once when HD needs a transcode."""
+    proxy_key = _proxy_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    proxy_path = os.path.join(PROXY_CACHE_DIR, f"{proxy_key}.mp4")
+    hd_key = _hd_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    hd_path = os.path.join(PROXY_CACHE_DIR, f"{hd_key}.mp4")
+    kwargs = {"share_hash": share_hash, "file_path": file_path, "size": size, "modified": modified}
+
+    def finish():
+        # Whatever is still missing (or was skipped by the shared encode) goes through the single-output path.
+        _ensure_fast_proxy_mp4(**kwargs, progress=progress)
+        return _ensure_hd_mp4(**kwargs, progress=progress)
+
+    if os.path.exists(proxy_path) or os.path.exists(hd_path):
+        return finish()
+
+    src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+    summary = _source_media_summary(src_url=src_url, file_path=file_path, size=size)
+    hd_strategy, hd_reason = _choose_hd_strategy(summary)
+    if hd_strategy != "transcode":
+        # HD is a remux here, so there is no second decode to save.
+        return finish()
+    if _chunked_encode_eligible(summary.get("duration") if summary else None):
+        # For long sources, HD as parallel chunks after the (live) fast encode beats one shared serial decode.
+        return finish()
+
+    # Same lock files as the single-output paths; always fast before HD.
+    with open(proxy_path + ".lock", "w") as fast_lock, open(hd_path + ".lock", "w") as hd_lock:
+        fcntl.flock(fast_lock, fcntl.LOCK_EX)
+        fcntl.flock(hd_lock, fcntl.LOCK_EX)
+
+        if os.path.exists(proxy_path) or os.path.exists(hd_path):
+            return finish()
+
+        fast_tmp = proxy_path + ".tmp"
+        fast_live = _proxy_live_path(proxy_path)
+        hd_tmp = hd_path + ".tmp"
+        for stale in (fast_tmp, fast_live, hd_tmp):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
 
-    if os.path.exists(output_path):
-        return cache_key, output_path, public_url, os.path.getsize(output_path)
+        fast_encode_path = fast_live if PROXY_LIVE_ENABLED else fast_tmp
+        cmd = _ffmpeg_fast_hd_cmd(
+            src_url=src_url,
+            fast_path=fast_encode_path,
+            hd_path=hd_tmp,
+            fast_fragmented=PROXY_LIVE_ENABLED,
+        )
+        on_progress = _bind_duration(progress, src_url, summary.get("duration") if summary else None)
+        result = None
+        try:
+            with _hd_sema:
+                result = _run_ffmpeg(cmd, timeout=HD_FFMPEG_TIMEOUT_SECONDS, on_progress=on_progress)
+        except subprocess.TimeoutExpired:
+            app.logger.error("ffmpeg fast+hd timed out for %s", file_path)
+        except TranscodeCancelled:
+            for path in (fast_encode_path, hd_tmp):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            raise
+
+        if result is not None and result.returncode == 0:
+            # Publish fast first, before the HD finalizing; viewers have been streaming its `.live` file meanwhile.
+            _publish_fast_proxy(file_path=file_path, output_path=proxy_path, fragmented=PROXY_LIVE_ENABLED)
+            _record_cache_entry(
+                cache_key=proxy_key,
+                kind="fast",
+                share_hash=share_hash,
+                file_path=file_path,
+                output_path=proxy_path,
+                strategy="transcode",
+                reason="shared decode with HD",
+            )
+            _drop_preview_clip(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+            os.replace(hd_tmp, hd_path)
+            _record_cache_entry(
+                cache_key=hd_key,
+                kind="hd",
+                share_hash=share_hash,
+                file_path=file_path,
+                output_path=hd_path,
+                strategy="transcode",
+                reason=f"{hd_reason}; shared decode with fast proxy",
+            )
+        else:
+            if result is not None:
+                app.logger.error(
+                    "ffmpeg fast+hd failed for %s: %s", file_path, result.stderr.decode(errors="replace")
+                )
+            for path in (fast_encode_path, hd_tmp):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
 
-    lock_path = output_path + ".lock"
-    with open(lock_path, "w") as lock_file:
-        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return finish()
 
-        if os.path.exists(output_path):
-            return cache_key, output_path, public_url, os.path.getsize(output_path)
 
-        tmp_path = output_path + ".tmp"
+def _hls_cache_key(*, share_hash: str, file_path: str, size: int, modified: str | None = None) -> str:
+    content_id = _source_content_id(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    key = f"hls:{_cache_profile('hls')}:{content_id}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _hls_paths(cache_key: str) -> tuple[str, str, str]:
+    """Return (output_dir, master_playlist_path, public_url) for an HLS cache key."""
+    output_dir = os.path.join(HLS_CACHE_DIR, cache_key)
+    return output_dir, os.path.join(output_dir, "master.m3u8"), f"/api/proxy-cache/hls/{cache_key}/master.m3u8"
+
+
+def _hls_is_complete(output_dir: str) -> bool:
+    return os.path.exists(os.path.join(output_dir, ".done"))
+
+
+def _parse_hls_ladder(value: str) -> list[tuple[int, str]]:
+    rungs: list[tuple[int, str]] = []
+    for part in (value or "").split(","):
+        dim, _, bitrate = part.strip().partition(":")
         try:
-            os.remove(tmp_path)
-        except FileNotFoundError:
-            pass
+            dim_int = int(dim)
+        except ValueError:
+            continue
+        bitrate = bitrate.strip()
+        if dim_int > 0 and bitrate:
+            rungs.append((dim_int, bitrate))
+    rungs.sort(key=lambda r: r[0], reverse=True)
+    return rungs
 
-        src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
 
-        with _proxy_sema:
-            cmd = _ffmpeg_proxy_cmd(src_url=src_url, dst_path=tmp_path)
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=PROXY_FFMPEG_TIMEOUT_SECONDS,
-            )
+def _hls_ladder_for_source(probe: dict | None) -> tuple[list[tuple[int, str]], bool]:
+    """Pick the rungs that do not upscale the source, and whether the source has audio."""
+    rungs = _parse_hls_ladder(HLS_LADDER) or [(1280, "3000k")]
 
-        if result.returncode != 0:
-            app.logger.error(
-                "ffmpeg proxy failed for %s: %s",
-                file_path,
-                result.stderr.decode(errors="replace"),
-            )
+    streams = probe.get("streams") if isinstance(probe, dict) else None
+    streams = streams if isinstance(streams, list) else []
+    has_audio = any(isinstance(st, dict) and st.get("codec_type") == "audio" for st in streams)
+
+    src_dim = 0
+    for st in streams:
+        if isinstance(st, dict) and st.get("codec_type") == "video":
             try:
-                os.remove(tmp_path)
-            except OSError:
-                pass
-            raise RuntimeError("Proxy generation failed")
+                src_dim = max(int(st.get("width") or 0), int(st.get("height") or 0))
+            except (TypeError, ValueError):
+                src_dim = 0
+            break
 
-        os.replace(tmp_path, output_path)
-        return cache_key, output_path, public_url, os.path.getsize(output_path)
+    if src_dim > 0:
+        fitting = [r for r in rungs if r[0] <= src_dim]
+        # Always keep one rung; the scale filter caps it at the source size instead of upscaling.
+        rungs = fitting or rungs[-1:]
+    return rungs, has_audio
 
 
-def _ffmpeg_hd_remux_cmd(*, src_url: str, dst_path: str) -> list[str]:
-    return [
+def _ffmpeg_hls_cmd(*, src_url: str, output_dir: str, rungs: list[tuple[int, str]], has_audio: bool) -> list[str]:
+    splits = "".join(f"[v{i}]" for i in range(len(rungs)))
+    filters = [f"[0:v:0]split={len(rungs)}{splits}"]
+    for i, (dim, _) in enumerate(rungs):
+        filters.append(
+            f"[v{i}]scale='if(gt(iw,ih),min({dim},iw),-2)':'if(gt(iw,ih),-2,min({dim},ih))'[v{i}o]"
+        )
+
+    cmd = [
         "ffmpeg",
         "-hide_banner",
         "-nostdin",
@@ -1117,185 +4126,663 @@ def _ffmpeg_hd_remux_cmd(*, src_url: str, dst_path: str) -> list[str]:
         "-y",
         "-i",
         src_url,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
-        "-sn",
-        "-c",
-        "copy",
-        "-movflags",
-        "+faststart",
-        "-f",
-        "mp4",
-        dst_path,
+        "-filter_complex",
+        ";".join(filters),
     ]
+    for i in range(len(rungs)):
+        cmd += ["-map", f"[v{i}o]"]
+    if has_audio:
+        for _ in rungs:
+            cmd += ["-map", "0:a:0"]
 
-
-def _ffmpeg_hd_copy_video_cmd(*, src_url: str, dst_path: str) -> list[str]:
-    return [
-        "ffmpeg",
-        "-hide_banner",
-        "-nostdin",
-        "-loglevel",
-        "error",
-        "-y",
-        "-i",
-        src_url,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
+    cmd += [
         "-sn",
         "-c:v",
-        "copy",
-        "-c:a",
-        "aac",
-        "-b:a",
-        str(HD_AAC_BITRATE),
-        "-movflags",
-        "+faststart",
+        "libx264",
+        "-preset",
+        HLS_H264_PRESET,
+        "-pix_fmt",
+        "yuv420p",
+        "-profile:v",
+        "high",
+        # Keyframes on segment boundaries keep every rung switchable at the same points.
+        "-force_key_frames",
+        f"expr:gte(t,n_forced*{max(1, HLS_SEGMENT_SECONDS)})",
+        "-sc_threshold",
+        "0",
+    ]
+    for i, (_, bitrate) in enumerate(rungs):
+        cmd += [f"-b:v:{i}", bitrate, f"-maxrate:v:{i}", bitrate, f"-bufsize:v:{i}", bitrate]
+    if has_audio:
+        cmd += ["-c:a", "aac", "-b:a", str(HLS_AAC_BITRATE)]
+
+    if has_audio:
+        var_stream_map = " ".join(f"v:{i},a:{i}" for i in range(len(rungs)))
+    else:
+        var_stream_map = " ".join(f"v:{i}" for i in range(len(rungs)))
+
+    cmd += [
         "-f",
-        "mp4",
-        dst_path,
+        "hls",
+        "-hls_time",
+        str(max(1, HLS_SEGMENT_SECONDS)),
+        # EVENT playlists only grow, so players can start on the first segments while encoding continues.
+        "-hls_playlist_type",
+        "event",
+        "-hls_segment_type",
+        "fmp4",
+        "-hls_flags",
+        "independent_segments+temp_file",
+        "-hls_fmp4_init_filename",
+        "init.mp4",
+        "-hls_segment_filename",
+        os.path.join(output_dir, "v%v", "seg_%05d.m4s"),
+        "-master_pl_name",
+        "master.m3u8",
+        "-var_stream_map",
+        var_stream_map,
+        os.path.join(output_dir, "v%v", "index.m3u8"),
     ]
+    return cmd
+
+
+def _ensure_hls(
+    *,
+    share_hash: str,
+    file_path: str,
+    size: int,
+    modified: str | None = None,
+    progress=None,
+) -> tuple[str, str, str, int | None]:
+    cache_key = _hls_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    output_dir, master_path, public_url = _hls_paths(cache_key)
+
+    if _hls_is_complete(output_dir):
+        return cache_key, master_path, public_url, None
+
+    lock_path = output_dir + ".lock"
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        if _hls_is_complete(output_dir):
+            return cache_key, master_path, public_url, None
+
+        # Anything left here without a `.done` marker is from an interrupted run.
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+        src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+
+        probe = _probe_source(src_url)
+        rungs, has_audio = _hls_ladder_for_source(probe)
+        on_progress = _bind_duration(progress, src_url, _duration_from_probe(probe))
+        if on_progress is not None:
+            report = on_progress
+            playable = False
+
+            def on_progress(out_time: float, speed: float | None) -> None:
+                nonlocal playable
+                # nginx serves the EVENT playlist straight from disk, so viewers on it send no heartbeat;
+                # once it is playable, finish the encode rather than delete segments someone may be watching.
+                if not playable and os.path.exists(master_path):
+                    _protect_transcode_job(f"hls:{cache_key}")
+                    playable = True
+                report(out_time, speed)
+
+        with _hd_sema:
+            cmd = _ffmpeg_hls_cmd(src_url=src_url, output_dir=output_dir, rungs=rungs, has_audio=has_audio)
+            try:
+                result = _run_ffmpeg(cmd, timeout=HLS_FFMPEG_TIMEOUT_SECONDS, on_progress=on_progress)
+            except (subprocess.TimeoutExpired, TranscodeCancelled):
+                shutil.rmtree(output_dir, ignore_errors=True)
+                raise
+
+        if result.returncode != 0:
+            app.logger.error("ffmpeg hls failed for %s: %s", file_path, result.stderr.decode(errors="replace"))
+            shutil.rmtree(output_dir, ignore_errors=True)
+            raise RuntimeError("HLS generation failed")
+
+        with open(os.path.join(output_dir, ".done"), "w") as f:
+            f.write(str(int(time.time())))
+        _record_cache_entry(
+            cache_key=cache_key,
+            kind="hls",
+            share_hash=share_hash,
+            file_path=file_path,
+            output_path=output_dir,
+            strategy="transcode",
+            reason=", ".join(f"{dim}:{bitrate}" for dim, bitrate in rungs),
+        )
+        return cache_key, master_path, public_url, None
+
+
+TRANSCODE_JOB_STATUSES = ("queued", "running", "done", "skipped", "failed", "cancelled")
+# Higher runs first: a viewer's preview clip > someone is waiting on the page > warming likely views.
+TRANSCODE_PRIORITIES = {"preview": 30, "interactive": 20, "prewarm": 10}
+# Preview clips may run this many jobs over TRANSCODE_MAX_RUNNING, so they never wait behind full encodes.
+TRANSCODE_PREVIEW_HEADROOM = 1
+
+_transcode_workers_lock = threading.Lock()
+_transcode_interest_at: dict[str, float] = {}
+_transcode_workers_pid: int | None = None
+_transcode_wakeup = threading.Event()
+_last_transcode_prune_at: float = 0.0
+
+
+class TranscodeCancelled(Exception):
+    """Raised from a job's progress callback to stop its ffmpeg once no viewer is waiting for it."""
+
+
+class TranscodeSkipped(Exception):
+    """Raised by a job handler when the source gets no output of that kind; the job stays `skipped`."""
+
+
+def _transcode_job_handlers() -> dict:
+    return {
+        "fast": _ensure_fast_proxy_mp4,
+        "hd": _ensure_hd_mp4,
+        "fast+hd": _ensure_fast_and_hd_mp4,
+        "hls": _ensure_hls,
+        "preview": _ensure_preview_clip,
+        "zip": _build_share_zip_artifact,
+    }
+
+
+def _enqueue_transcode_job(
+    *,
+    job_id: str,
+    kind: str,
+    share_hash: str,
+    file_path: str,
+    size: int,
+    modified: str | None = None,
+    priority: str = "interactive",
+) -> bool:
+    """Queue a job unless an identical one is already queued/running. Returns True if it was (re)queued.
+
+    Re-enqueueing a job that is still queued raises its priority if the new one is higher.
+    """
+    if kind not in _transcode_job_handlers():
+        raise ValueError(f"Unknown transcode job kind: {kind}")
+    if priority not in TRANSCODE_PRIORITIES:
+        raise ValueError(f"Unknown transcode priority: {priority}")
+    priority_value = TRANSCODE_PRIORITIES[priority]
+    # Prewarm work is wanted regardless of viewers, so it is never cancelled for lack of interest.
+    protected = 1 if priority_value < TRANSCODE_PRIORITIES["interactive"] else 0
+    # The identity the caller's cache keys were derived from; the worker reuses it rather than re-deriving.
+    content_id = (
+        None
+        if kind == "zip"
+        else _source_content_id(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
+    )
+
+    now = int(time.time())
+    with _transcode_conn() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO transcode_jobs (
+                id, kind, share_hash, file_path, size, modified, content_id, status, attempts, max_attempts,
+                priority, protected, last_interest_at, created_at, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', 0, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                share_hash = excluded.share_hash,
+                file_path = excluded.file_path,
+                size = excluded.size,
+                modified = excluded.modified,
+                content_id = excluded.content_id,
+                status = 'queued',
+                attempts = 0,
+                max_attempts = excluded.max_attempts,
+                priority = excluded.priority,
+                protected = excluded.protected,
+                last_interest_at = excluded.last_interest_at,
+                lease_owner = NULL,
+                lease_expires_at = NULL,
+                error = NULL,
+                created_at = excluded.created_at,
+                updated_at = excluded.updated_at,
+                started_at = NULL,
+                finished_at = NULL
+            WHERE transcode_jobs.status IN ('done', 'cancelled')
+                OR (transcode_jobs.status = 'failed' AND transcode_jobs.finished_at < ?)
+            """,
+            (
+                job_id,
+                kind,
+                share_hash,
+                file_path,
+                size,
+                modified,
+                content_id,
+                max(1, TRANSCODE_JOB_MAX_ATTEMPTS),
+                priority_value,
+                protected,
+                now,
+                now,
+                now,
+                now - TRANSCODE_JOB_RETRY_FAILED_AFTER_SECONDS,
+            ),
+        )
+        queued = cur.rowcount > 0
+        if not queued:
+            conn.execute(
+                "UPDATE transcode_jobs SET priority = ? WHERE id = ? AND status = 'queued' AND priority < ?",
+                (priority_value, job_id, priority_value),
+            )
+            conn.execute(
+                """
+                UPDATE transcode_jobs SET protected = MAX(protected, ?), last_interest_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+                """,
+                (protected, now, job_id),
+            )
+
+    if queued:
+        _transcode_wakeup.set()
+    return queued
+
+
+def _transcode_job_statuses(job_ids: list[str]) -> dict[str, str]:
+    placeholders = ",".join("?" for _ in job_ids)
+    with _transcode_conn() as conn:
+        rows = conn.execute(
+            f"SELECT id, status FROM transcode_jobs WHERE id IN ({placeholders})", tuple(job_ids)
+        ).fetchall()
+    return {str(row["id"]): str(row["status"]) for row in rows}
+
+
+def _supersede_queued_transcode_jobs(job_ids: list[str], *, by_job_id: str) -> None:
+    """Cancel jobs still waiting in the queue whose outputs `by_job_id` now produces."""
+    now = int(time.time())
+    placeholders = ",".join("?" for _ in job_ids)
+    with _transcode_conn() as conn:
+        conn.execute(
+            f"""
+            UPDATE transcode_jobs SET status = 'cancelled', error = ?, finished_at = ?, updated_at = ?
+            WHERE id IN ({placeholders}) AND status = 'queued'
+            """,
+            (f"superseded by {by_job_id}", now, now, *job_ids),
+        )
+
+
+def _claim_transcode_job(owner: str) -> dict | None:
+    now = int(time.time())
+    with _transcode_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            min_priority = min(TRANSCODE_PRIORITIES.values())
+            counts = {
+                int(row["is_zip"]): int(row["count"] or 0)
+                for row in conn.execute(
+                    """
+                    SELECT kind = 'zip' AS is_zip, COUNT(*) AS count FROM transcode_jobs
+                    WHERE status = 'running' AND lease_expires_at >= ? GROUP BY 1
+                    """,
+                    (now,),
+                )
+            }
+            # Encodes and ZIP builds have separate budgets, so a big archive never holds up a viewer's encode.
+            encodes_ok = True
+            if TRANSCODE_MAX_RUNNING > 0:
+                running = counts.get(0, 0)
+                if running >= TRANSCODE_MAX_RUNNING + TRANSCODE_PREVIEW_HEADROOM:
+                    encodes_ok = False
+                elif running >= TRANSCODE_MAX_RUNNING:
+                    min_priority = TRANSCODE_PRIORITIES["preview"]
+            zips_ok = counts.get(1, 0) < max(1, ZIP_CACHE_MAX_BUILDS)
+            if not encodes_ok and not zips_ok:
+                conn.execute("COMMIT")
+                return None
+
+            if TRANSCODE_ABANDON_GRACE_SECONDS > 0:
+                conn.execute(
+                    """
+                    UPDATE transcode_jobs
+                    SET status = 'cancelled', error = 'no viewer interest', finished_at = ?, updated_at = ?
+                    WHERE status = 'queued' AND protected = 0 AND last_interest_at < ?
+                    """,
+                    (now, now, now - TRANSCODE_ABANDON_GRACE_SECONDS),
+                )
+
+            while True:
+                row = conn.execute(
+                    """
+                    SELECT * FROM transcode_jobs
+                    WHERE (status = 'queued' OR (status = 'running' AND lease_expires_at < ?))
+                        AND ((kind != 'zip' AND ? AND priority >= ?) OR (kind = 'zip' AND ?))
+                    ORDER BY priority DESC, created_at, rowid
+                    LIMIT 1
+                    """,
+                    (now, encodes_ok, min_priority, zips_ok),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                if row["status"] == "running" and int(row["attempts"] or 0) >= int(row["max_attempts"] or 1):
+                    conn.execute(
+                        """
+                        UPDATE transcode_jobs
+                        SET status = 'failed', error = ?, lease_owner = NULL, lease_expires_at = NULL,
+                            finished_at = ?, updated_at = ?
+                        WHERE id = ?
+                        """,
+                        ("lease expired", now, now, row["id"]),
+                    )
+                    continue
+
+                conn.execute(
+                    """
+                    UPDATE transcode_jobs
+                    SET status = 'running', attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?,
+                        started_at = ?, updated_at = ?, progress_seconds = NULL, speed = NULL
+                    WHERE id = ?
+                    """,
+                    (owner, now + TRANSCODE_JOB_LEASE_SECONDS, now, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                job = dict(row)
+                job["attempts"] = int(row["attempts"] or 0) + 1
+                return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
 
 
-def _ffmpeg_hd_transcode_cmd(*, src_url: str, dst_path: str) -> list[str]:
-    cmd = [
-        "ffmpeg",
-        "-hide_banner",
-        "-nostdin",
-        "-loglevel",
-        "error",
-        "-y",
-        "-i",
-        src_url,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
-        "-sn",
-    ]
+def _renew_transcode_lease(job_id: str, owner: str) -> bool:
+    now = int(time.time())
+    with _transcode_conn() as conn:
+        cur = conn.execute(
+            """
+            UPDATE transcode_jobs SET lease_expires_at = ?, updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'running'
+            """,
+            (now + TRANSCODE_JOB_LEASE_SECONDS, now, job_id, owner),
+        )
+        return cur.rowcount > 0
 
-    if HD_MAX_DIMENSION and HD_MAX_DIMENSION > 0:
-        scale = (
-            f"scale='if(gt(iw,ih),min({HD_MAX_DIMENSION},iw),-2)':'if(gt(iw,ih),-2,min({HD_MAX_DIMENSION},ih))'"
+
+def _finish_transcode_job(
+    job: dict, owner: str, error: str | None = None, *, cancelled: bool = False, skipped: bool = False
+) -> None:
+    now = int(time.time())
+    if error is None:
+        status = "done"
+    elif skipped:
+        status = "skipped"
+    elif cancelled:
+        status = "cancelled"
+    elif int(job.get("attempts") or 0) < int(job.get("max_attempts") or 1):
+        status = "queued"
+    else:
+        status = "failed"
+
+    with _transcode_conn() as conn:
+        conn.execute(
+            """
+            UPDATE transcode_jobs
+            SET status = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?,
+                finished_at = CASE WHEN ? = 'queued' THEN NULL ELSE ? END
+            WHERE id = ? AND lease_owner = ?
+            """,
+            (status, error, now, status, now, job["id"], owner),
         )
-        cmd += ["-vf", scale]
 
-    cmd += [
-        "-c:v",
-        "libx264",
-        "-preset",
-        HD_H264_PRESET,
-        "-crf",
-        str(HD_CRF),
-        "-pix_fmt",
-        "yuv420p",
-        "-profile:v",
-        "high",
-        "-g",
-        "60",
-        "-keyint_min",
-        "60",
-        "-sc_threshold",
-        "0",
-        "-c:a",
-        "aac",
-        "-b:a",
-        str(HD_AAC_BITRATE),
-        "-movflags",
-        "+faststart",
-        "-f",
-        "mp4",
-        dst_path,
-    ]
-    return cmd
 
+def _prune_transcode_jobs() -> None:
+    global _last_transcode_prune_at
 
-def _ensure_hd_mp4(
-    *,
-    share_hash: str,
-    file_path: str,
-    size: int,
-    modified: str | None = None,
-) -> tuple[str, str, str, int | None]:
-    cache_key = _hd_cache_key(share_hash=share_hash, file_path=file_path, size=size, modified=modified)
-    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
-    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+    now = time.time()
+    if now - _last_transcode_prune_at < 3600:
+        return
+    _last_transcode_prune_at = now
 
-    if os.path.exists(output_path):
-        return cache_key, output_path, public_url, os.path.getsize(output_path)
+    with _transcode_conn() as conn:
+        conn.execute(
+            "DELETE FROM transcode_jobs WHERE status IN ('done', 'skipped', 'failed', 'cancelled') AND finished_at < ?",
+            (int(now - TRANSCODE_JOB_RETENTION_SECONDS),),
+        )
 
-    lock_path = output_path + ".lock"
-    with open(lock_path, "w") as lock_file:
-        fcntl.flock(lock_file, fcntl.LOCK_EX)
 
-        if os.path.exists(output_path):
-            return cache_key, output_path, public_url, os.path.getsize(output_path)
+def _transcode_progress_reporter(job_id: str, owner: str):
+    last_report_at = 0.0
+
+    def report(out_time: float, duration: float | None, speed: float | None) -> None:
+        nonlocal last_report_at
+
+        now = time.time()
+        if now - last_report_at < TRANSCODE_PROGRESS_INTERVAL_SECONDS:
+            return
+        last_report_at = now
 
-        tmp_path = output_path + ".tmp"
         try:
-            os.remove(tmp_path)
-        except FileNotFoundError:
-            pass
+            with _transcode_conn() as conn:
+                conn.execute(
+                    """
+                    UPDATE transcode_jobs SET duration = ?, progress_seconds = ?, speed = ?, updated_at = ?
+                    WHERE id = ? AND lease_owner = ?
+                    """,
+                    (duration, out_time, speed, int(now), job_id, owner),
+                )
+                row = conn.execute(
+                    "SELECT protected, last_interest_at FROM transcode_jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+        except Exception as e:
+            app.logger.warning("Failed to record progress for %s: %s", job_id, e)
+            return
 
-        src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{share_hash}/{quote(file_path, safe='/')}?inline=true"
+        if (
+            TRANSCODE_ABANDON_GRACE_SECONDS > 0
+            and row is not None
+            and not row["protected"]
+            and row["last_interest_at"] is not None
+            and now - int(row["last_interest_at"]) > TRANSCODE_ABANDON_GRACE_SECONDS
+        ):
+            raise TranscodeCancelled(f"no viewer interest for {int(now - int(row['last_interest_at']))}s")
 
-        attempts = [
-            ("remux", _ffmpeg_hd_remux_cmd(src_url=src_url, dst_path=tmp_path)),
-            ("copy_video", _ffmpeg_hd_copy_video_cmd(src_url=src_url, dst_path=tmp_path)),
-            ("transcode", _ffmpeg_hd_transcode_cmd(src_url=src_url, dst_path=tmp_path)),
-        ]
+    return report
 
-        last_err = None
-        with _hd_sema:
-            for label, cmd in attempts:
-                try:
-                    result = subprocess.run(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        timeout=HD_FFMPEG_TIMEOUT_SECONDS,
-                    )
-                except subprocess.TimeoutExpired:
-                    last_err = f"{label}: timeout"
-                    continue
 
-                if result.returncode == 0:
-                    os.replace(tmp_path, output_path)
-                    return cache_key, output_path, public_url, os.path.getsize(output_path)
+def _protect_transcode_job(job_id: str) -> None:
+    """Exempt a job from cancellation for lack of interest, as prewarm jobs are."""
+    with _transcode_conn() as conn:
+        conn.execute("UPDATE transcode_jobs SET protected = 1 WHERE id = ?", (job_id,))
 
-                last_err = f"{label}: {result.stderr.decode(errors='replace')}"
-                try:
-                    os.remove(tmp_path)
-                except OSError:
-                    pass
 
-        if last_err:
-            app.logger.error("ffmpeg hd failed for %s: %s", file_path, last_err)
-        raise RuntimeError("HD generation failed")
+def _record_transcode_interest(job_ids: list[str]) -> None:
+    """Heartbeat from a viewer still waiting on these jobs (throttled per process)."""
+    now = time.time()
+    due = [job_id for job_id in job_ids if now - _transcode_interest_at.get(job_id, 0.0) >= TRANSCODE_INTEREST_TOUCH_SECONDS]
+    if not due:
+        return
+    if len(_transcode_interest_at) > 10000:
+        _transcode_interest_at.clear()
+    for job_id in due:
+        _transcode_interest_at[job_id] = now
+
+    placeholders = ",".join("?" for _ in due)
+    with _transcode_conn() as conn:
+        conn.execute(
+            f"""
+            UPDATE transcode_jobs SET last_interest_at = ?
+            WHERE id IN ({placeholders}) AND status IN ('queued', 'running')
+            """,
+            (int(now), *due),
+        )
 
 
-def _spawn_background(task_id: str, fn, *args, **kwargs) -> bool:
-    with _background_lock:
-        if task_id in _background_tasks:
-            return False
-        _background_tasks.add(task_id)
+def _run_transcode_job(job: dict, owner: str) -> None:
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(max(1, TRANSCODE_JOB_LEASE_SECONDS // 3)):
+            try:
+                if not _renew_transcode_lease(job["id"], owner):
+                    app.logger.warning("transcode job %s lost its lease", job["id"])
+            except Exception as e:
+                app.logger.warning("transcode lease renewal failed for %s: %s", job["id"], e)
+
+    hb = threading.Thread(target=heartbeat, daemon=True)
+    hb.start()
+
+    error = None
+    cancelled = False
+    skipped = False
+    try:
+        if job.get("content_id"):
+            # Derive output keys from the identity the job was queued under, even if this process would sample
+            # a different one (e.g. the web worker fell back to a share-scoped id).
+            ident = (job["share_hash"], job["file_path"], int(job["size"] or 0), (job["modified"] or "").strip())
+            _remember_content_id(ident, str(job["content_id"]))
+        handler = _transcode_job_handlers()[job["kind"]]
+        handler(
+            share_hash=job["share_hash"],
+            file_path=job["file_path"],
+            size=int(job["size"] or 0),
+            modified=job["modified"],
+            progress=_transcode_progress_reporter(job["id"], owner),
+        )
+    except subprocess.TimeoutExpired:
+        error = "timeout"
+    except TranscodeCancelled as e:
+        error = f"cancelled: {e}"
+        cancelled = True
+    except TranscodeSkipped as e:
+        error = f"skipped: {e}"
+        skipped = True
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    finally:
+        stop.set()
+        hb.join(timeout=5)
+
+    if cancelled or skipped:
+        app.logger.info("transcode job %s %s", job["id"], error)
+    elif error:
+        app.logger.warning("transcode job %s failed (attempt %s): %s", job["id"], job.get("attempts"), error)
+    _finish_transcode_job(job, owner, error, cancelled=cancelled, skipped=skipped)
 
-    def runner():
+
+def _transcode_worker_loop(owner: str) -> None:
+    while True:
         try:
-            fn(*args, **kwargs)
+            job = _claim_transcode_job(owner)
         except Exception as e:
-            app.logger.warning("background task %s failed: %s", task_id, e)
-        finally:
-            with _background_lock:
-                _background_tasks.discard(task_id)
+            app.logger.warning("transcode worker %s failed to claim a job: %s", owner, e)
+            job = None
 
-    t = threading.Thread(target=runner, daemon=True)
-    t.start()
-    return True
+        if job is None:
+            try:
+                _prune_transcode_jobs()
+            except Exception as e:
+                app.logger.warning("transcode job pruning failed: %s", e)
+            try:
+                _sweep_proxy_cache()
+            except Exception as e:
+                app.logger.warning("proxy cache sweep failed: %s", e)
+            try:
+                _prefetch_popular_videos()
+            except Exception as e:
+                app.logger.warning("prefetch failed: %s", e)
+            _transcode_wakeup.wait(TRANSCODE_WORKER_POLL_SECONDS)
+            _transcode_wakeup.clear()
+            continue
+
+        try:
+            _run_transcode_job(job, owner)
+        except Exception as e:
+            app.logger.warning("transcode worker %s crashed on %s: %s", owner, job.get("id"), e)
+
+
+def _ensure_transcode_workers() -> None:
+    global _transcode_workers_pid
+
+    if TRANSCODE_WORKERS <= 0:
+        return
+
+    pid = os.getpid()
+    if _transcode_workers_pid == pid:
+        return
+
+    with _transcode_workers_lock:
+        if _transcode_workers_pid == pid:
+            return
+        for i in range(TRANSCODE_WORKERS):
+            owner = f"{socket.gethostname()}:{pid}:{i}"
+            threading.Thread(target=_transcode_worker_loop, args=(owner,), daemon=True).start()
+        _transcode_workers_pid = pid
+
+
+@app.before_request
+def _start_transcode_workers():
+    _ensure_transcode_workers()
+
+
+def _get_transcode_job_progress(job_ids: list[str]) -> dict | None:
+    """Progress of the first active (queued/running) job among `job_ids`, or None."""
+    with _transcode_conn() as conn:
+        for job_id in job_ids:
+            row = conn.execute(
+                "SELECT rowid, * FROM transcode_jobs WHERE id = ? AND status IN ('queued', 'running')",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                continue
+
+            result = {
+                "status": str(row["status"]),
+                "percent": None,
+                "speed": None,
+                "eta_seconds": None,
+                "queue_position": None,
+            }
+            if row["status"] == "queued":
+                ahead = conn.execute(
+                    """
+                    SELECT COUNT(*) AS count FROM transcode_jobs
+                    WHERE status = 'queued' AND (
+                        priority > ?
+                        OR (priority = ? AND (created_at < ? OR (created_at = ? AND rowid < ?)))
+                    )
+                    """,
+                    (row["priority"], row["priority"], row["created_at"], row["created_at"], row["rowid"]),
+                ).fetchone()
+                result["queue_position"] = int(ahead["count"] or 0) + 1
+                return result
+
+            duration = float(row["duration"] or 0)
+            done = float(row["progress_seconds"] or 0)
+            speed = float(row["speed"] or 0)
+            if duration > 0:
+                result["percent"] = round(min(100.0, max(0.0, done * 100.0 / duration)), 1)
+            if speed > 0:
+                result["speed"] = round(speed, 2)
+                if duration > 0:
+                    result["eta_seconds"] = int(max(0.0, duration - done) / speed)
+            return result
+    return None
+
+
+def _list_transcode_jobs(*, status: str | None = None, limit: int = 200) -> tuple[dict[str, int], list[dict]]:
+    limit = max(1, min(int(limit or 200), 2000))
+    with _transcode_conn() as conn:
+        depth = {s: 0 for s in TRANSCODE_JOB_STATUSES}
+        for row in conn.execute("SELECT status, COUNT(*) AS count FROM transcode_jobs GROUP BY status").fetchall():
+            depth[str(row["status"])] = int(row["count"] or 0)
+
+        if status:
+            rows = conn.execute(
+                "SELECT * FROM transcode_jobs WHERE status = ? ORDER BY updated_at DESC LIMIT ?",
+                (status, limit),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM transcode_jobs ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    return depth, [dict(row) for row in rows]
 
 
 @app.route("/api/share/<share_hash>/preview/<path:filename>")
@@ -1343,21 +4830,24 @@ def serve_preview(share_hash: str, filename: str):
                 # Generate thumbnail
                 src_url = f"{FILEBROWSER_PUBLIC_DL_API}/{source_hash}/{quote(safe, safe='/')}?inline=true"
 
+                # Prefer an embedded preview (no full decode); fall back to ffmpeg below.
+                if THUMB_EMBEDDED_ENABLED and _try_embedded_thumbnail(src_url=src_url, ext=ext, dst_path=cache_path):
+                    with open(cache_path, "rb") as f:
+                        return Response(f.read(), mimetype="image/jpeg")
+
                 with _thumb_sema:
-                    cmd = _ffmpeg_thumbnail_cmd(
-                        src_url=src_url, dst_path=cache_path, seek_seconds=(1 if is_video else None)
-                    )
+                    if is_video and _extract_video_poster(
+                        share_hash=source_hash, filename=safe, src_url=src_url, dst_path=cache_path
+                    ):
+                        with open(cache_path, "rb") as f:
+                            return Response(f.read(), mimetype="image/jpeg")
+
+                    # Full decode (images, or videos whose keyframes could not be decoded on their own).
+                    cmd = _ffmpeg_thumbnail_cmd(src_url=src_url, dst_path=cache_path, seek_seconds=(0 if is_video else None))
                     result = subprocess.run(
                         cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=THUMB_FFMPEG_TIMEOUT_SECONDS
                     )
 
-                    if result.returncode != 0 and is_video:
-                        # Fallback: try capturing frame 0
-                        cmd = _ffmpeg_thumbnail_cmd(src_url=src_url, dst_path=cache_path, seek_seconds=0)
-                        result = subprocess.run(
-                            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=THUMB_FFMPEG_TIMEOUT_SECONDS
-                        )
-
                 if result.returncode != 0:
                     app.logger.error("ffmpeg failed for %s: %s", safe, result.stderr.decode(errors="replace"))
                     return "Thumbnail generation failed", 500
@@ -1407,22 +4897,181 @@ def serve_proxy(share_hash: str, filename: str):
     if (not meta_path or not meta_path.startswith("/")) and name and safe != name:
         return "File not found", 404
 
-    size = int(meta.get("size") or 0)
-    modified = meta.get("modified") if isinstance(meta.get("modified"), str) else None
+    size = int(meta.get("size") or 0)
+    modified = meta.get("modified") if isinstance(meta.get("modified"), str) else None
+
+    cache_key = _proxy_cache_key(share_hash=source_hash, file_path=safe, size=size, modified=modified)
+    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
+    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+    if os.path.exists(output_path):
+        try:
+            _touch_cache_entries([(cache_key, "fast", source_hash, safe, output_path)])
+        except Exception as e:
+            app.logger.warning("Failed to record proxy cache access for %s: %s", safe, e)
+        return redirect(public_url, code=302)
+
+    original_ready = _stream_ready_original(safe, size)
+    if original_ready and original_ready["fast"]:
+        if meta_path and meta_path.startswith("/"):
+            return redirect(f"/api/public/dl/{source_hash}/{quote(safe, safe='/')}?inline=true", code=302)
+        return redirect(f"/api/public/file/{source_hash}?inline=true", code=302)
+
+    # Encoding happens in the transcode workers; this request only queues the job and answers right away,
+    # so a cold proxy never holds a gunicorn thread.
+    job_id = f"fast:{cache_key}"
+    hd_key = _hd_cache_key(share_hash=source_hash, file_path=safe, size=size, modified=modified)
+    job_ids = [job_id, _fast_hd_job_id(cache_key, hd_key)]
+    try:
+        job = _get_transcode_job_progress(job_ids)
+        if job is None:
+            queued = _enqueue_transcode_job(
+                job_id=job_id,
+                kind="fast",
+                share_hash=source_hash,
+                file_path=safe,
+                size=size,
+                modified=modified,
+            )
+            # Not re-queued: it failed recently (retried after TRANSCODE_JOB_RETRY_FAILED_AFTER_SECONDS).
+            if not queued and _transcode_job_statuses([job_id]).get(job_id) == "failed":
+                return "Proxy generation failed", 500
+        else:
+            _record_transcode_interest(job_ids)
+    except Exception as e:
+        app.logger.error("Error generating proxy for %s: %s", safe, e)
+        return "Internal Error", 500
+
+    if os.path.exists(output_path):
+        return redirect(public_url, code=302)
+    if PROXY_LIVE_ENABLED and job and job.get("status") == "running" and os.path.exists(_proxy_live_path(output_path)):
+        return redirect(f"/api/share/{share_hash}/proxy-live/{quote(safe, safe='/')}", code=302)
+    resp = Response("Proxy generation in progress", status=202)
+    resp.headers["Retry-After"] = "5"
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+def _follow_growing_file(path: str, done_path: str):
+    """Yield the bytes of `path` as it grows until `done_path` appears, the file is unlinked, or it stalls."""
+    with open(path, "rb") as f:
+        idle_since = time.time()
+        while True:
+            chunk = f.read(PROXY_LIVE_CHUNK_SIZE)
+            if chunk:
+                idle_since = time.time()
+                yield chunk
+                continue
+
+            # The writer is finished once the final file exists or the live file is gone; drain and stop.
+            if os.path.exists(done_path) or os.fstat(f.fileno()).st_nlink == 0:
+                rest = f.read()
+                if rest:
+                    yield rest
+                return
+            if time.time() - idle_since > PROXY_LIVE_IDLE_TIMEOUT_SECONDS:
+                return
+            time.sleep(0.25)
+
+
+@app.route("/api/share/<share_hash>/proxy-live/<path:filename>")
+def serve_proxy_live(share_hash: str, filename: str):
+    if not is_valid_share_hash(share_hash):
+        return "Invalid share hash", 400
+
+    source_hash = _resolve_share_hash(share_hash)
+
+    filename = filename or ""
+    safe = _safe_rel_path(filename)
+    if not safe:
+        return "Invalid filename", 400
+
+    ext = os.path.splitext(safe)[1].lstrip(".").lower()
+    if ext not in VIDEO_EXTS:
+        return "Unsupported proxy type", 415
+
+    meta = _fetch_public_share_json(source_hash, subpath="/" + safe)
+    if not meta or isinstance(meta.get("items"), list) or parse_bool(meta.get("isDir")):
+        return "File not found", 404
+
+    name = meta.get("name") if isinstance(meta.get("name"), str) else None
+    meta_path = meta.get("path") if isinstance(meta.get("path"), str) else None
+    if (not meta_path or not meta_path.startswith("/")) and name and safe != name:
+        return "File not found", 404
+
+    size = int(meta.get("size") or 0)
+    modified = meta.get("modified") if isinstance(meta.get("modified"), str) else None
+
+    cache_key = _proxy_cache_key(share_hash=source_hash, file_path=safe, size=size, modified=modified)
+    output_path = os.path.join(PROXY_CACHE_DIR, f"{cache_key}.mp4")
+    public_url = f"/api/proxy-cache/{cache_key}.mp4"
+    live_path = _proxy_live_path(output_path)
+
+    if os.path.exists(output_path):
+        return redirect(public_url, code=302)
+    if not PROXY_LIVE_ENABLED:
+        return "Live proxy disabled", 404
+
+    job_id = f"fast:{cache_key}"
+    hd_key = _hd_cache_key(share_hash=source_hash, file_path=safe, size=size, modified=modified)
+    job_ids = [job_id, _fast_hd_job_id(cache_key, hd_key)]
+
+    def encoding() -> bool:
+        # A `.live` file without a running job is left over from an interrupted encode and will not grow.
+        job = _get_transcode_job_progress(job_ids)
+        return bool(job and job.get("status") == "running" and os.path.exists(live_path))
+
+    try:
+        if _get_transcode_job_progress(job_ids) is None:
+            _enqueue_transcode_job(
+                job_id=job_id,
+                kind="fast",
+                share_hash=source_hash,
+                file_path=safe,
+                size=size,
+                modified=modified,
+            )
+        else:
+            _record_transcode_interest(job_ids)
+        deadline = time.time() + max(0.0, PROXY_LIVE_WAIT_SECONDS)
+        live = encoding()
+        while not live and not os.path.exists(output_path) and time.time() < deadline:
+            time.sleep(0.5)
+            live = encoding()
+    except Exception as e:
+        app.logger.error("Failed to start live proxy for %s: %s", safe, e)
+        return "Internal Error", 500
+
+    if os.path.exists(output_path):
+        return redirect(public_url, code=302)
+    if not live:
+        resp = Response("Proxy is queued", status=503)
+        resp.headers["Retry-After"] = "2"
+        return resp
+
+    try:
+        stream = _follow_growing_file(live_path, output_path)
+        first = next(stream, b"")
+    except FileNotFoundError:
+        # Finished between the checks above.
+        if os.path.exists(output_path):
+            return redirect(public_url, code=302)
+        return "File not found", 404
+
+    def generate():
+        if first:
+            yield first
+        for chunk in stream:
+            # Someone is watching the encode's output, so it must not be cancelled as abandoned.
+            try:
+                _record_transcode_interest(job_ids)
+            except Exception as e:
+                app.logger.warning("Failed to record live proxy interest for %s: %s", safe, e)
+            yield chunk
 
-    try:
-        _, _, public_url, _ = _ensure_fast_proxy_mp4(
-            share_hash=source_hash, file_path=safe, size=size, modified=modified
-        )
-        return redirect(public_url, code=302)
-    except subprocess.TimeoutExpired:
-        app.logger.error("ffmpeg proxy timed out for %s", safe)
-        return "Proxy generation timed out", 504
-    except RuntimeError:
-        return "Proxy generation failed", 500
-    except Exception as e:
-        app.logger.error("Error generating proxy for %s: %s", safe, e)
-        return "Internal Error", 500
+    resp = Response(stream_with_context(generate()), mimetype="video/mp4")
+    resp.headers["Cache-Control"] = "no-store"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @app.route("/api/share/<share_hash>/video-sources/<path:filename>", methods=["GET", "POST"])
@@ -1465,11 +5114,48 @@ def video_sources(share_hash: str, filename: str):
     proxy_ready = os.path.exists(proxy_path)
     proxy_size = os.path.getsize(proxy_path) if proxy_ready else None
 
+    preview_key = _preview_cache_key(share_hash=source_hash, file_path=safe, size=original_size, modified=modified)
+    preview_path = os.path.join(PROXY_CACHE_DIR, f"{preview_key}.mp4")
+    preview_ready = not proxy_ready and os.path.exists(preview_path)
+
     hd_key = _hd_cache_key(share_hash=source_hash, file_path=safe, size=original_size, modified=modified)
     hd_path = os.path.join(PROXY_CACHE_DIR, f"{hd_key}.mp4")
     hd_url = f"/api/proxy-cache/{hd_key}.mp4"
     hd_ready = os.path.exists(hd_path)
     hd_size = os.path.getsize(hd_path) if hd_ready else None
+    hd_entry = _get_cache_entry(hd_key) if hd_ready else None
+
+    hls_key = _hls_cache_key(share_hash=source_hash, file_path=safe, size=original_size, modified=modified)
+    hls_dir, hls_master_path, hls_url = _hls_paths(hls_key)
+    hls_ready = os.path.exists(hls_master_path)
+    hls_complete = _hls_is_complete(hls_dir)
+
+    try:
+        _touch_cache_entries(
+            [
+                (key, kind, source_hash, safe, path)
+                for key, kind, path, ready in (
+                    (proxy_key, "fast", proxy_path, proxy_ready),
+                    (preview_key, "preview", preview_path, preview_ready),
+                    (hd_key, "hd", hd_path, hd_ready),
+                    (hls_key, "hls", hls_dir, hls_complete),
+                )
+                if ready
+            ]
+        )
+    except Exception as e:
+        app.logger.warning("Failed to record proxy cache access for %s: %s", safe, e)
+
+    hd_strategy = hd_entry.get("strategy") if hd_entry else None
+    hd_strategy_reason = hd_entry.get("reason") if hd_entry else None
+
+    # An original that faststart already left as browser-friendly H.264 is served as-is instead of re-encoded.
+    original_ready = _stream_ready_original(safe, original_size) if not (proxy_ready and hd_ready) else None
+    if original_ready and not hd_ready:
+        hd_url, hd_ready, hd_size = original_url, True, original_size
+        hd_strategy, hd_strategy_reason = "original", original_ready["reason"]
+    if original_ready and original_ready["fast"] and not proxy_ready:
+        proxy_url, proxy_ready, proxy_size = original_url, True, original_size
 
     prepare_targets: set[str] = set()
     if request.method == "POST":
@@ -1491,26 +5177,114 @@ def video_sources(share_hash: str, filename: str):
     if request.method == "POST" and not prepare_targets:
         prepare_targets = {"hd"}
 
-    prepare_started = {"fast": False, "hd": False}
-    if "fast" in prepare_targets and not proxy_ready:
-        prepare_started["fast"] = _spawn_background(
-            f"fast:{proxy_key}",
-            _ensure_fast_proxy_mp4,
-            share_hash=source_hash,
-            file_path=safe,
-            size=original_size,
-            modified=modified,
-        )
+    prepare_started = {"fast": False, "preview": False, "hd": False, "hls": False}
+    fast_hd_job_id = _fast_hd_job_id(proxy_key, hd_key)
+    # Skip the clip when faststart already recorded the source as short; otherwise the job checks itself,
+    # and a job that found it too short stays `skipped` (and is not queued again).
+    recorded = _recorded_media_summary(safe, original_size) if PREVIEW_CLIP_ENABLED and not proxy_ready else None
+    preview_wanted = bool(
+        PREVIEW_CLIP_ENABLED
+        and not proxy_ready
+        and not preview_ready
+        and not (recorded and (recorded.get("duration") or 0) < PREVIEW_CLIP_MIN_SOURCE_SECONDS)
+        and _transcode_job_statuses([f"preview:{preview_key}"]).get(f"preview:{preview_key}") != "skipped"
+    )
+    try:
+        if "fast" in prepare_targets and preview_wanted:
+            prepare_started["preview"] = _enqueue_transcode_job(
+                job_id=f"preview:{preview_key}",
+                kind="preview",
+                share_hash=source_hash,
+                file_path=safe,
+                size=original_size,
+                modified=modified,
+                priority="preview",
+            )
+
+        combine = False
+        if "hd" in prepare_targets and not proxy_ready and not hd_ready:
+            statuses = _transcode_job_statuses([f"fast:{proxy_key}", fast_hd_job_id])
+            fast_status = statuses.get(f"fast:{proxy_key}")
+            # Both renditions wanted (now, or fast earlier and still waiting in the queue): decode the source once.
+            combine = statuses.get(fast_hd_job_id) in ("queued", "running") or (
+                fast_status == "queued" or ("fast" in prepare_targets and fast_status != "running")
+            )
+
+        if combine:
+            started = _enqueue_transcode_job(
+                job_id=fast_hd_job_id,
+                kind="fast+hd",
+                share_hash=source_hash,
+                file_path=safe,
+                size=original_size,
+                modified=modified,
+            )
+            prepare_started["fast"] = prepare_started["hd"] = started
+            _supersede_queued_transcode_jobs([f"fast:{proxy_key}", f"hd:{hd_key}"], by_job_id=fast_hd_job_id)
+        else:
+            if "fast" in prepare_targets and not proxy_ready:
+                prepare_started["fast"] = _enqueue_transcode_job(
+                    job_id=f"fast:{proxy_key}",
+                    kind="fast",
+                    share_hash=source_hash,
+                    file_path=safe,
+                    size=original_size,
+                    modified=modified,
+                )
+
+            if "hd" in prepare_targets and not hd_ready:
+                prepare_started["hd"] = _enqueue_transcode_job(
+                    job_id=f"hd:{hd_key}",
+                    kind="hd",
+                    share_hash=source_hash,
+                    file_path=safe,
+                    size=original_size,
+                    modified=modified,
+                )
+
+        if "hls" in prepare_targets and not hls_complete:
+            prepare_started["hls"] = _enqueue_transcode_job(
+                job_id=f"hls:{hls_key}",
+                kind="hls",
+                share_hash=source_hash,
+                file_path=safe,
+                size=original_size,
+                modified=modified,
+            )
+    except Exception as e:
+        app.logger.error("Failed to enqueue transcode jobs for %s: %s", safe, e)
 
-    if "hd" in prepare_targets and not hd_ready:
-        prepare_started["hd"] = _spawn_background(
-            f"hd:{hd_key}",
-            _ensure_hd_mp4,
-            share_hash=source_hash,
-            file_path=safe,
-            size=original_size,
-            modified=modified,
+    proxy_job = None
+    preview_job = None
+    hd_job = None
+    hls_job = None
+    try:
+        # This poll is the viewer's heartbeat: it keeps their pending jobs from being cancelled as abandoned.
+        _record_transcode_interest(
+            ([] if proxy_ready else [f"fast:{proxy_key}"])
+            + ([f"preview:{preview_key}"] if preview_wanted else [])
+            + ([] if hd_ready else [f"hd:{hd_key}"])
+            + ([] if proxy_ready and hd_ready else [fast_hd_job_id])
+            + ([] if hls_complete else [f"hls:{hls_key}"])
         )
+        if not proxy_ready:
+            proxy_job = _get_transcode_job_progress([f"fast:{proxy_key}", fast_hd_job_id])
+        if preview_wanted:
+            preview_job = _get_transcode_job_progress([f"preview:{preview_key}"])
+        if not hd_ready:
+            hd_job = _get_transcode_job_progress([f"hd:{hd_key}", fast_hd_job_id])
+        if not hls_complete:
+            hls_job = _get_transcode_job_progress([f"hls:{hls_key}"])
+    except Exception as e:
+        app.logger.warning("Failed to read transcode progress for %s: %s", safe, e)
+
+    # A leftover `.live` file from an interrupted encode is not growing; only advertise it while the job runs.
+    proxy_live = bool(
+        PROXY_LIVE_ENABLED
+        and proxy_job
+        and proxy_job.get("status") == "running"
+        and os.path.exists(_proxy_live_path(proxy_path))
+    )
 
     resp = jsonify(
         {
@@ -1524,11 +5298,33 @@ def video_sources(share_hash: str, filename: str):
                 "url": proxy_url,
                 "ready": proxy_ready,
                 "size": proxy_size,
+                "live": proxy_live,
+                "live_url": f"/api/share/{share_hash}/proxy-live/{quote(safe, safe='/')}",
+                "job": proxy_job,
+            },
+            "preview": {
+                "url": f"/api/proxy-cache/{preview_key}.mp4",
+                "ready": preview_ready,
+                "duration": PREVIEW_CLIP_SECONDS,
+                "job": preview_job,
             },
             "hd": {
                 "url": hd_url,
                 "ready": hd_ready,
                 "size": hd_size,
+                "strategy": hd_strategy,
+                "strategy_reason": hd_strategy_reason,
+                "job": hd_job,
+            },
+            "hls": {
+                "url": hls_url,
+                "ready": hls_ready,
+                "complete": hls_complete,
+                "job": hls_job,
+            },
+            "poster": {
+                "url": f"/api/share/{share_hash}/preview/{quote(safe, safe='/')}",
+                "time": _get_poster_time(source_hash, safe),
             },
             "prepare": {
                 "requested": sorted(prepare_targets) if prepare_targets else [],
@@ -1644,6 +5440,753 @@ def share_video_meta(share_hash: str, filename: str):
     return resp
 
 
+# "Download All" ZIPs are built here instead of proxying FileBrowser's: entries are stored, not deflated
+# (shares are mostly already-compressed media), and each file is streamed from FileBrowser in large reads.
+ZIP_NATIVE_ENABLED = parse_bool(os.environ.get("DROPPR_ZIP_NATIVE_ENABLED", "true"))
+ZIP_STREAM_CHUNK_BYTES = int(os.environ.get("DROPPR_ZIP_STREAM_CHUNK_BYTES", str(1024 * 1024)))
+ZIP_SOURCE_TIMEOUT_SECONDS = int(os.environ.get("DROPPR_ZIP_SOURCE_TIMEOUT_SECONDS", "120"))
+# A Range request that would first have to read more than this from files with unknown CRCs (to fill in
+# descriptors or the central directory) gets the whole archive with 200 instead, so it never idles past
+# nginx's proxy_read_timeout before its first byte.
+ZIP_RANGE_CRC_READ_MAX_BYTES = int(os.environ.get("DROPPR_ZIP_RANGE_CRC_READ_MAX_BYTES", str(256 * 1024**2)))
+# Shares whose ZIP (for one listing) was requested more often than this get it built once into ZIP_CACHE_DIR by
+# the transcode worker; nginx then serves the file via X-Accel-Redirect (0 disables the cache).
+ZIP_CACHE_DIR = os.environ.get("DROPPR_ZIP_CACHE_DIR", "/tmp/zip-cache")
+os.makedirs(ZIP_CACHE_DIR, exist_ok=True)
+ZIP_CACHE_MIN_REQUESTS = int(os.environ.get("DROPPR_ZIP_CACHE_MIN_REQUESTS", "3"))
+ZIP_CACHE_MAX_BYTES = int(os.environ.get("DROPPR_ZIP_CACHE_MAX_BYTES", str(20 * 1024**3)))
+# ZIP builds are I/O, not encodes: they run under their own limit instead of TRANSCODE_MAX_RUNNING.
+ZIP_CACHE_MAX_BUILDS = int(os.environ.get("DROPPR_ZIP_CACHE_MAX_BUILDS", "1"))
+ZIP_SELECTION_MAX_FILES = int(os.environ.get("DROPPR_ZIP_SELECTION_MAX_FILES", "5000"))
+ZIP_CACHE_ACCEL_PREFIX = os.environ.get("DROPPR_ZIP_CACHE_ACCEL_PREFIX", "/internal/zip-cache/")
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP_FLAG_DESCRIPTOR = 0x08
+_ZIP_FLAG_UTF8 = 0x800
+_ZIP_DOS_EPOCH = (0, (1 << 5) | 1)  # 1980-01-01 00:00:00
+_ZIP_MODIFIED_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})")
+
+
+def _zip_dos_datetime(modified: str | None) -> tuple[int, int]:
+    """DOS (time, date) words for a FileBrowser `modified` timestamp (local wall-clock time, as ZIP expects)."""
+    m = _ZIP_MODIFIED_RE.match(modified or "")
+    if not m:
+        return _ZIP_DOS_EPOCH
+    year, month, day, hour, minute, second = (int(g) for g in m.groups())
+    if not 1980 <= year <= 2107:
+        return _ZIP_DOS_EPOCH
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _zip_entries(files: list[dict]) -> list[dict]:
+    """ZIP entry plan for a share listing: archive name, size and timestamp per file, in name order.
+
+    The archive is a pure function of this plan, so its length, ETag and byte offsets are known up front.
+    Items may override the archive name (`archive_name`), the revision that keys CRCs and the ETag
+    (`revision`, default `modified`), and where the bytes come from (`local_path` or in-memory `content`).
+    """
+    entries = []
+    seen: set[bytes] = set()
+    for item in files:
+        path = _safe_rel_path(item.get("path") or "")
+        name = _safe_rel_path(item.get("archive_name") or path)
+        if not path or not name or name.encode("utf-8") in seen:
+            continue
+        seen.add(name.encode("utf-8"))
+        modified = item.get("modified") if isinstance(item.get("modified"), str) else ""
+        dos_time, dos_date = _zip_dos_datetime(modified)
+        entry = {
+            "path": path,
+            "name": name.encode("utf-8"),
+            "size": int(item.get("size") or 0),
+            "modified": str(item.get("revision") or modified),
+            "dos_time": dos_time,
+            "dos_date": dos_date,
+        }
+        for source in ("local_path", "content"):
+            if item.get(source) is not None:
+                entry[source] = item[source]
+        entries.append(entry)
+    entries.sort(key=lambda entry: entry["name"])
+    return entries
+
+
+def _zip_etag(source_hash: str, entries: list[dict], total: int) -> tuple[str, int]:
+    """ETag of the archive and the pseudo mtime it encodes, in nginx's static-file format `"<mtime>-<size>"`.
+
+    A cached artifact is stamped with that mtime, so nginx serving it reports the same ETag as the streaming
+    path and honours `If-Range` from downloads that started on either.
+    """
+    digest = hashlib.sha256(f"zip-v1:{source_hash}".encode())
+    for entry in entries:
+        digest.update(b"\0" + entry["name"] + f"\0{entry['size']}\0{entry['modified']}".encode())
+    mtime = 1_000_000_000 + int(digest.hexdigest()[:7], 16)
+    return f'"{mtime:x}-{total:x}"', mtime
+
+
+def _zip_layout(entries: list[dict]) -> dict:
+    """Byte offsets of every part of the archive: per entry header/data/descriptor, then the central directory."""
+    offset = 0
+    parts = []
+    cd_size = 0
+    for entry in entries:
+        zip64 = entry["size"] >= _ZIP64_LIMIT
+        header_len = len(_zip_local_header(entry, zip64=zip64))
+        descriptor_len = 24 if zip64 else 16
+        parts.append({"offset": offset, "zip64": zip64, "data_offset": offset + header_len})
+        cd_size += len(
+            _zip_central_header(entry, crc=0, size=entry["size"], offset=offset, flags=_ZIP_FLAG_DESCRIPTOR)
+        )
+        offset += header_len + entry["size"] + descriptor_len
+    end_len = len(_zip_end_records(count=len(entries), cd_offset=offset, cd_size=cd_size))
+    return {"parts": parts, "cd_offset": offset, "cd_size": cd_size, "total": offset + cd_size + end_len}
+
+
+def _get_zip_crcs(source_hash: str, entries: list[dict]) -> list[int | None]:
+    """CRC-32 per entry, where known: in-memory content, or recorded by an earlier download of the same revision."""
+    crcs: list[int | None] = [zlib.crc32(entry["content"]) if "content" in entry else None for entry in entries]
+    try:
+        with _transcode_conn() as conn:
+            for i, entry in enumerate(entries):
+                # Without a modification time a recorded CRC cannot be told apart from a replaced file's.
+                if crcs[i] is not None or not entry.get("modified"):
+                    continue
+                row = conn.execute(
+                    """
+                    SELECT crc32 FROM zip_file_crcs
+                    WHERE share_hash = ? AND file_path = ? AND size = ? AND modified = ?
+                    """,
+                    (source_hash, entry["path"], entry["size"], entry["modified"]),
+                ).fetchone()
+                if row:
+                    crcs[i] = int(row["crc32"])
+    except Exception as e:
+        app.logger.warning("Failed to read ZIP CRC cache for %s: %s", source_hash, e)
+    return crcs
+
+
+def _record_zip_crc(source_hash: str, entry: dict, crc: int) -> None:
+    if not entry.get("modified"):
+        return
+    try:
+        with _transcode_conn() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO zip_file_crcs (share_hash, file_path, size, modified, crc32, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (source_hash, entry["path"], entry["size"], entry["modified"], crc, int(time.time())),
+            )
+    except Exception as e:
+        app.logger.warning("Failed to record ZIP CRC for %s/%s: %s", source_hash, entry["path"], e)
+
+
+def _parse_byte_range(header: str | None, total: int) -> tuple[int, int] | None:
+    """`(start, end)` (inclusive) for a single `bytes=` range; None for no/multi/invalid ranges (send it all).
+
+    Raises ValueError when the range is well-formed but starts past the end.
+    """
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        length = int(m.group(2))
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, total - length), total - 1
+    start = int(m.group(1))
+    if start >= total:
+        raise ValueError("range starts past the end")
+    end = int(m.group(2)) if m.group(2) else total - 1
+    if end < start:
+        return None
+    return start, min(end, total - 1)
+
+
+def _zip_local_header(entry: dict, *, zip64: bool) -> bytes:
+    # CRC and sizes follow the data in a descriptor, so nothing has to be read ahead of time.
+    extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if zip64 else b""
+    return struct.pack(
+        "<IHHHHHIIIHH",
+        0x04034B50,
+        45 if zip64 else 20,
+        _ZIP_FLAG_DESCRIPTOR | _ZIP_FLAG_UTF8,
+        0,
+        entry["dos_time"],
+        entry["dos_date"],
+        0,
+        _ZIP64_LIMIT if zip64 else 0,
+        _ZIP64_LIMIT if zip64 else 0,
+        len(entry["name"]),
+        len(extra),
+    ) + entry["name"] + extra
+
+
+def _zip_data_descriptor(crc: int, size: int, *, zip64: bool) -> bytes:
+    if zip64:
+        return struct.pack("<IIQQ", 0x08074B50, crc, size, size)
+    return struct.pack("<IIII", 0x08074B50, crc, size, size)
+
+
+def _zip_central_header(entry: dict, *, crc: int, size: int, offset: int, flags: int) -> bytes:
+    zip64_fields = [value for value in (size, size) if value >= _ZIP64_LIMIT]
+    if offset >= _ZIP64_LIMIT:
+        zip64_fields.append(offset)
+    extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b""
+    version = 45 if zip64_fields else 20
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII",
+        0x02014B50,
+        (3 << 8) | version,  # made by: Unix, so the external attributes below carry file permissions
+        version,
+        flags,
+        0,
+        entry["dos_time"],
+        entry["dos_date"],
+        crc,
+        min(size, _ZIP64_LIMIT),
+        min(size, _ZIP64_LIMIT),
+        len(entry["name"]),
+        len(extra),
+        0,
+        0,
+        0,
+        0o100644 << 16,
+        min(offset, _ZIP64_LIMIT),
+    ) + entry["name"] + extra
+
+
+def _zip_end_records(*, count: int, cd_offset: int, cd_size: int) -> bytes:
+    records = b""
+    if count >= 0xFFFF or cd_offset >= _ZIP64_LIMIT or cd_size >= _ZIP64_LIMIT:
+        zip64_eocd_offset = cd_offset + cd_size
+        records += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack("<IIQI", 0x07064B50, 0, zip64_eocd_offset, 1)
+    return records + struct.pack(
+        "<IHHHHIIH",
+        0x06054B50,
+        0,
+        0,
+        min(count, 0xFFFF),
+        min(count, 0xFFFF),
+        min(cd_size, _ZIP64_LIMIT),
+        min(cd_offset, _ZIP64_LIMIT),
+        0,
+    )
+
+
+def _zip_entry_chunks(source_hash: str, entry: dict, offset: int, length: int | None, chunk_bytes: int):
+    """Open an entry's bytes at `offset` (`length` None: to the end) from memory, a local file or FileBrowser.
+
+    Returns `(actual_offset, chunks)`; FileBrowser may ignore the range and start from 0.
+    """
+    stop = None if length is None else offset + length
+
+    if "content" in entry:
+        return offset, iter([entry["content"][offset:stop]])
+
+    if entry.get("local_path"):
+        f = open(entry["local_path"], "rb")
+        f.seek(offset)
+
+        def read_local():
+            with f:
+                remaining = length
+                while remaining is None or remaining > 0:
+                    data = f.read(chunk_bytes if remaining is None else min(chunk_bytes, remaining))
+                    if not data:
+                        return
+                    if remaining is not None:
+                        remaining -= len(data)
+                    yield data
+
+        return offset, read_local()
+
+    url = f"{FILEBROWSER_PUBLIC_DL_API}/{source_hash}/{quote(entry['path'], safe='/')}?inline=true"
+    headers = {}
+    if offset or stop is not None:
+        headers["Range"] = f"bytes={offset}-{'' if stop is None else stop - 1}"
+    resp = requests.get(url, headers=headers, stream=True, timeout=ZIP_SOURCE_TIMEOUT_SECONDS)
+    if resp.status_code not in (200, 206):
+        resp.close()
+        raise RuntimeError(f"{entry['path']} unavailable for share ZIP {source_hash}: HTTP {resp.status_code}")
+
+    def read_remote():
+        with resp:
+            yield from resp.iter_content(chunk_size=chunk_bytes)
+
+    # A 200 means no range support upstream: the caller reads from the top and discards the head.
+    return (offset if resp.status_code == 206 else 0), read_remote()
+
+
+def _zip_range_crc_read_bytes(entries: list[dict], layout: dict, crcs: list[int | None], start: int, end: int) -> int:
+    """Bytes `_iter_share_zip` reads outside `start..end` (inclusive) only to compute missing CRCs."""
+    need_all_crcs = end >= layout["cd_offset"]
+    extra = 0
+    for i, (entry, part) in enumerate(zip(entries, layout["parts"])):
+        if part["offset"] > end:
+            break
+        if crcs[i] is not None or entry["size"] == 0:
+            continue
+        data_start = part["data_offset"]
+        descriptor_offset = data_start + entry["size"]
+        descriptor_wanted = start < descriptor_offset + (24 if part["zip64"] else 16) and end >= descriptor_offset
+        if descriptor_wanted or need_all_crcs:
+            overlap = max(0, min(end + 1, descriptor_offset) - max(start, data_start))
+            extra += entry["size"] - overlap
+    return extra
+
+
+def _iter_share_zip(source_hash: str, entries: list[dict], *, start: int = 0, end: int | None = None):
+    """Yield bytes `start..end` (inclusive) of the share ZIP for `entries`, flushed in ZIP_STREAM_CHUNK_BYTES pieces.
+
+    Only the slice of each file inside the range is read, except for a file whose CRC is still unknown and is
+    needed for a descriptor/directory inside the range, which is read whole. A file that no longer matches its
+    listed size (or is gone) aborts the stream: the length was promised.
+    """
+    layout = _zip_layout(entries)
+    if end is None:
+        end = layout["total"] - 1
+    chunk_bytes = max(64 * 1024, ZIP_STREAM_CHUNK_BYTES)
+    crcs = _get_zip_crcs(source_hash, entries)
+    need_all_crcs = end >= layout["cd_offset"]
+    buf = bytearray()
+
+    def clip(offset: int, blob: bytes) -> bytes:
+        lo = max(start, offset)
+        hi = min(end + 1, offset + len(blob))
+        return blob[lo - offset : hi - offset] if lo < hi else b""
+
+    for i, (entry, part) in enumerate(zip(entries, layout["parts"])):
+        zip64 = part["zip64"]
+        data_start = part["data_offset"]
+        data_end = data_start + entry["size"]  # exclusive
+        descriptor_offset = data_end
+        if part["offset"] > end:
+            break
+        if entry["size"] == 0:
+            crcs[i] = 0
+        buf += clip(part["offset"], _zip_local_header(entry, zip64=zip64))
+
+        want_lo = max(start, data_start)
+        want_hi = min(end + 1, data_end)
+        descriptor_wanted = start < descriptor_offset + (24 if zip64 else 16) and end >= descriptor_offset
+        crc_needed = (descriptor_wanted or need_all_crcs) and crcs[i] is None
+        if want_lo < want_hi or crc_needed:
+            if crc_needed:
+                read_from, chunks = _zip_entry_chunks(source_hash, entry, 0, None, chunk_bytes)
+            else:
+                read_from, chunks = _zip_entry_chunks(
+                    source_hash, entry, want_lo - data_start, want_hi - want_lo, chunk_bytes
+                )
+
+            crc = 0
+            pos = data_start + read_from
+            for data in chunks:
+                if not data:
+                    continue
+                if crc_needed:
+                    crc = zlib.crc32(data, crc)
+                piece = clip(pos, data) if pos < want_hi else b""
+                pos += len(data)
+                if piece:
+                    buf += piece
+                    if len(buf) >= chunk_bytes:
+                        yield bytes(buf)
+                        buf.clear()
+                if not crc_needed and pos >= want_hi:
+                    break
+            if hasattr(chunks, "close"):
+                chunks.close()
+            if pos != (data_end if crc_needed else want_hi):
+                raise RuntimeError(f"{entry['path']} no longer matches its listed size in share ZIP {source_hash}")
+            if crc_needed:
+                crcs[i] = crc
+                _record_zip_crc(source_hash, entry, crc)
+
+        if descriptor_wanted:
+            buf += clip(descriptor_offset, _zip_data_descriptor(crcs[i], entry["size"], zip64=zip64))
+        if len(buf) >= chunk_bytes:
+            yield bytes(buf)
+            buf.clear()
+
+    if need_all_crcs:
+        offset = layout["cd_offset"]
+        for i, (entry, part) in enumerate(zip(entries, layout["parts"])):
+            record = _zip_central_header(
+                entry,
+                crc=crcs[i],
+                size=entry["size"],
+                offset=part["offset"],
+                flags=_ZIP_FLAG_DESCRIPTOR | _ZIP_FLAG_UTF8,
+            )
+            buf += clip(offset, record)
+            offset += len(record)
+        buf += clip(offset, _zip_end_records(count=len(entries), cd_offset=layout["cd_offset"], cd_size=layout["cd_size"]))
+    if buf:
+        yield bytes(buf)
+
+
+def _zip_download_name(share_hash: str, root: dict | None) -> str:
+    name = root.get("name") if isinstance(root, dict) and isinstance(root.get("name"), str) else ""
+    name = re.sub(r'[\x00-\x1f"\\/]', "_", name).strip() or f"share_{share_hash}"
+    return f"{name}.zip"
+
+
+def _attachment_disposition(filename: str) -> str:
+    ascii_name = filename.encode("ascii", "replace").decode("ascii").replace("?", "_")
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _zip_artifact_path(source_hash: str, mtime: int, total: int) -> str:
+    return os.path.join(ZIP_CACHE_DIR, f"{source_hash}-{mtime:x}-{total:x}.zip")
+
+
+def _zip_artifact_share(name: str) -> str:
+    # Share hashes may contain "-", so split the `-<mtime>-<size>.zip` suffix off from the right.
+    return name[: -len(".zip")].rsplit("-", 2)[0]
+
+
+def _note_zip_request(source_hash: str, etag: str, *, counted: bool) -> int:
+    """Count a ZIP request for this listing (if `counted`), refresh its last access; returns the request count."""
+    now = int(time.time())
+    with _transcode_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO zip_artifacts (share_hash, etag, requests, last_access_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(share_hash, etag) DO UPDATE SET
+                requests = requests + excluded.requests,
+                last_access_at = excluded.last_access_at
+            """,
+            (source_hash, etag, 1 if counted else 0, now),
+        )
+        row = conn.execute(
+            "SELECT requests FROM zip_artifacts WHERE share_hash = ? AND etag = ?", (source_hash, etag)
+        ).fetchone()
+    return int(row["requests"] or 0)
+
+
+def _build_share_zip_artifact(
+    *,
+    share_hash: str,
+    file_path: str = "",
+    size: int = 0,
+    modified: str | None = None,
+    progress=None,
+) -> str | None:
+    """Transcode-queue handler (kind "zip"): write the share's current ZIP into ZIP_CACHE_DIR.
+
+    Takes the usual job arguments; only `share_hash` matters; the listing is re-read, so a share that changed
+    since the job was queued gets an artifact for its new contents.
+    """
+    files = _get_share_files(
+        share_hash, source_hash=share_hash, force_refresh=False, max_age_seconds=DEFAULT_CACHE_TTL_SECONDS
+    )
+    if not files:
+        return None
+    entries = _zip_entries(files)
+    total = _zip_layout(entries)["total"]
+    etag, mtime = _zip_etag(share_hash, entries, total)
+    if total > ZIP_CACHE_MAX_BYTES:
+        app.logger.info("Share ZIP %s is %s bytes, over DROPPR_ZIP_CACHE_MAX_BYTES; not caching", share_hash, total)
+        return None
+
+    output_path = _zip_artifact_path(share_hash, mtime, total)
+    with open(output_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.exists(output_path):
+            tmp_path = output_path + ".tmp"
+            written = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in _iter_share_zip(share_hash, entries):
+                        f.write(chunk)
+                        written += len(chunk)
+                        if progress is not None:
+                            progress(float(written), float(total), None)
+                if written != total:
+                    raise RuntimeError(f"wrote {written} of {total} bytes")
+                os.utime(tmp_path, (mtime, mtime))
+                os.replace(tmp_path, output_path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    now = int(time.time())
+    with _transcode_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO zip_artifacts (share_hash, etag, requests, size, built_at, last_access_at)
+            VALUES (?, ?, 0, ?, ?, ?)
+            ON CONFLICT(share_hash, etag) DO UPDATE SET size = excluded.size, built_at = excluded.built_at
+            """,
+            (share_hash, etag, total, now, now),
+        )
+        # Earlier listings of this share are superseded.
+        conn.execute("DELETE FROM zip_artifacts WHERE share_hash = ? AND etag != ?", (share_hash, etag))
+    for name in os.listdir(ZIP_CACHE_DIR):
+        path = os.path.join(ZIP_CACHE_DIR, name)
+        if name.endswith(".zip") and _zip_artifact_share(name) == share_hash and path != output_path:
+            _remove_cache_path(path)
+    return output_path
+
+
+def _sweep_zip_cache(now: float, expired: set[str]) -> dict:
+    """Drop artifacts of expired shares, leftover temp files, stale counters and CRCs, then enforce the ZIP quota."""
+    report = {"removed": 0, "evicted": 0, "bytes_freed": 0}
+    try:
+        names = os.listdir(ZIP_CACHE_DIR)
+    except FileNotFoundError:
+        return report
+
+    with _transcode_conn() as conn:
+        rows = {
+            (str(row["share_hash"]), str(row["etag"])): dict(row)
+            for row in conn.execute("SELECT * FROM zip_artifacts")
+        }
+
+    artifacts: dict[str, dict] = {}
+    for name in names:
+        path = os.path.join(ZIP_CACHE_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if name.endswith((".zip.tmp", ".zip.lock")):
+            # Artifacts carry a pseudo mtime, but temp and lock files keep their real one.
+            lock_path = path if name.endswith(".lock") else path[: -len(".tmp")] + ".lock"
+            if now - mtime > PROXY_CACHE_ORPHAN_SECONDS and _lock_is_free(lock_path):
+                report["bytes_freed"] += _remove_cache_path(path)
+                report["removed"] += 1
+        elif name.endswith(".zip"):
+            artifacts[path] = {"share_hash": _zip_artifact_share(name), "size": os.path.getsize(path)}
+
+    def last_used(path: str) -> float:
+        info = artifacts[path]
+        used = [
+            float(row.get("last_access_at") or 0)
+            for (share_hash, _), row in rows.items()
+            if share_hash == info["share_hash"] and row.get("built_at") is not None
+        ]
+        return max(used, default=0.0)
+
+    for path in list(artifacts):
+        if artifacts[path]["share_hash"] in expired:
+            report["bytes_freed"] += _remove_cache_path(path)
+            report["removed"] += 1
+            del artifacts[path]
+
+    total = sum(info["size"] for info in artifacts.values())
+    if total > ZIP_CACHE_MAX_BYTES:
+        for path in sorted(artifacts, key=last_used):
+            if total <= ZIP_CACHE_MAX_BYTES:
+                break
+            size = artifacts.pop(path)["size"]
+            report["bytes_freed"] += _remove_cache_path(path)
+            report["evicted"] += 1
+            total -= size
+
+    live = {info["share_hash"] for info in artifacts.values()}
+    with _transcode_conn() as conn:
+        # Built rows whose file is gone start counting again; unbuilt counters fade after a week without use.
+        for (share_hash, etag), row in rows.items():
+            if row.get("built_at") is not None and share_hash not in live:
+                conn.execute("DELETE FROM zip_artifacts WHERE share_hash = ? AND etag = ?", (share_hash, etag))
+        conn.execute(
+            "DELETE FROM zip_artifacts WHERE built_at IS NULL AND last_access_at < ?", (int(now - 7 * 86400),)
+        )
+        # CRCs of replaced file versions and of expired shares can never be looked up again.
+        report["crcs_removed"] = conn.execute(
+            """
+            DELETE FROM zip_file_crcs
+            WHERE EXISTS (
+                SELECT 1 FROM zip_file_crcs AS newer
+                WHERE newer.share_hash = zip_file_crcs.share_hash
+                    AND newer.file_path = zip_file_crcs.file_path
+                    AND newer.created_at > zip_file_crcs.created_at
+            )
+            """
+        ).rowcount
+        for share_hash in expired:
+            report["crcs_removed"] += conn.execute(
+                "DELETE FROM zip_file_crcs WHERE share_hash = ?", (share_hash,)
+            ).rowcount
+    report["total_bytes"] = total
+    report["artifacts"] = len(artifacts)
+    return report
+
+
+_ZIP_FAST_PENDING_NOTE = "_compact-versions-pending.txt"
+
+
+def _fast_quality_items(source_hash: str, files: list[dict]) -> list[dict]:
+    """Listing for a compact ZIP: each video swapped for its fast proxy, photos and other files as they are.
+
+    Videos without a ready proxy are left out and queued for encoding, and a note in the archive lists them.
+    A video whose original already streams at fast quality is kept as is.
+    """
+    taken = {item["path"] for item in files}
+    items: list[dict] = []
+    pending: list[str] = []
+    touched: list[tuple[str, str, str, str, str]] = []
+    for item in files:
+        path = item["path"]
+        if os.path.splitext(path)[1].lstrip(".").lower() not in VIDEO_EXTS:
+            items.append(item)
+            continue
+
+        size = int(item.get("size") or 0)
+        modified = item.get("modified") if isinstance(item.get("modified"), str) else None
+        original_ready = _stream_ready_original(path, size)
+        if original_ready and original_ready["fast"]:
+            items.append(item)
+            continue
+
+        kwargs = {"share_hash": source_hash, "file_path": path, "size": size, "modified": modified}
+        proxy_key = _proxy_cache_key(**kwargs)
+        proxy_path = os.path.join(PROXY_CACHE_DIR, f"{proxy_key}.mp4")
+        try:
+            proxy_size = os.path.getsize(proxy_path)
+        except OSError:
+            pending.append(path)
+            try:
+                _enqueue_transcode_job(job_id=f"fast:{proxy_key}", kind="fast", priority="prewarm", **kwargs)
+            except Exception as e:
+                app.logger.warning("Failed to queue fast proxy for %s/%s: %s", source_hash, path, e)
+            continue
+
+        stem = os.path.splitext(path)[0]
+        name = f"{stem}.mp4"
+        if name != path and name in taken:
+            name = f"{stem}.fast.mp4"
+            n = 2
+            while name in taken:
+                name = f"{stem}.fast-{n}.mp4"
+                n += 1
+        taken.add(name)
+        items.append(
+            {
+                **item,
+                "archive_name": name,
+                "size": proxy_size,
+                "revision": f"{modified or ''}|fast:{proxy_key}",
+                "local_path": proxy_path,
+            }
+        )
+        touched.append((proxy_key, "fast", source_hash, path, proxy_path))
+
+    try:
+        _touch_cache_entries(touched)
+    except Exception as e:
+        app.logger.warning("Failed to record proxy cache access for %s: %s", source_hash, e)
+
+    if pending:
+        lines = [
+            "These videos are still being converted to the compact version and are not in this download.",
+            "Download again later to get them, or use the full-quality download.",
+            "",
+            *pending,
+        ]
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        items.append(
+            {
+                "path": _ZIP_FAST_PENDING_NOTE,
+                "size": len(content),
+                "revision": hashlib.sha256(content).hexdigest(),
+                "content": content,
+            }
+        )
+    return items
+
+
+def _share_zip_response(
+    share_hash: str, source_hash: str, entries: list[dict], filename: str, *, cacheable: bool = True
+) -> Response:
+    """Stream a share ZIP with an exact length and ETag, honouring single `Range` requests for resumes.
+
+    `cacheable` marks the whole-share archive, which may be served from (and counted toward) the artifact cache.
+    """
+    layout = _zip_layout(entries)
+    total = layout["total"]
+    etag, mtime = _zip_etag(source_hash, entries, total)
+    headers = {
+        "Content-Disposition": _attachment_disposition(filename),
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "no-store",
+    }
+
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or if_range.strip() == etag:
+        try:
+            byte_range = _parse_byte_range(request.headers.get("Range"), total)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{total}"
+            return Response(status=416, headers=headers)
+    if byte_range:
+        crc_read = _zip_range_crc_read_bytes(entries, layout, _get_zip_crcs(source_hash, entries), *byte_range)
+        if crc_read > ZIP_RANGE_CRC_READ_MAX_BYTES:
+            # Streaming from the top computes each CRC as its file goes out, with no silent read up front.
+            byte_range = None
+
+    start, end = byte_range or (0, total - 1)
+    counted = start == 0 and request.method != "HEAD"
+    if counted:
+        # Resumed requests continue a download that was already counted.
+        _log_event("zip_download", share_hash)
+
+    if cacheable and ZIP_CACHE_MIN_REQUESTS > 0:
+        artifact = _zip_artifact_path(source_hash, mtime, total)
+        try:
+            requests_seen = _note_zip_request(source_hash, etag, counted=counted)
+            if os.path.exists(artifact):
+                # nginx serves the prebuilt file, Range and ETag included; only the download headers pass on.
+                return Response(
+                    status=200,
+                    content_type="application/zip",
+                    headers={
+                        "Content-Disposition": headers["Content-Disposition"],
+                        "Cache-Control": headers["Cache-Control"],
+                        "X-Accel-Redirect": ZIP_CACHE_ACCEL_PREFIX + os.path.basename(artifact),
+                    },
+                )
+            if requests_seen > ZIP_CACHE_MIN_REQUESTS and total <= ZIP_CACHE_MAX_BYTES:
+                _enqueue_transcode_job(
+                    job_id=f"zip:{source_hash}",
+                    kind="zip",
+                    share_hash=source_hash,
+                    file_path="",
+                    size=total,
+                    modified=etag,
+                    priority="prewarm",
+                )
+        except Exception as e:
+            app.logger.warning("ZIP artifact cache unavailable for %s: %s", share_hash, e)
+
+    def stream():
+        try:
+            yield from _iter_share_zip(source_hash, entries, start=start, end=end)
+        except Exception as e:
+            # The promised length can no longer be met; cut the response short and re-list on the next try.
+            app.logger.error("Share ZIP for %s aborted: %s", share_hash, e)
+            with _share_cache_lock:
+                _share_files_cache.pop(share_hash, None)
+
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    return Response(
+        stream_with_context(stream()),
+        status=206 if byte_range else 200,
+        content_type="application/zip",
+        headers=headers,
+    )
+
+
 @app.route("/api/share/<share_hash>/download")
 def download_all(share_hash: str):
     if not is_valid_share_hash(share_hash):
@@ -1663,7 +6206,25 @@ def download_all(share_hash: str):
             return redirect(f"/api/public/file/{source_hash}?inline=true", code=302)
         return redirect(f"/api/public/file/{source_hash}", code=302)
 
-    # Folder share - stream ZIP through proxy (no range support needed for ZIP downloads)
+    if ZIP_NATIVE_ENABLED and data:
+        files = _get_share_files(
+            share_hash,
+            source_hash=source_hash,
+            force_refresh=False,
+            max_age_seconds=DEFAULT_CACHE_TTL_SECONDS,
+        )
+        if files is None:
+            return "Share not found", 404
+        filename = _zip_download_name(share_hash, data)
+        if (request.args.get("quality") or "").strip().lower() == "fast":
+            # Compact archive for offline viewing: built from the fast proxies, so never cached as the share ZIP.
+            items = _fast_quality_items(source_hash, files)
+            return _share_zip_response(
+                share_hash, source_hash, _zip_entries(items), filename[: -len(".zip")] + "-fast.zip", cacheable=False
+            )
+        return _share_zip_response(share_hash, source_hash, _zip_entries(files), filename)
+
+    # Folder share - stream FileBrowser's ZIP through proxy (no range support needed for ZIP downloads)
     try:
         req_url = f"{FILEBROWSER_PUBLIC_DL_API}/{source_hash}?download=1"
         req = requests.get(req_url, stream=True, timeout=120)
@@ -1678,7 +6239,7 @@ def download_all(share_hash: str):
             headers["Content-Disposition"] = f'attachment; filename="share_{share_hash}.zip"'
 
         return Response(
-            stream_with_context(req.iter_content(chunk_size=8192)),
+            stream_with_context(req.iter_content(chunk_size=max(64 * 1024, ZIP_STREAM_CHUNK_BYTES))),
             status=req.status_code,
             content_type=req.headers.get("Content-Type"),
             headers=headers,
@@ -1688,6 +6249,47 @@ def download_all(share_hash: str):
         return "Failed to download share", 500
 
 
+@app.route("/api/share/<share_hash>/download-selection", methods=["POST"])
+def download_selection(share_hash: str):
+    """ZIP of just the posted paths (JSON `{"paths": [...]}` or repeated `paths` form fields)."""
+    if not is_valid_share_hash(share_hash):
+        return jsonify({"error": "Invalid share hash"}), 400
+
+    source_hash = _resolve_share_hash(share_hash)
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        raw_paths = payload.get("paths")
+    else:
+        # Plain form posts let the browser save the response as a download.
+        raw_paths = request.form.getlist("paths")
+    if not isinstance(raw_paths, list) or not raw_paths:
+        return jsonify({"error": "Missing paths"}), 400
+    if len(raw_paths) > ZIP_SELECTION_MAX_FILES:
+        return jsonify({"error": f"At most {ZIP_SELECTION_MAX_FILES} files per selection"}), 400
+
+    files = _get_share_files(
+        share_hash,
+        source_hash=source_hash,
+        force_refresh=False,
+        max_age_seconds=DEFAULT_CACHE_TTL_SECONDS,
+    )
+    if files is None:
+        return jsonify({"error": "Share not found"}), 404
+
+    by_path = {item["path"]: item for item in files}
+    selected = []
+    for raw in raw_paths:
+        safe = _safe_rel_path(raw) if isinstance(raw, str) else None
+        if not safe or safe not in by_path:
+            return jsonify({"error": "Invalid path", "path": raw if isinstance(raw, str) else None}), 400
+        selected.append(by_path[safe])
+
+    root = _fetch_public_share_json(source_hash)
+    filename = _zip_download_name(share_hash, root)[: -len(".zip")] + "-selection.zip"
+    return _share_zip_response(share_hash, source_hash, _zip_entries(selected), filename, cacheable=False)
+
+
 @app.route("/api/droppr/shares/<share_hash>/expire", methods=["POST"])
 def droppr_update_share_expire(share_hash: str):
     if not is_valid_share_hash(share_hash):
@@ -1789,6 +6391,81 @@ def droppr_list_share_aliases():
     return resp
 
 
+@app.route("/api/droppr/transcode/jobs")
+def droppr_transcode_jobs():
+    token = _get_auth_token()
+    if not token:
+        return jsonify({"error": "Missing auth token"}), 401
+
+    try:
+        status = _validate_filebrowser_admin(token)
+    except Exception as e:
+        return jsonify({"error": f"Failed to validate auth: {e}"}), 502
+
+    if status is not None:
+        return jsonify({"error": "Unauthorized"}), status
+
+    status_filter = (request.args.get("status") or "").strip().lower() or None
+    if status_filter and status_filter not in TRANSCODE_JOB_STATUSES:
+        return jsonify({"error": "Invalid status"}), 400
+
+    limit = _parse_int(request.args.get("limit")) or 200
+    try:
+        depth, jobs = _list_transcode_jobs(status=status_filter, limit=limit)
+    except Exception as e:
+        app.logger.error("Failed to list transcode jobs: %s", e)
+        return jsonify({"error": "Failed to list transcode jobs"}), 500
+
+    resp = jsonify({"depth": depth, "jobs": jobs})
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@app.route("/api/droppr/proxy-cache", methods=["GET", "POST"])
+def droppr_proxy_cache():
+    token = _get_auth_token()
+    if not token:
+        return jsonify({"error": "Missing auth token"}), 401
+
+    try:
+        status = _validate_filebrowser_admin(token)
+    except Exception as e:
+        return jsonify({"error": f"Failed to validate auth: {e}"}), 502
+
+    if status is not None:
+        return jsonify({"error": "Unauthorized"}), status
+
+    try:
+        if request.method == "POST":
+            report = _sweep_proxy_cache(force=True)
+            if report is None:
+                return jsonify({"error": "A cache sweep is already running"}), 409
+        else:
+            report = _read_proxy_cache_report()
+
+        with _transcode_conn() as conn:
+            rows = conn.execute(
+                """
+                SELECT kind, COUNT(*) AS count, COALESCE(SUM(output_size), 0) AS bytes
+                FROM proxy_cache_entries GROUP BY kind
+                """
+            ).fetchall()
+    except Exception as e:
+        app.logger.error("Failed to read proxy cache state: %s", e)
+        return jsonify({"error": "Failed to read proxy cache state"}), 500
+
+    resp = jsonify(
+        {
+            "max_bytes": PROXY_CACHE_MAX_BYTES or None,
+            "indexed": {str(row["kind"]): {"count": int(row["count"]), "bytes": int(row["bytes"])} for row in rows},
+            "last_sweep": report,
+            "last_prefetch": _read_prefetch_report(),
+        }
+    )
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
 @app.route("/api/droppr/video-meta")
 def droppr_video_meta():
     token = _get_auth_token()
@@ -1917,45 +6594,54 @@ def analytics_shares():
 
     stats_by_hash: dict[str, dict] = {}
     total_unique_ips = 0
+    _ensure_analytics_writer()
     with _analytics_conn() as conn:
+        # One read transaction, so every query sees the same watermark even if the writer folds a batch meanwhile.
+        conn.execute("BEGIN")
+        # Read from the hourly/daily rollups; raw events only fill the partial hours at the range edges.
+        source, params = _analytics_rollup_source(conn, since, until)
         rows = conn.execute(
-            """
+            f"""
             SELECT
                 share_hash,
-                SUM(CASE WHEN event_type = 'gallery_view' THEN 1 ELSE 0 END) AS gallery_views,
-                SUM(CASE WHEN event_type = 'file_download' THEN 1 ELSE 0 END) AS file_downloads,
-                SUM(CASE WHEN event_type = 'zip_download' THEN 1 ELSE 0 END) AS zip_downloads,
-                COUNT(DISTINCT CASE WHEN event_type IN ('file_download', 'zip_download') THEN ip END) AS unique_ips,
-                MAX(created_at) AS last_seen,
-                MAX(CASE WHEN event_type IN ('file_download', 'zip_download') THEN created_at ELSE NULL END) AS last_download_at
-            FROM download_events
-            WHERE created_at >= ? AND created_at <= ?
+                SUM(CASE WHEN event_type = 'gallery_view' THEN events ELSE 0 END) AS gallery_views,
+                SUM(CASE WHEN event_type = 'file_download' THEN events ELSE 0 END) AS file_downloads,
+                SUM(CASE WHEN event_type = 'zip_download' THEN events ELSE 0 END) AS zip_downloads,
+                MAX(last_at) AS last_seen,
+                MAX(CASE WHEN event_type IN {_ANALYTICS_DOWNLOAD_TYPES_SQL} THEN last_at ELSE NULL END) AS last_download_at
+            FROM ({source})
             GROUP BY share_hash
             """,
-            (since, until),
+            params,
         ).fetchall()
 
+        ip_source, ip_params = _analytics_rollup_source(conn, since, until, ips=True)
+        unique_ips_by_hash = {
+            str(row["share_hash"]): int(row["unique_ips"] or 0)
+            for row in conn.execute(
+                f"SELECT share_hash, COUNT(DISTINCT ip) AS unique_ips FROM ({ip_source}) GROUP BY share_hash",
+                ip_params,
+            ).fetchall()
+        }
+
         for row in rows:
-            stats_by_hash[str(row["share_hash"])] = {
+            share_hash = str(row["share_hash"])
+            stats_by_hash[share_hash] = {
                 "gallery_views": int(row["gallery_views"] or 0),
                 "file_downloads": int(row["file_downloads"] or 0),
                 "zip_downloads": int(row["zip_downloads"] or 0),
                 "downloads": int((row["file_downloads"] or 0) + (row["zip_downloads"] or 0)),
-                "unique_ips": int(row["unique_ips"] or 0),
+                "unique_ips": unique_ips_by_hash.get(share_hash, 0),
                 "last_seen": int(row["last_seen"] or 0) if row["last_seen"] else None,
                 "last_download_at": int(row["last_download_at"] or 0) if row["last_download_at"] else None,
             }
 
         total_unique_ips_row = conn.execute(
-            """
-            SELECT COUNT(DISTINCT ip) AS unique_ips
-            FROM download_events
-            WHERE created_at >= ? AND created_at <= ? AND ip IS NOT NULL AND event_type IN ('file_download', 'zip_download')
-            """,
-            (since, until),
+            f"SELECT COUNT(DISTINCT ip) AS unique_ips FROM ({ip_source})", ip_params
         ).fetchone()
         if total_unique_ips_row is not None:
             total_unique_ips = int(total_unique_ips_row["unique_ips"] or 0)
+        conn.execute("COMMIT")
 
     shares = []
     seen_hashes: set[str] = set()
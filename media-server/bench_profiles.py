@@ -0,0 +1,320 @@
+"""
+Encoding profile benchmark for Droppr's proxy/HD renditions.
+
+Runs the real `_ffmpeg_proxy_cmd` / `_ffmpeg_hd_transcode_cmd` builders from app.py
+over a directory of sample clips for every preset/CRF (and proxy size) combination,
+and measures encode fps, speed relative to real time, output bitrate and size, and
+SSIM/PSNR (plus VMAF when ffmpeg has libvmaf) against the source. Results are
+written as a JSON report and printed as a table, so settings can be picked per host
+CPU. The HD profile at a given preset/CRF is also a fair stand-in for the faststart
+re-encode (`DROPPR_FASTSTART_X264_PRESET` / `DROPPR_FASTSTART_X264_CRF`).
+
+Usage (inside the media-transcoder container, with clips mounted at /samples):
+    python bench_profiles.py /samples --profiles proxy,hd --presets veryfast,faster,medium \\
+        --proxy-crfs 26,28,30 --hd-crfs 18,20,22 --report /database/bench-report.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import app as media_app
+
+
+SAMPLE_EXTS = tuple(f".{ext}" for ext in sorted(media_app.VIDEO_EXTS))
+QUALITY_TIMEOUT_SECONDS = 3600
+
+
+def log(message: str) -> None:
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{now} droppr-bench: {message}", file=sys.stderr, flush=True)
+
+
+def _csv(value: str) -> list[str]:
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+
+def _find_samples(paths: list[str]) -> list[str]:
+    samples = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                samples += [os.path.join(root, name) for name in files if name.lower().endswith(SAMPLE_EXTS)]
+        elif os.path.isfile(path):
+            samples.append(path)
+    return sorted(samples)
+
+
+def _video_info(path: str) -> dict | None:
+    probe = media_app._probe_source(path)
+    if not probe:
+        return None
+    video = next((s for s in probe.get("streams") or [] if s.get("codec_type") == "video"), None)
+    if not video:
+        return None
+
+    duration = media_app._duration_from_probe(probe)
+    fps = None
+    num, _, den = str(video.get("avg_frame_rate") or "").partition("/")
+    try:
+        fps = float(num) / float(den or 1) if float(num) > 0 else None
+    except (ValueError, ZeroDivisionError):
+        fps = None
+    return {
+        "duration": duration,
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "frames": int(video["nb_frames"]) if str(video.get("nb_frames") or "").isdigit() else None,
+        "fps": fps,
+        "codec": video.get("codec_name"),
+    }
+
+
+def _ffmpeg_version() -> str | None:
+    result = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = result.stdout.decode(errors="replace").splitlines()
+    return lines[0] if lines else None
+
+
+def _has_libvmaf() -> bool:
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return b"libvmaf" in result.stdout
+
+
+def _quality_scores(*, encoded: str, source: str, width: int, height: int, vmaf: bool) -> dict:
+    """SSIM/PSNR (and VMAF) of `encoded` against `source` scaled to the encoded resolution."""
+    metrics = ["ssim", "psnr"] + (["libvmaf"] if vmaf else [])
+    n = len(metrics)
+    graph = (
+        f"[0:v]setpts=PTS-STARTPTS,format=yuv420p,split={n}" + "".join(f"[d{i}]" for i in range(n)) + ";"
+        f"[1:v]scale={width}:{height}:flags=bicubic,setpts=PTS-STARTPTS,format=yuv420p,split={n}"
+        + "".join(f"[r{i}]" for i in range(n))
+        + ";"
+        + ";".join(f"[d{i}][r{i}]{metric}" for i, metric in enumerate(metrics))
+    )
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-loglevel",
+        "info",
+        "-i",
+        encoded,
+        "-i",
+        source,
+        "-lavfi",
+        graph,
+        "-f",
+        "null",
+        "-",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=QUALITY_TIMEOUT_SECONDS)
+    stderr = result.stderr.decode(errors="replace")
+
+    scores: dict = {"ssim": None, "psnr": None, "vmaf": None}
+    match = re.search(r"SSIM .*All:([0-9.]+)", stderr)
+    if match:
+        scores["ssim"] = float(match.group(1))
+    match = re.search(r"PSNR .*average:([0-9.]+|inf)", stderr)
+    if match:
+        scores["psnr"] = float(match.group(1))
+    match = re.search(r"VMAF score[:=]\s*([0-9.]+)", stderr)
+    if match:
+        scores["vmaf"] = float(match.group(1))
+    if result.returncode != 0:
+        log(f"quality pass failed for {encoded}: {stderr.strip().splitlines()[-1:]}")
+    return scores
+
+
+def _combinations(args) -> list[dict]:
+    combos = []
+    for profile in _csv(args.profiles):
+        if profile == "proxy":
+            for dimension in [int(v) for v in _csv(args.proxy_dimensions)] or [media_app.PROXY_MAX_DIMENSION]:
+                for preset in _csv(args.presets) or [media_app.PROXY_H264_PRESET]:
+                    for crf in [int(v) for v in _csv(args.proxy_crfs)] or [media_app.PROXY_CRF]:
+                        combos.append({"profile": "proxy", "preset": preset, "crf": crf, "max_dimension": dimension})
+        elif profile == "hd":
+            for preset in _csv(args.presets) or [media_app.HD_H264_PRESET]:
+                for crf in [int(v) for v in _csv(args.hd_crfs)] or [media_app.HD_CRF]:
+                    combos.append(
+                        {"profile": "hd", "preset": preset, "crf": crf, "max_dimension": media_app.HD_MAX_DIMENSION}
+                    )
+        else:
+            raise SystemExit(f"unknown profile: {profile} (expected proxy or hd)")
+    return combos
+
+
+def _build_cmd(combo: dict, *, src: str, dst: str) -> tuple[list[str], int]:
+    """Point the app's profile settings at `combo` and return its real ffmpeg command and timeout."""
+    if combo["profile"] == "proxy":
+        media_app.PROXY_H264_PRESET = combo["preset"]
+        media_app.PROXY_CRF = combo["crf"]
+        media_app.PROXY_MAX_DIMENSION = combo["max_dimension"]
+        return media_app._ffmpeg_proxy_cmd(src_url=src, dst_path=dst), media_app.PROXY_FFMPEG_TIMEOUT_SECONDS
+
+    media_app.HD_H264_PRESET = combo["preset"]
+    media_app.HD_CRF = combo["crf"]
+    media_app.HD_MAX_DIMENSION = combo["max_dimension"]
+    return media_app._ffmpeg_hd_transcode_cmd(src_url=src, dst_path=dst), media_app.HD_FFMPEG_TIMEOUT_SECONDS
+
+
+def _bench_one(combo: dict, *, sample: str, info: dict, work_dir: str, vmaf: bool) -> dict:
+    dst = os.path.join(work_dir, "out.mp4")
+    cmd, timeout = _build_cmd(combo, src=sample, dst=dst)
+
+    row = dict(combo, sample=os.path.basename(sample), source_duration=info["duration"])
+    started = time.monotonic()
+    try:
+        result = media_app._run_ffmpeg(cmd, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return dict(row, error="timeout")
+    elapsed = time.monotonic() - started
+    if result.returncode != 0:
+        return dict(row, error=result.stderr.decode(errors="replace").strip()[-500:])
+
+    out = _video_info(dst) or {}
+    duration = info["duration"] or out.get("duration") or 0
+    frames = out.get("frames") or (round(duration * info["fps"]) if duration and info.get("fps") else None)
+    size = os.path.getsize(dst)
+    row.update(
+        {
+            "encode_seconds": round(elapsed, 3),
+            "fps": round(frames / elapsed, 2) if frames and elapsed > 0 else None,
+            "speed": round(duration / elapsed, 3) if duration and elapsed > 0 else None,
+            "output_size": size,
+            "bitrate_kbps": round(size * 8 / duration / 1000, 1) if duration else None,
+            "width": out.get("width"),
+            "height": out.get("height"),
+        }
+    )
+    if out.get("width") and out.get("height"):
+        row.update(
+            _quality_scores(encoded=dst, source=sample, width=out["width"], height=out["height"], vmaf=vmaf)
+        )
+    os.remove(dst)
+    return row
+
+
+def _mean(values: list) -> float | None:
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _summarize(rows: list[dict]) -> list[dict]:
+    """Average each combination over the corpus."""
+    groups: dict[tuple, list[dict]] = {}
+    for row in rows:
+        if row.get("error"):
+            continue
+        key = (row["profile"], row["preset"], row["crf"], row["max_dimension"])
+        groups.setdefault(key, []).append(row)
+
+    summary = []
+    for (profile, preset, crf, dimension), items in groups.items():
+        entry = {"profile": profile, "preset": preset, "crf": crf, "max_dimension": dimension, "samples": len(items)}
+        for field in ("fps", "speed", "bitrate_kbps", "ssim", "psnr", "vmaf"):
+            value = _mean([item.get(field) for item in items])
+            entry[field] = round(value, 4) if value is not None else None
+        entry["output_size"] = sum(item["output_size"] for item in items)
+        summary.append(entry)
+    summary.sort(key=lambda e: (e["profile"], -(e["speed"] or 0)))
+    return summary
+
+
+def _format_table(summary: list[dict]) -> str:
+    columns = [
+        "profile",
+        "preset",
+        "crf",
+        "max_dimension",
+        "fps",
+        "speed",
+        "bitrate_kbps",
+        "output_size",
+        "ssim",
+        "psnr",
+        "vmaf",
+    ]
+    lines = [" | ".join(columns), " | ".join("---" for _ in columns)]
+    for entry in summary:
+        lines.append(" | ".join("-" if entry.get(c) is None else str(entry[c]) for c in columns))
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark Droppr proxy/HD encoding profiles on sample clips.")
+    parser.add_argument("samples", nargs="+", help="sample clips or directories of clips")
+    parser.add_argument("--profiles", default="proxy,hd", help="comma-separated: proxy, hd")
+    parser.add_argument("--presets", default="", help="x264 presets (default: the configured one per profile)")
+    parser.add_argument("--proxy-crfs", default="", help="CRF values for the proxy profile")
+    parser.add_argument("--hd-crfs", default="", help="CRF values for the HD profile")
+    parser.add_argument("--proxy-dimensions", default="", help="max dimensions for the proxy profile")
+    parser.add_argument("--no-vmaf", action="store_true", help="skip VMAF even if ffmpeg has libvmaf")
+    parser.add_argument("--report", default="bench-report.json", help="where to write the JSON report")
+    args = parser.parse_args()
+
+    samples = _find_samples(args.samples)
+    if not samples:
+        log("no sample clips found")
+        return 1
+
+    infos = {}
+    for sample in samples:
+        info = _video_info(sample)
+        if info is None or not info["duration"]:
+            log(f"skipping {sample}: no video stream or duration")
+            continue
+        infos[sample] = info
+
+    combos = _combinations(args)
+    vmaf = not args.no_vmaf and _has_libvmaf()
+    log(f"{len(infos)} sample(s) x {len(combos)} combination(s); vmaf={'on' if vmaf else 'off'}")
+
+    rows = []
+    work_dir = tempfile.mkdtemp(prefix="droppr-bench-")
+    try:
+        for combo in combos:
+            for sample, info in infos.items():
+                row = _bench_one(combo, sample=sample, info=info, work_dir=work_dir, vmaf=vmaf)
+                rows.append(row)
+                log(
+                    f"{combo['profile']} preset={combo['preset']} crf={combo['crf']} "
+                    f"dim={combo['max_dimension']} {row['sample']}: "
+                    + (f"error {row['error'][:120]}" if row.get("error") else f"speed={row['speed']}x ssim={row.get('ssim')}")
+                )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = _summarize(rows)
+    report = {
+        "created_at": int(time.time()),
+        "host": {
+            "hostname": platform.node(),
+            "cpu_count": os.cpu_count(),
+            "processor": platform.processor() or platform.machine(),
+            "ffmpeg": _ffmpeg_version(),
+        },
+        "samples": {os.path.basename(path): info for path, info in infos.items()},
+        "summary": summary,
+        "results": rows,
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(_format_table(summary))
+    log(f"report written to {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
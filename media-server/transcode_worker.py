@@ -0,0 +1,86 @@
+"""
+Standalone transcode worker for Droppr.
+
+Runs the fast/HD/HLS transcode jobs from the shared SQLite queue outside of the
+gunicorn web workers, so heavy ffmpeg work never competes with request handling.
+The web processes only enqueue jobs and poll their status.
+
+Usage: python transcode_worker.py
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import app as media_app
+
+
+TRANSCODE_NICE = int(os.environ.get("DROPPR_TRANSCODE_NICE", "10"))
+# ionice class/level for this process and its ffmpeg children: "idle", "best-effort:<0-7>", or "" to leave as is.
+TRANSCODE_IONICE = (os.environ.get("DROPPR_TRANSCODE_IONICE", "best-effort:7") or "").strip().lower()
+
+
+def log(message: str) -> None:
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{now} droppr-transcoder: {message}", flush=True)
+
+
+def _apply_process_priority() -> None:
+    # Children inherit both settings, so every ffmpeg started by the job handlers runs deprioritized.
+    if TRANSCODE_NICE > 0:
+        try:
+            os.nice(TRANSCODE_NICE)
+        except OSError as e:
+            log(f"failed to set nice {TRANSCODE_NICE}: {e}")
+
+    if not TRANSCODE_IONICE:
+        return
+    ionice = shutil.which("ionice")
+    if not ionice:
+        log("ionice not found; skipping IO priority")
+        return
+
+    if TRANSCODE_IONICE == "idle":
+        args = ["-c", "3"]
+    else:
+        _, _, level = TRANSCODE_IONICE.partition(":")
+        args = ["-c", "2", "-n", level or "7"]
+
+    result = subprocess.run(
+        [ionice, *args, "-p", str(os.getpid())], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        log(f"ionice {TRANSCODE_IONICE} failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+def main() -> int:
+    if media_app.TRANSCODE_WORKERS <= 0:
+        log("DROPPR_TRANSCODE_WORKERS is 0; nothing to do")
+        return 1
+
+    _apply_process_priority()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    media_app._ensure_transcode_workers()
+    log(
+        f"started {media_app.TRANSCODE_WORKERS} worker(s); "
+        f"max running={media_app.TRANSCODE_MAX_RUNNING} nice={TRANSCODE_NICE} ionice={TRANSCODE_IONICE or 'unchanged'}"
+    )
+
+    # Worker threads are daemons; jobs interrupted here are re-claimed once their lease expires.
+    stop.wait()
+    log("stopping")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())